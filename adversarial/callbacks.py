@@ -7,7 +7,59 @@
 from keras.callbacks import Callback
 
 # Project import(s)
-# ...
+from adversarial.utils import save_checkpoint
+
+
+class CheckpointCallback (Callback):
+    """Periodically save training checkpoints, cf. `save_checkpoint`."""
+    def __init__ (self, basedir, name, stage, history, period=1):
+        """
+        Arguments:
+            basedir: Directory in which the checkpoints should be saved.
+            name: Name of the model, used in filenames.
+            stage: Name of the training stage, e.g. 'pretrain' or 'train'.
+            history: Dict of per-stage training histories, including those of
+                any resumed epochs, which is updated in-place.
+            period: Number of epochs between checkpoints.
+        """
+        super(CheckpointCallback, self).__init__()
+
+        # Member variable(s)
+        self.basedir = basedir
+        self.name    = name
+        self.stage   = stage
+        self.history = history
+        self.period  = period
+        self.epoch   = None
+        self.saved   = None
+        return
+
+    def save (self):
+        save_checkpoint(self.basedir, self.name, self.model, self.stage, self.epoch, self.history)
+        self.saved = self.epoch
+        return
+
+    def on_epoch_end (self, epoch, logs={}):
+        # Record history of the current stage
+        history = self.history.setdefault(self.stage, dict())
+        for key, value in logs.iteritems():
+            history.setdefault(key, []).append(float(value))
+            pass
+
+        self.epoch = epoch + 1
+        if self.epoch % self.period == 0:
+            self.save()
+            pass
+        return
+
+    def on_train_end (self, logs={}):
+        # Make sure the last epoch is checkpointed
+        if self.epoch is not None and self.saved != self.epoch:
+            self.save()
+            pass
+        return
+
+    pass
 
 
 class LossCallback (Callback):
@@ -45,7 +97,7 @@ class LossCallback (Callback):
 
 # @TODO:
 # - Implement `plot_*` methods, accommodating Pandas.DataFrame inputs.
-"""
+'''
 class PosteriorCallback (Callback):
     """Plot adversary posterior p.d.f. during training."""
     def __init__ (self, data, args, adversary):
@@ -76,4 +128,4 @@ class ProfilesCallback (Callback):
         plot_profiles(name='profiles_epoch_{:03d}'.format(epoch + 1), title="Epoch {}".format(epoch + 1), **self.opts)
         return
     pass
-"""
+'''
@@ -10,7 +10,7 @@ import time
 import inspect
 from inspect import currentframe, getframeinfo, getouterframes
 from functools import wraps
-import os,psutil
+import os
 
 
 class Profile:
@@ -89,6 +89,7 @@ class Profile:
         # Print summary        
         title = self.__title or "%s:L%d-%d" % (self.__filename, self.__startline, self.__endline)
         left  = self.prefix() + "Time elapsed in \033[1m{title}\033[0m: ".format(title=title)
+        import psutil
         mem=(psutil.Process(os.getpid()).memory_info().rss)/(1024*1024)
         right = '\033[1m{:.1f}s, {}MB\033[0m'.format(duration,mem)
         
@@ -1,5 +1,6 @@
 from .math import *
 from .misc import *
 from .setup import *
+from .storage import *
 from .metrics import *
 from .management import *
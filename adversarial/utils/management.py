@@ -8,7 +8,9 @@ import os
 import gc
 import json
 import gzip
+import shutil
 import pickle
+import hashlib
 import subprocess
 
 def garbage_collect (f):
@@ -168,6 +170,224 @@ def load (basedir, name, model=None):
     return model, history
 
 
+def save_scaler (basedir, name, scaler):
+    """Save the decorrelation scaling parameters alongside the model `name`.
+
+    Arguments:
+        basedir: Directory in which the scaler should be saved, cf. `save`. If a
+            list or tuple is specified, the scaler is saved to each directory.
+        name: Name of the associated model, used in filenames.
+        scaler: Dict of scaling parameters, cf. `fit_decorrelation_scaler`.
+    """
+
+    # Check(s)
+    if isinstance(basedir, (list, tuple)):
+        for d in basedir:
+            save_scaler(d, name, scaler)
+            pass
+        return
+
+    # Make sure output directory exists
+    mkdir(basedir)
+
+    with open(basedir + 'scaler__{}.json'.format(name), 'wb') as f:
+        json.dump(scaler, f)
+        pass
+    return
+
+
+def load_scaler (basedir, name):
+    """Load the decorrelation scaling parameters saved alongside model `name`.
+
+    Arguments:
+        basedir: Directory from which the scaler should be loaded.
+        name: Name of the associated model, used in filenames.
+
+    Returns:
+        Dict of scaling parameters, cf. `fit_decorrelation_scaler`.
+
+    Raises:
+        IOError: If the scaler file does not exist.
+    """
+
+    with open(basedir + 'scaler__{}.json'.format(name), 'r') as f:
+        scaler = json.load(f)
+        pass
+    return scaler
+
+
+def save_checkpoint (basedir, name, model, stage, epoch, history=None):
+    """Save a training checkpoint for model `name`, i.e. the model weights, the
+    optimizer state, and the training history, to be resumed from with
+    `restore_checkpoint`.
+
+    The weights and optimizer state are written to files unique to the `stage`
+    and `epoch`, and the checkpoint state file pointing to them is replaced
+    atomically, such that an interrupted save leaves the previous checkpoint
+    intact. The files of the previous checkpoint are then removed.
+
+    Arguments:
+        basedir: Directory in which the checkpoint should be saved.
+        name: Name of the model, used in filenames.
+        model: Compiled Keras model being trained.
+        stage: Name of the training stage, e.g. 'pretrain' or 'train'.
+        epoch: Number of epochs completed in `stage`.
+        history: Dict of per-stage training histories.
+    """
+
+    # Import(s)
+    import keras.backend as K
+
+    # Make sure output directory exists
+    mkdir(basedir)
+
+    # Get previous checkpoint, if any
+    previous = load_checkpoint(basedir, name)
+
+    # Save model weights and optimizer state
+    prefix = 'checkpoint__{}__{}{:04d}'.format(name, stage, epoch)
+    model.save_weights(basedir + prefix + '_weights.h5')
+    with open(basedir + prefix + '_optimizer.pkl', 'wb') as f:
+        pickle.dump(K.batch_get_value(model.optimizer.weights), f, pickle.HIGHEST_PROTOCOL)
+        pass
+
+    # Save checkpoint state
+    state = dict(stage=stage, epoch=epoch, prefix=prefix, history=history or dict())
+    path  = basedir + 'checkpoint__{}.json'.format(name)
+    with open(path + '.tmp', 'wb') as f:
+        json.dump(state, f)
+        pass
+    os.rename(path + '.tmp', path)
+
+    # Remove previous checkpoint files
+    if previous is not None and previous['prefix'] != prefix:
+        for suffix in ['_weights.h5', '_optimizer.pkl']:
+            if os.path.exists(basedir + previous['prefix'] + suffix):
+                os.remove(basedir + previous['prefix'] + suffix)
+                pass
+            pass
+        pass
+    return
+
+
+def load_checkpoint (basedir, name):
+    """Load the state of the last training checkpoint for model `name`.
+
+    Arguments:
+        basedir: Directory from which the checkpoint should be loaded.
+        name: Name of the model, used in filenames.
+
+    Returns:
+        Dict with the training `stage`, the number of completed `epoch`s in
+        that stage, the `prefix` of the checkpoint files, and the per-stage
+        training `history`; or `None` if no checkpoint exists.
+    """
+
+    path = basedir + 'checkpoint__{}.json'.format(name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        state = json.load(f)
+        pass
+    return state
+
+
+def restore_checkpoint (basedir, state, model):
+    """Restore the model weights and optimizer state from a training checkpoint.
+
+    Arguments:
+        basedir: Directory from which the checkpoint should be loaded.
+        state: Checkpoint state dict, cf. `load_checkpoint`.
+        model: Keras model, compiled as when the checkpoint was saved.
+    """
+
+    # Load model weights
+    model.load_weights(basedir + state['prefix'] + '_weights.h5')
+
+    # Load optimizer state. The optimizer weights are only created along with
+    # the training function, cf. `keras.models.load_model`.
+    with open(basedir + state['prefix'] + '_optimizer.pkl', 'rb') as f:
+        weights = pickle.load(f)
+        pass
+    model._make_train_function()
+    model.optimizer.set_weights(weights)
+    return
+
+
+def file_digest (path, quick=False, blocksize=2**20):
+    """Compute the digest of the contents of the file at `path`.
+
+    Arguments:
+        path: Path to the file.
+        quick: Whether to only hash the file size, modification time, and the
+            first and last `blocksize` bytes, e.g. for large datasets.
+        blocksize: Number of bytes to read at a time.
+
+    Returns:
+        Hexadecimal MD5 digest.
+
+    Raises:
+        IOError: If the file does not exist.
+    """
+
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        if quick:
+            stat = os.fstat(f.fileno())
+            md5.update('{}:{}'.format(stat.st_size, stat.st_mtime))
+            md5.update(f.read(blocksize))
+            f.seek(max(stat.st_size - blocksize, 0))
+            md5.update(f.read(blocksize))
+        else:
+            for block in iter(lambda: f.read(blocksize), b''):
+                md5.update(block)
+                pass
+            pass
+        pass
+    return md5.hexdigest()
+
+
+def get_cache_key (**inputs):
+    """Get the key of derived data in the content-addressed cache.
+
+    Arguments:
+        inputs: JSON-serialisable description of everything the derived data
+            depends on, e.g. file digests (cf. `file_digest`), lists of
+            variables, and configuration dicts.
+
+    Returns:
+        Hexadecimal MD5 digest of `inputs`.
+    """
+    return hashlib.md5(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+
+def get_cache_path (key, name, basedir='output/cache/', ext='.h5'):
+    """Get the path of derived data `name` with `key` in the cache."""
+    return basedir + '{}_{}{}'.format(name, key, ext)
+
+
+def link_cached (cached, path):
+    """Make `path` point to the cached file `cached`, replacing any existing file.
+
+    A relative symbolic link is used where supported; otherwise the file is
+    copied.
+    """
+
+    if os.path.lexists(path):
+        os.remove(path)
+        pass
+    dirname = os.path.dirname(path)
+    if dirname:
+        mkdir(dirname)
+        pass
+    try:
+        os.symlink(os.path.relpath(cached, dirname or '.'), path)
+    except (OSError, AttributeError):
+        shutil.copyfile(cached, path)
+        pass
+    return
+
+
 def lwtnn_save(model, name, basedir='models/adversarial/lwtnn/'):
     """Method for saving classifier in lwtnn-friendly format.
     See [https://github.com/lwtnn/lwtnn/wiki/Keras-Converter]
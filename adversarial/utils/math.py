@@ -5,10 +5,10 @@
 
 # Basic import(s)
 import numpy as np
-import pandas as pd
 
 # Project import(s)
-from .misc import belongs_to
+from .misc import belongs_to, lazy_import
+pd = lazy_import('pandas')
 
 
 def wmean (x, w):
@@ -2,8 +2,6 @@
 
 # Scientific import(s)
 import numpy as np
-from scipy.stats import entropy
-from sklearn.metrics import roc_curve
 from .setup import DECORRELATION_VARIABLES, WEIGHT_VARIABLES, DECORRELATION_VARIABLES_AUX,INPUT_VARIABLES
 PT=DECORRELATION_VARIABLES_AUX[0]
 MASS=DECORRELATION_VARIABLES[0]
@@ -34,6 +32,7 @@ def JSD (P, Q, base=2):
     Returns:
         Jensen-Shannon divergence of `P` and `Q`.
     """
+    from scipy.stats import entropy
     if np.sum(P)==0 or np.sum(Q)==0 :
         print "Error! JSD input is all 0"
     p = P / np.sum(P)
@@ -62,6 +61,7 @@ def metrics (data, feat, target_tpr=0.5, cut=None, masscut=False, verbose=False)
         Tuple of (background rejection at `target_tpr`, JSD for background mass
         distributions at `target_tpr`).
     """
+    from sklearn.metrics import roc_curve
     print "metrics calu started..."
     # Background rejection at `target_tpr` signal efficiency
     # ------------------------------------------------------
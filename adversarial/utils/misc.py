@@ -5,6 +5,71 @@
 
 # Basic import(s)
 import re
+import importlib
+
+
+class LazyModule (object):
+    """
+    Proxy for a module which is only imported on first attribute access, such
+    that heavy dependencies do not add to the start-up time of scripts which
+    never use them, cf. `lazy_import`.
+    """
+
+    def __init__ (self, name, on_import=None):
+        self.__dict__['_name']      = name
+        self.__dict__['_module']    = None
+        self.__dict__['_on_import'] = on_import
+        pass
+
+    def _load (self):
+        if self.__dict__['_module'] is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            if self.__dict__['_on_import'] is not None:
+                self.__dict__['_on_import'](module)
+                pass
+            self.__dict__['_module'] = module
+            pass
+        return self.__dict__['_module']
+
+    def __getattr__ (self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__ (self, attr, value):
+        setattr(self._load(), attr, value)
+        return
+
+    def __repr__ (self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return "<lazy module '{}' ({})>".format(self.__dict__['_name'], state)
+
+
+def lazy_import (name, on_import=None):
+    """
+    Import module `name` lazily, i.e. on first use.
+
+    Arguments:
+        name: Fully qualified name of the module, e.g. 'pandas'.
+        on_import: Callable, taking the module as its only argument, to be
+            called once the module has been imported, e.g. for configuration.
+
+    Returns:
+        Module proxy, cf. `LazyModule`.
+    """
+    return LazyModule(name, on_import)
+
+
+def _ignore_command_line_options (ROOT):
+    """Get ROOT to stop hogging the command-line options."""
+    ROOT.PyConfig.IgnoreCommandLineOptions = True
+    return
+
+
+def lazy_import_root ():
+    """
+    Import ROOT lazily, cf. `lazy_import`, without ROOT parsing the command-line
+    options on first use.
+    """
+    return lazy_import('ROOT', _ignore_command_line_options)
 
 
 def belongs_to (x, module):
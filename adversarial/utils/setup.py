@@ -17,11 +17,13 @@ import logging as log
 
 # Scientific import(s)
 import numpy as np
-import pandas as pd
 
 # Project import(s)
+from .misc import lazy_import
 from .management import mkdir, garbage_collect
+from .storage import CHUNKSIZE, get_dtypes, audit_na, get_na_key, load_na_report, save_na_report, read_columns, iter_columns, read_columnar, iter_columnar, ensure_columnar
 from ..profile import profile
+pd = lazy_import('pandas')
 
 # Global variable definition(s)
 RNG = np.random.RandomState(21)  # For reproducibility
@@ -75,6 +77,10 @@ def parse_args (cmdline_args=sys.argv[1:], backend=False, adversarial=False, plo
         # Inputs
         parser.add_argument('--jobname', action='store', type=str,
                             default="", help='Name of job, used for TensorBoard output.')
+        parser.add_argument('--parallel-folds', action='store', type=int,
+                            default=1, help='Number of cross-validation folds to train in parallel, in separate worker processes, when optimising.')
+        parser.add_argument('--checkpoint-period', action='store', type=int,
+                            default=1, help='Number of epochs between training checkpoints.')
 
         # Flags
         parser.add_argument('--tensorboard', action='store_true',
@@ -85,6 +91,10 @@ def parse_args (cmdline_args=sys.argv[1:], backend=False, adversarial=False, plo
                             help='Perform classifier pre-training')
         parser.add_argument('--train-adversarial', action='store_true',
                             help='Perform adversarial training')
+        parser.add_argument('--resume', action='store_true',
+                            help='Resume training from the last checkpoint')
+        parser.add_argument('--pretrain-cached', action='store_true',
+                            help='Pre-train adversary stand-alone, on cached classifier outputs')
 
         group_optimise = parser.add_mutually_exclusive_group()
         group_optimise.add_argument('--optimise-classifier',  dest='optimise_classifier',  action='store_true',
@@ -98,6 +108,7 @@ def parse_args (cmdline_args=sys.argv[1:], backend=False, adversarial=False, plo
         parser.add_argument('--save', action='store_true', help='Save plots to file')
         parser.add_argument('--show', action='store_true', help='Show plots')
         pass
+    parser.add_argument('--mmap',  action='store_true', help='Read data through memory-mapped, columnar cache')
     parser.add_argument('--debug', action='store_true', help='Global debug flag')
     parser.add_argument('--max',   action='store', type=int, default=1, help='Global max multithreads')
     parser.add_argument('--bkg', action='store', type=str, default="D", help='Background Type')
@@ -289,12 +300,14 @@ def configure_tensorflow (args, num_cores):
 
 
 @profile
-def initialise_backend (args):
+def initialise_backend (args, share=1):
     """Initialise the Keras backend.
 
     Args:
         args: Namespace containing command-line arguments from argparse. These
             settings specify which back-end should be configured, and how.
+        share: Number of processes sharing the CPU cores, e.g. concurrent
+            cross-validation folds, between which the cores are divided.
     """
 
     # Check(s)
@@ -330,6 +343,9 @@ def initialise_backend (args):
     except:
 	pass
 
+    # Divide cores between processes sharing them
+    num_cores = max(num_cores // share, 1)
+
     # Configure backend
     if args.theano:
         _       = configure_theano(args, num_cores)
@@ -449,41 +465,164 @@ INPUT_DEFAULTS={"sjetVRGT2_SV1_efracsvx": -0.44386664032936096, "sjetVRGT2_IP3D_
 USED_VARIABLES=list(set(INPUT_VARIABLES+DECORRELATION_VARIABLES+
                         DECORRELATION_VARIABLES_AUX+
                         WEIGHT_VARIABLES+FLAG_VARIABLES))
+# Variables stored as indexed data columns by `index_data`, for selections
+INDEX_VARIABLES=FLAG_VARIABLES+DECORRELATION_VARIABLES+DECORRELATION_VARIABLES_AUX
+# Data types applied at load time. Floating-point variables (features, weights)
+# are loaded with the Keras `floatx` set in `initialise_backend`; flags as bytes.
+FLOAT_DTYPE=np.float32
+FLAG_DTYPE=np.uint8
 
 @garbage_collect
 @profile
-def get_decorrelation_variables (data,bWithAux=False,bAuxLog=True):
+def fit_decorrelation_scaler (data):
+    """
+    Fit the parameters used to scale the decorrelation variables to [0,1].
+
+    Arguments:
+        data: Pandas DataFrame from which variables should be read, typically
+            the training dataset.
+
+    Returns:
+        Dict with the list of decorrelation `variables`, and the `offset` and
+        `scale` for each, cf. `get_decorrelation_variables`. Can be saved
+        alongside the adversary, cf. `save_scaler`.
+    """
+
+    values = data[DECORRELATION_VARIABLES].values
+    minimum = np.min(values, axis=0).astype(float)
+    maximum = np.max(values, axis=0).astype(float)
+    return {
+        'variables': list(DECORRELATION_VARIABLES),
+        'offset':    minimum.tolist(),
+        'scale':     (1. / (maximum - minimum)).tolist(),
+        }
+
+
+def get_decorrelation_variables (data,scaler=None,bWithAux=False,bAuxLog=True):
     """
     Get array of standardised decorrelation variables.
 
     Arguments:
-        data: Pandas DataFrame from which variables should be read.
+        data: Pandas DataFrame from which variables should be read. Is not
+            modified.
+        scaler: Scaling parameters, cf. `fit_decorrelation_scaler`. Should be
+            fitted once, on the training dataset, and reused for validation and
+            inference. If `None`, the parameters are fitted on `data`.
 
     Returns:
         Numpy array with decorrelation variables scaled to [0,1].
     """
 
-    # Initialise and fill coordinate original arrays
-    decorrelation = data[DECORRELATION_VARIABLES].values
+    # Check(s)
+    if scaler is None:
+        scaler = fit_decorrelation_scaler(data)
+        pass
+    assert scaler['variables'] == list(DECORRELATION_VARIABLES), \
+        "Scaler was fitted for decorrelation variables {}".format(scaler['variables'])
 
-    # Scale coordinates to range [0,1]
-    decorrelation -= np.min(decorrelation, axis=0)
-    decorrelation /= np.max(decorrelation, axis=0)
+    # Scale coordinates to range [0,1], into a single new array
+    values = data[DECORRELATION_VARIABLES].values
+    decorrelation = np.subtract(values, np.asarray(scaler['offset'], dtype=values.dtype))
+    decorrelation *= np.asarray(scaler['scale'], dtype=values.dtype)
 
     return decorrelation
 
 
+def get_conditions (train=None, test=None, signal=None, background=None, pt_range=None, mass_range=None):
+    """
+    Get list of selection conditions, to be pushed down to the reader, for the
+    flags common to `load_data` and `load_data_iter`.
+
+    Returns:
+        List of `(column, operator, value)` tuples, cf. `read_columns`.
+    """
+
+    conditions = list()
+    if train:
+        log.info("load_data: Selecting only training data.")
+        conditions.append(('train', '==', True))
+        pass
+
+    if test:
+        log.info("load_data: Selecting only testing data.")
+        conditions.append(('train', '==', False))
+        pass
+
+    if signal:
+        log.info("load_data: Selecting only signal data.")
+        conditions.append(('signal', '==', True))
+        pass
+
+    if background:
+        log.info("load_data: Selecting only background data.")
+        conditions.append(('signal', '==', False))
+        pass
+
+    for var, var_range in zip([DECORRELATION_VARIABLES_AUX[0], DECORRELATION_VARIABLES[0]], [pt_range, mass_range]):
+        if var_range is not None:
+            log.info("load_data: Selecting only data with {} in [{}, {}).".format(var, *var_range))
+            conditions.append((var, '>=', var_range[0]))
+            conditions.append((var, '<',  var_range[1]))
+            pass
+        pass
+
+    return conditions
+
+
+def get_schema (path, name='dataset'):
+    """
+    Get the dtype schema to apply when loading the HDF5 file at `path`:
+    `FLAG_DTYPE` for the flag variables and `FLOAT_DTYPE` for all floating-
+    point variables. Integer-type variables keep their stored dtype.
+
+    Returns:
+        Dict of `{column: dtype}`, cf. `read_columns`.
+    """
+
+    schema = dict()
+    for col, dtype in get_dtypes(path, name).items():
+        if col in FLAG_VARIABLES:
+            schema[col] = FLAG_DTYPE
+        elif np.issubdtype(dtype, np.floating):
+            schema[col] = FLOAT_DTYPE
+            pass
+        pass
+    return schema
+
+
 @garbage_collect
 @profile
-def load_data (path, name='dataset', train=None, test=None, signal=None, background=None, sample=None, seed=21, replace=True,fillna=True,dropna=False,debug=False,study=False):
+def load_data (path, name='dataset', columns=None, train=None, test=None, signal=None, background=None, pt_range=None, mass_range=None, sample=None, seed=21, replace=True,fillna=True,dropna=False,debug=False,study=False,mmap=False,downcast=True):
     """
     General script to load data, common to all run scripts.
 
     Arguments:
         path: The path to the HDF5 file, from which data should be loaded.
         name: Name of the dataset, as stored in the HDF5 file.
+        columns: List of columns to read from the HDF5 file, typically the
+            variables needed by the calling run script, e.g. `USED_VARIABLES`.
+            The flag variables are always read. If `None`, all columns are
+            read.
+        train, test, signal, background: Flags for selecting only training/
+            testing and signal/background samples.
+        pt_range, mass_range: Tuples `(min, max)` of the jet pT and mass, in
+            MeV, within which to select samples.
+        mmap: Whether to read from the memory-mapped, columnar cache of the
+            HDF5 file, cf. `convert_columnar`. The cache is created, or
+            re-created if the HDF5 file has changed, on first use.
+        downcast: Whether to apply the dtype schema, cf. `get_schema`, on
+            read. With `mmap`, a separate columnar cache is kept with and
+            without the schema applied.
+        sample: Fraction of the selected rows to load, drawn at random, without
+            replacement, when reading, cf. `read_columns`. `replace` is kept
+            for backwards compatibility and ignored.
+        seed: Seed for the random subsample.
         ...
 
+    The sample selection is pushed down to the reader, cf. `read_columns`, such
+    that only the selected rows are kept in memory. For files converted using
+    `index_data`, only the selected rows are decoded.
+
     Returns:
         Tuple of pandas.DataFrame containing the loaded; list of loaded features
         to be used for training; and list of features to be used for mass-
@@ -501,51 +640,58 @@ def load_data (path, name='dataset', train=None, test=None, signal=None, backgro
     if sample: assert 0 < sample and sample < 1.
     if study:fillna=False
 
+    # Split data, for different usage
+    conditions = get_conditions(train, test, signal, background, pt_range, mass_range)
+    if sample:
+        log.info("load_data: Selecting a random fraction {:.2f} of data (seed = {}).".format(sample, seed))
+        pass
+
     # Read data from HDF5 file
-    # data = pd.read_hdf(path, name)[USED_VARIABLES]
-    data = pd.read_hdf(path, name)
+    if columns is not None:
+        columns = list(columns) + [flag for flag in FLAG_VARIABLES if flag not in columns]
+        pass
+    schema = get_schema(path, name)
+    dtypes = schema if downcast else None
+    if mmap:
+        data = read_columnar(ensure_columnar(path, name, dtypes=dtypes), columns, conditions, dtypes, sample, seed)
+    else:
+        data = read_columns(path, name, columns, conditions, dtypes, sample, seed)
+        pass
     print "examining load data"
     if debug:
         data.info(verbose=True, memory_usage="deep",null_counts=True)
     else:
         data.info()
+    # Audit, and fill, N/A values in a single pass. The report is cached in a
+    # sidecar file, such that only the affected columns are processed on
+    # subsequent loads of the same selection.
+    defaults = INPUT_DEFAULTS if fillna else None
+    key      = get_na_key(data.columns, conditions, fillna=fillna, sample=sample, seed=seed)
+    report   = load_na_report(path, key)
+    if report is None:
+        report, NA_rows = audit_na(data, defaults)
+        save_na_report(path, key, report)
+    else:
+        NA_colnames = [col for col, count in report['columns'].items() if count > 0]
+        if NA_colnames and (fillna or dropna):
+            _, NA_rows = audit_na(data, defaults, columns=NA_colnames)
+            pass
+        pass
+
     print "N/A report: "
-    NA_mask=data.isna()
-    NA_count=NA_mask.sum()
-    NA_colnames = data.columns[NA_count>0]
-    NA_rows = NA_mask.sum(axis=1) > 0
-
-    NA_count = NA_count[NA_count>0]
-    for name,count in zip(NA_colnames.to_list(),NA_count.to_list()):
-        # log.debug("{}\t{:.3%}".format(name,1.*count/len(data)))
-        if debug:print "{}\t{:.3%}".format(name, 1. * count / len(data))
-    print "Total rows have N/A {}/{}={:.3%}".format(NA_rows.sum(),len(data),1.*NA_rows.sum() / len(data))
+    NA_count = [(col, count) for col, count in report['columns'].items() if count > 0]
+    for col, count in NA_count:
+        if debug:print "{}\t{:.3%}".format(col, 1. * count / report['nrows'])
+        pass
+    print "Total rows have N/A {}/{}={:.3%}".format(report['rows'], report['nrows'], 1. * report['rows'] / max(report['nrows'], 1))
     if fillna or dropna:
-        print "N/A filling with defaults input..." if fillna else "Drop rows have N/A..."
-        log.debug("examine input data before {}\n{}".format(
-            "fill" if fillna else "drop",
-            data[NA_colnames].describe()
-        ))
-        if fillna:
-            data = data.fillna(value=INPUT_DEFAULTS)
-        elif dropna:
-            data = data.dropna()
+        print "N/A filled with defaults input" if fillna else "Drop rows have N/A..."
+        if dropna and not fillna and report['rows']:
+            data = data[~NA_rows]
             pass
-        log.debug("examine input data after {}\n{}".format(
-            "fill" if fillna else "drop",
-            data[NA_colnames].describe()
-        ))
         print "N/A report again:"
-        NA_mask = data.isna()
-        NA_count = NA_mask.sum()
-        NA_colnames = data.columns[NA_count > 0]
-        NA_rows = NA_mask.sum(axis=1) > 0
-        NA_count = NA_count[NA_count > 0]
-        for name, count in zip(NA_colnames.to_list(), NA_count.to_list()):
-            # log.debug("{}\t{:.3%}".format(name, 1. * count / len(data)))
-            if debug:print "{}\t{:.3%}".format(name, 1. * count / len(data))
-        print "Total rows have N/A {}/{}={:.3%}".format(NA_rows.sum(),len(data),1.*NA_rows.sum() / len(data))
-        # assert NA_count.sum()==0  # Those output value might be still be N/A
+        print "Total rows have N/A {}/{}={:.3%}".format(report['remaining'] if fillna else 0, len(data), 1. * (report['remaining'] if fillna else 0) / max(len(data), 1))
+        # assert report['remaining']==0  # Those output value might be still be N/A
         pass
 
 
@@ -588,35 +734,69 @@ def load_data (path, name='dataset', train=None, test=None, signal=None, backgro
     features_input         = INPUT_VARIABLES
     features_decorrelation = DECORRELATION_VARIABLES
 
-    # Split data, for different usage
-    if train:
-        log.info("load_data: Selecting only training data.")
-        data = data[data['train']  == True]
-        pass
+    # Return
+    # print data.dtypes
+    return data, features_input, features_decorrelation
 
-    if test:
-        log.info("load_data: Selecting only testing data.")
-        data = data[data['train']  == False]
-        pass
 
-    if signal:
-        log.info("load_data: Selecting only signal data.")
-        data = data[data['signal'] == True]
-        pass
+def load_data_iter (path, name='dataset', features=None, chunksize=CHUNKSIZE, train=None, test=None, signal=None, background=None, pt_range=None, mass_range=None, fillna=True, dropna=False, mmap=False, downcast=True):
+    """
+    Iterate over fixed-size chunks of data, read straight from disk, such that
+    datasets larger than the available memory can be processed.
 
-    if background:
-        log.info("load_data: Selecting only background data.")
-        data = data[data['signal'] == False]
+    Arguments:
+        path: The path to the HDF5 file, from which data should be loaded.
+        name: Name of the dataset, as stored in the HDF5 file.
+        features: List of input features. If `None`, use `INPUT_VARIABLES`.
+        chunksize: Number of rows to read at a time. Chunks contain at most
+            this number of rows after the selection.
+        train, test, signal, background, pt_range, mass_range: Sample
+            selection, applied per chunk, cf. `load_data`.
+        fillna: Whether to fill N/A values in the input features with
+            `INPUT_DEFAULTS`.
+        dropna: Whether to drop rows with N/A values, if not `fillna`.
+        mmap: Whether to read from the columnar cache, cf. `load_data`.
+        downcast: Whether to apply the dtype schema, cf. `load_data`.
+
+    Yields:
+        Tuple of numpy arrays with the input features, the (unscaled)
+        decorrelation variables, the sample weights, and the signal labels, for
+        each chunk.
+    """
+
+    # Check(s)
+    assert False not in [train, test, signal, background]
+
+    # Define feature collections to use
+    features = features or INPUT_VARIABLES
+    weight   = WEIGHT_VARIABLES[0]
+    columns  = features + [var for var in DECORRELATION_VARIABLES + [weight, 'signal'] if var not in features]
+    conditions = get_conditions(train, test, signal, background, pt_range, mass_range)
+
+    # Get chunk iterator
+    schema = get_schema(path, name)
+    dtypes = schema if downcast else None
+    if mmap:
+        chunks = iter_columnar(ensure_columnar(path, name, dtypes=dtypes), columns, conditions, dtypes, chunksize)
+    else:
+        chunks = iter_columns(path, name, columns, conditions, dtypes, chunksize)
         pass
 
-    if sample:
-        log.info("load_data: Selecting a random fraction {:.2f} of data (replace = {}, seed = {}).".format(sample, replace, seed))
-        data = data.sample(frac=sample, random_state=seed, replace=False) #dataframe.sample
-        # no replace means one element can only be selected once
+    for chunk in chunks:
+        if fillna or dropna:
+            _, NA_rows = audit_na(chunk, INPUT_DEFAULTS if fillna else None)
+            if dropna and not fillna:
+                chunk = chunk[~NA_rows]
+                pass
+            pass
+        yield (chunk[features].values,
+               chunk[DECORRELATION_VARIABLES].values,
+               chunk[weight].values,
+               chunk['signal'].values)
         pass
-    # Return
-    # print data.dtypes
-    return data, features_input, features_decorrelation
+
+    return
+
 
 # @garbage_collect
 # @profile
@@ -837,4 +1017,4 @@ def load_data (path, name='dataset', train=None, test=None, signal=None, backgro
 #         pass
 #     # Return
 #     # print data.dtypes
-#     return data, features_input, features_decorrelation
\ No newline at end of file
+#     return data, features_input, features_decorrelation
@@ -0,0 +1,937 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Common, storage-related utilities."""
+
+# Basic import(s)
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import collections
+import logging as log
+
+# Scientific import(s)
+import numpy as np
+
+# Project import(s)
+from .misc import lazy_import
+pd = lazy_import('pandas')
+
+# Global variable definition(s)
+CHUNKSIZE = 1000000  # Number of rows to read/write at a time
+SPARSE    = 0.05     # Fraction of selected rows below which rows are read by point selection
+
+# Supported comparison operators for selection conditions
+OPERATORS = {
+    '==': np.equal,
+    '!=': np.not_equal,
+    '<':  np.less,
+    '<=': np.less_equal,
+    '>':  np.greater,
+    '>=': np.greater_equal,
+    }
+
+
+def get_columns (path, name='dataset'):
+    """
+    Get the list of columns stored in a pandas HDF5 file, without reading any
+    of the data.
+
+    Arguments:
+        path: The path to the HDF5 file.
+        name: Name of the dataset, as stored in the HDF5 file.
+
+    Returns:
+        List of column names, in the order in which they are stored.
+
+    Raises:
+        KeyError: If the HDF5 does not contained a dataset named `name`.
+    """
+
+    with pd.HDFStore(path, mode='r') as store:
+        storer = store.get_storer(name)
+        if storer.is_table:
+            columns = list(storer.non_index_axes[0][1])
+        else:
+            columns = list(storer.group.axis0.read())
+            pass
+        pass
+
+    return columns
+
+
+def build_where (conditions):
+    """
+    Convert a list of selection conditions to a pandas/PyTables `where`-clause.
+
+    Arguments:
+        conditions: List of `(column, operator, value)` tuples, e.g.
+            `[('train', '==', True), ('fjet_pt', '>=', 200E+03)]`, which are
+            combined with logical AND.
+
+    Returns:
+        List of query strings, as accepted by `pandas.HDFStore.select`.
+    """
+    return ["{} {} {!r}".format(col, op, val) for (col, op, val) in conditions]
+
+
+def apply_conditions (data, conditions):
+    """
+    Evaluate a list of selection conditions on in-memory data.
+
+    Arguments:
+        data: pandas.DataFrame, or dict of numpy arrays, containing (at least)
+            the columns used in `conditions`.
+        conditions: List of `(column, operator, value)` tuples, cf.
+            `build_where`.
+
+    Returns:
+        Boolean numpy array, `True` for rows passing all conditions.
+    """
+    msk = None
+    for col, op, val in conditions:
+        values = np.asarray(data[col])
+        passing = OPERATORS[op](values, val)
+        msk = passing if msk is None else (msk & passing)
+        pass
+    return msk
+
+
+def sample_rows (nrows, sample, seed=None, msk=None):
+    """
+    Draw a random subsample of rows, without replacement.
+
+    Arguments:
+        nrows: Total number of rows.
+        sample: Fraction of (passing) rows to select.
+        seed: Seed for the random number generator.
+        msk: Boolean row mask. If given, only passing rows are sampled.
+
+    Returns:
+        Boolean numpy array, `True` for rows in the subsample.
+    """
+    candidates = np.arange(nrows) if msk is None else np.flatnonzero(msk)
+    rng = np.random.RandomState(seed)
+    chosen = rng.choice(candidates, int(round(sample * len(candidates))), replace=False)
+    sampled = np.zeros((nrows,), dtype=bool)
+    sampled[chosen] = True
+    return sampled
+
+
+def _read_fixed (group, columns, msk=None, start=None, stop=None, dtypes=None, chunksize=CHUNKSIZE):
+    """
+    Read `columns` from a fixed-format pandas frame stored in PyTables `group`.
+
+    The per-dtype value blocks written by pandas are sliced column-wise
+    directly in PyTables, such that unused columns are never loaded into
+    memory. The rows in `[start, stop)` are read in chunks of `chunksize`, and
+    written into preallocated output arrays with the dtypes in `dtypes`, such
+    that the stored dtype is never held in memory for the full dataset. If a
+    row mask `msk` is given, only passing rows are kept; chunks in which fewer
+    than a fraction `SPARSE` of rows pass are read by point selection, such
+    that e.g. a small random subsample is cheap to read.
+    """
+
+    # Check(s)
+    dtypes = dtypes or dict()
+    start, stop, _ = slice(start, stop).indices(len(group.axis1))
+
+    index = group.axis1.read(start, stop)
+    if msk is not None:
+        msk = msk[start:stop]
+        index = index[msk]
+        pass
+
+    frames = list()
+    for iblock in range(group._v_attrs.nblocks):
+        items = list(getattr(group, 'block{}_items'.format(iblock)).read())
+        wanted = [item for item in items if item in columns]
+        if not wanted:
+            continue
+
+        # @NOTE: PyTables requires strictly increasing point selections.
+        idx  = [items.index(item) for item in wanted]
+        node = getattr(group, 'block{}_values'.format(iblock))
+        if getattr(node._v_attrs, 'transposed', False):
+            read = lambda lo, hi: node[lo:hi, idx]
+            read_rows = lambda rows: node[rows][:, idx]
+        else:
+            read = lambda lo, hi: node[idx, lo:hi].T
+            read_rows = lambda rows: node[:, rows][idx].T
+            pass
+
+        # Allocate output arrays, by output dtype
+        outputs = collections.OrderedDict()
+        for icol, item in enumerate(wanted):
+            outputs.setdefault(np.dtype(dtypes.get(item, node.atom.dtype)), list()).append(icol)
+            pass
+        arrays = [np.empty((len(index), len(icols)), dtype=dtype) for dtype, icols in outputs.items()]
+
+        # Fill output arrays in chunks
+        offset = 0
+        for lo in range(start, stop, chunksize):
+            hi = min(lo + chunksize, stop)
+            if msk is None:
+                values = read(lo, hi)
+            else:
+                sel = msk[lo - start:hi - start]
+                npass = np.count_nonzero(sel)
+                if npass == 0:
+                    continue
+                elif npass < SPARSE * len(sel):
+                    values = read_rows(np.flatnonzero(sel) + lo)
+                else:
+                    values = read(lo, hi)[sel]
+                    pass
+                pass
+            for array, icols in zip(arrays, outputs.values()):
+                array[offset:offset + len(values)] = values[:, icols]
+                pass
+            offset += len(values)
+            pass
+
+        for array, icols in zip(arrays, outputs.values()):
+            frames.append(pd.DataFrame(array, index=index, columns=[wanted[icol] for icol in icols], copy=False))
+            pass
+        pass
+
+    return pd.concat(frames, axis=1, copy=False)[columns]
+
+
+def _astype (data, dtypes):
+    """Cast the columns of DataFrame `data` to `dtypes`, where necessary."""
+    dtypes = {col: dtype for (col, dtype) in (dtypes or dict()).items() if col in data and data[col].dtype != dtype}
+    return data.astype(dtypes, copy=False) if dtypes else data
+
+
+def get_dtypes (path, name='dataset'):
+    """
+    Get the dtypes of the columns stored in a pandas HDF5 file, without reading
+    any of the data.
+
+    Arguments:
+        path: The path to the HDF5 file.
+        name: Name of the dataset, as stored in the HDF5 file.
+
+    Returns:
+        Dict of `{column: dtype}`.
+    """
+
+    with pd.HDFStore(path, mode='r') as store:
+        storer = store.get_storer(name)
+        if storer.is_table:
+            dtypes = dict(store.select(name, start=0, stop=0).dtypes)
+        else:
+            dtypes = dict()
+            group = storer.group
+            for iblock in range(group._v_attrs.nblocks):
+                node = getattr(group, 'block{}_values'.format(iblock))
+                for item in getattr(group, 'block{}_items'.format(iblock)).read():
+                    dtypes[item] = node.atom.dtype
+                    pass
+                pass
+            pass
+        pass
+
+    return dtypes
+
+
+def read_columns (path, name='dataset', columns=None, conditions=None, dtypes=None, sample=None, seed=None):
+    """
+    Read (a subset of) the rows and columns in a pandas HDF5 file.
+
+    Only the requested columns are read from disk, for both `table`- and
+    `fixed`-format files. Selection `conditions` are pushed down to the reader:
+    for `table`-format files with the relevant data columns, cf. `index_data`,
+    the selection is performed by PyTables using the on-disk index. Otherwise,
+    only the columns used in the selection are read in full, and the remaining
+    columns are read for passing rows only. Likewise, a random `sample` of the
+    passing rows is drawn before reading, such that only sampled rows are read.
+
+    Arguments:
+        path: The path to the HDF5 file.
+        name: Name of the dataset, as stored in the HDF5 file.
+        columns: List of columns to read. If `None`, all columns are read.
+        conditions: List of `(column, operator, value)` tuples, cf.
+            `build_where`. If `None`, all rows are read.
+        dtypes: Dict of `{column: dtype}` to which to cast the columns on
+            read. Columns not in `dtypes` keep their stored dtype.
+        sample: Fraction of the passing rows to read, selected at random. If
+            `None`, all passing rows are read.
+        seed: Seed for the random subsample, cf. `sample_rows`.
+
+    Returns:
+        pandas.DataFrame with the requested columns, in the requested order.
+
+    Raises:
+        KeyError: If the HDF5 does not contained a dataset named `name`.
+        KeyError: If any of the requested `columns`, or any of the columns used
+            in `conditions`, are not present in the dataset.
+    """
+
+    # Read full dataset
+    conditions = conditions or []
+    if columns is None and not conditions and not dtypes and not sample:
+        return pd.read_hdf(path, name)
+
+    # Check(s)
+    available = get_columns(path, name)
+    columns = available if columns is None else list(columns)
+    missing = [col for col in columns + [c[0] for c in conditions] if col not in available]
+    if missing:
+        raise KeyError("read_columns: The following {} column(s) were not found in {}: {}".format(len(missing), path, ', '.join(sorted(set(missing)))))
+
+    with pd.HDFStore(path, mode='r') as store:
+        storer = store.get_storer(name)
+
+        # Table format
+        if storer.is_table:
+            pushed = [c for c in conditions if c[0] in (storer.data_columns or [])]
+            if len(pushed) == len(conditions) and not sample:
+                # Selection is performed using the on-disk index
+                data = store.select(name, where=build_where(pushed) or None, columns=columns)
+            else:
+                # Select by row coordinates
+                if len(pushed) == len(conditions):
+                    coordinates = np.asarray(store.select_as_coordinates(name, where=build_where(pushed) or None))
+                else:
+                    log.info("read_columns: Not all selection columns are indexed in {}; consider using `index_data`.".format(path))
+                    selection = store.select(name, columns=sorted(set(c[0] for c in conditions)))
+                    coordinates = np.where(apply_conditions(selection, conditions))[0]
+                    pass
+                if sample:
+                    coordinates = coordinates[sample_rows(len(coordinates), sample, seed)]
+                    pass
+                data = store.select(name, where=coordinates, columns=columns)
+                pass
+            data = _astype(data, dtypes)
+
+        # Fixed format
+        else:
+            group = storer.group
+            msk = None
+            if conditions:
+                selection = _read_fixed(group, sorted(set(c[0] for c in conditions)))
+                msk = apply_conditions(selection, conditions)
+                pass
+            if sample:
+                msk = sample_rows(len(group.axis1), sample, seed, msk)
+                pass
+            data = _read_fixed(group, columns, msk, dtypes=dtypes)
+            pass
+        pass
+
+    log.debug("read_columns: Read {} rows and {} of {} columns from {}".format(len(data), len(columns), len(available), path))
+
+    return data
+
+
+def iter_columns (path, name='dataset', columns=None, conditions=None, dtypes=None, chunksize=CHUNKSIZE):
+    """
+    Iterate over chunks of (a subset of) the rows and columns in a pandas HDF5
+    file, such that the full dataset is never held in memory.
+
+    Selection `conditions` are pushed down to the reader where possible, cf.
+    `read_columns`, and are otherwise applied to each chunk.
+
+    Arguments:
+        path: The path to the HDF5 file.
+        name: Name of the dataset, as stored in the HDF5 file.
+        columns: List of columns to read. If `None`, all columns are read.
+        conditions: List of `(column, operator, value)` tuples, cf.
+            `build_where`. If `None`, all rows are read.
+        dtypes: Dict of `{column: dtype}` to which to cast the columns on
+            read, cf. `read_columns`.
+        chunksize: Number of rows to read at a time. Chunks contain at most
+            this number of rows after the selection.
+
+    Yields:
+        pandas.DataFrame with the requested columns, for each chunk.
+
+    Raises:
+        KeyError: If any of the requested `columns`, or any of the columns used
+            in `conditions`, are not present in the dataset.
+    """
+
+    # Check(s)
+    conditions = conditions or []
+    available = get_columns(path, name)
+    columns = available if columns is None else list(columns)
+    missing = [col for col in columns + [c[0] for c in conditions] if col not in available]
+    if missing:
+        raise KeyError("iter_columns: The following {} column(s) were not found in {}: {}".format(len(missing), path, ', '.join(sorted(set(missing)))))
+
+    with pd.HDFStore(path, mode='r') as store:
+        storer = store.get_storer(name)
+
+        # Table format
+        if storer.is_table:
+            pushed    = [c for c in conditions if c[0] in (storer.data_columns or [])]
+            remaining = [c for c in conditions if c not in pushed]
+            extra     = sorted(set(c[0] for c in remaining) - set(columns))
+            chunks    = store.select(name, where=build_where(pushed) or None, columns=columns + extra,
+                                     chunksize=chunksize, iterator=True)
+
+        # Fixed format
+        else:
+            remaining = conditions
+            extra     = sorted(set(c[0] for c in remaining) - set(columns))
+            nrows     = len(storer.group.axis1)
+            chunks    = (_read_fixed(storer.group, columns + extra, start=start, stop=start + chunksize, dtypes=dtypes) \
+                         for start in range(0, nrows, chunksize))
+            pass
+
+        for chunk in chunks:
+            if remaining:
+                chunk = chunk[apply_conditions(chunk, remaining)]
+                pass
+            chunk = chunk[columns] if extra else chunk
+            yield _astype(chunk, dtypes)
+            pass
+        pass
+
+    return
+
+
+def index_data (path, data_columns, name='dataset', output=None, chunksize=CHUNKSIZE, complevel=1, complib='zlib'):
+    """
+    Rewrite a pandas HDF5 file in `table` format, with `data_columns` stored
+    as separate, indexed columns, such that selections on these columns can be
+    pushed down to the reader in `read_columns`.
+
+    The conversion is performed in chunks of `chunksize` rows, such that the
+    full dataset is never held in memory.
+
+    Arguments:
+        path: The path to the input HDF5 file.
+        data_columns: List of columns on which to create on-disk indices,
+            typically the flag variables and the decorrelation variables.
+        name: Name of the dataset, as stored in the HDF5 file.
+        output: Path to the output HDF5 file. If `None`, the input file is
+            replaced.
+        chunksize: Number of rows to convert at a time.
+        complevel: Compression level for the output file.
+        complib: Compression library for the output file.
+    """
+
+    # Check(s)
+    replace = output is None
+    if replace:
+        output = path + '.tmp'
+        pass
+
+    # Get number of rows
+    with pd.HDFStore(path, mode='r') as store:
+        nrows = store.get_storer(name).nrows or len(store.get_storer(name).group.axis1)
+        pass
+
+    # Convert in chunks
+    with pd.HDFStore(output, mode='w', complevel=complevel, complib=complib) as store:
+        for start in range(0, nrows, chunksize):
+            print "index_data: Converting rows {}-{} of {}".format(start, min(start + chunksize, nrows), nrows)
+            chunk = pd.read_hdf(path, name, start=start, stop=start + chunksize)
+            store.append(name, chunk, format='table', data_columns=data_columns, index=False)
+            pass
+
+        # Create on-disk indices
+        store.create_table_index(name, columns=data_columns, optlevel=9, kind='full')
+        pass
+
+    if replace:
+        os.rename(output, path)
+        pass
+
+    return
+
+
+def get_columnar_path (path, dtypes=None):
+    """
+    Get the directory of the memory-mappable, columnar cache of the HDF5 file at
+    `path`, cf. `convert_columnar`. Caches stored with different `dtypes` are
+    kept in separate directories, such that e.g. a down-cast cache is never
+    read in place of one with the stored dtypes.
+    """
+    suffix = ''
+    if dtypes:
+        key = json.dumps(sorted((col, np.dtype(dtype).str) for col, dtype in dtypes.items()))
+        suffix = '_' + hashlib.md5(key).hexdigest()[:8]
+        pass
+    return os.path.splitext(path)[0] + '_columnar{}/'.format(suffix)
+
+
+def check_columnar (path, directory=None):
+    """
+    Check whether the columnar cache of the HDF5 file at `path` exists and is up
+    to date, i.e. whether it was created from a file with the same size and
+    modification time.
+
+    Arguments:
+        path: The path to the HDF5 file.
+        directory: Directory of the columnar cache. If `None`, use the default
+            location, cf. `get_columnar_path`.
+
+    Returns:
+        Whether the columnar cache can be used in place of the HDF5 file.
+    """
+
+    directory = directory or get_columnar_path(path)
+    try:
+        with open(directory + 'meta.json', 'r') as f:
+            meta = json.load(f)
+            pass
+    except IOError:
+        return False
+
+    stat = os.stat(path)
+    return meta['size'] == stat.st_size and meta['mtime'] == stat.st_mtime
+
+
+def convert_columnar (path, name='dataset', columns=None, dtypes=None, directory=None, chunksize=CHUNKSIZE):
+    """
+    One-time conversion of a pandas HDF5 file to an uncompressed, memory-
+    mappable columnar layout.
+
+    The columns are grouped by dtype, and each group is stored as a column-major
+    `.npy` array of shape `(num_columns, num_rows)`, such that each column is
+    contiguous on disk, and such that the array has the same layout as the
+    values of the corresponding pandas block. A small `meta.json` file records
+    the column names, dtypes, and the size and modification time of the source
+    file. The conversion is performed in chunks of `chunksize` rows, into a
+    temporary sibling directory, which replaces any existing cache once
+    complete. Use `ensure_columnar` to serialise conversions between jobs.
+
+    Arguments:
+        path: The path to the HDF5 file.
+        name: Name of the dataset, as stored in the HDF5 file.
+        columns: List of columns to convert. If `None`, all columns are
+            converted.
+        dtypes: Dict of `{column: dtype}` with which to store the columns, cf.
+            `read_columns`.
+        directory: Output directory. If `None`, use the default location for
+            `dtypes`, cf. `get_columnar_path`.
+        chunksize: Number of rows to convert at a time.
+
+    Returns:
+        The directory of the columnar cache.
+    """
+
+    # Build in a temporary sibling directory, which is moved into place once
+    # complete, such that readers never see a partially written cache
+    directory = directory or get_columnar_path(path, dtypes)
+    target = directory.rstrip('/')
+    tmpdir = tempfile.mkdtemp(prefix=os.path.basename(target) + '.', suffix='.tmp',
+                              dir=os.path.dirname(target) or '.')
+    os.chmod(tmpdir, 0755)
+    try:
+        _write_columnar(path, name, columns, dtypes, tmpdir + '/', chunksize)
+    except:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+
+    # Publish, replacing any stale cache
+    if os.path.exists(target):
+        stale = tmpdir + '.old'
+        os.rename(target, stale)
+        os.rename(tmpdir, target)
+        shutil.rmtree(stale, ignore_errors=True)
+    else:
+        os.rename(tmpdir, target)
+        pass
+
+    return directory
+
+
+def _write_columnar (path, name, columns, dtypes, directory, chunksize):
+    """Write the columnar cache of the HDF5 file at `path` to `directory`, cf.
+    `convert_columnar`."""
+
+    # Get data layout from first chunk
+    available = get_columns(path, name)
+    columns   = available if columns is None else [col for col in available if col in columns]
+    with pd.HDFStore(path, mode='r') as store:
+        storer = store.get_storer(name)
+        nrows  = storer.nrows if storer.is_table else len(storer.group.axis1)
+        pass
+    first = _astype(pd.read_hdf(path, name, start=0, stop=1), dtypes)
+
+    groups = collections.OrderedDict()
+    for col in columns:
+        groups.setdefault(str(first[col].dtype), list()).append(col)
+        pass
+
+    # Allocate output arrays
+    index  = np.lib.format.open_memmap(directory + 'index.npy', mode='w+', dtype=np.int64, shape=(nrows,))
+    blocks = list()
+    for iblock, (dtype, cols) in enumerate(groups.items()):
+        filename = 'block{}.npy'.format(iblock)
+        array = np.lib.format.open_memmap(directory + filename, mode='w+', dtype=np.dtype(dtype), shape=(len(cols), nrows))
+        blocks.append((filename, dtype, cols, array))
+        pass
+
+    # Convert in chunks
+    for start in range(0, nrows, chunksize):
+        print "convert_columnar: Converting rows {}-{} of {}".format(start, min(start + chunksize, nrows), nrows)
+        chunk = pd.read_hdf(path, name, start=start, stop=start + chunksize)
+        stop  = start + len(chunk)
+        index[start:stop] = chunk.index.values
+        for _, _, cols, array in blocks:
+            array[:, start:stop] = chunk[cols].values.T
+            pass
+        pass
+
+    # Flush and write metadata
+    stat = os.stat(path)
+    meta = dict(source=os.path.abspath(path), size=stat.st_size, mtime=stat.st_mtime, nrows=nrows,
+                blocks=[dict(file=filename, dtype=dtype, columns=cols) for (filename, dtype, cols, _) in blocks])
+    del index, blocks
+    with open(directory + 'meta.json', 'w') as f:
+        json.dump(meta, f, indent=4)
+        pass
+
+    return
+
+
+def ensure_columnar (path, name='dataset', dtypes=None):
+    """
+    Create, or re-create, the columnar cache of the HDF5 file at `path`, unless
+    it is up to date. An exclusive lock is held on a sibling lock file while
+    checking and converting, such that concurrent jobs on the same node convert
+    the file at most once.
+
+    Arguments:
+        path: The path to the HDF5 file.
+        name: Name of the dataset, as stored in the HDF5 file.
+        dtypes: Dict of `{column: dtype}` with which to store the columns, cf.
+            `convert_columnar`. Each set of `dtypes` has its own cache, cf.
+            `get_columnar_path`.
+
+    Returns:
+        The directory of the columnar cache.
+    """
+
+    directory = get_columnar_path(path, dtypes)
+    with open(directory.rstrip('/') + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not check_columnar(path, directory):
+                log.info("ensure_columnar: Creating columnar cache for {}".format(path))
+                convert_columnar(path, name, dtypes=dtypes, directory=directory)
+                pass
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            pass
+        pass
+    return directory
+
+
+def read_columnar (directory, columns=None, conditions=None, dtypes=None, sample=None, seed=None):
+    """
+    Read (a subset of) the rows and columns of a columnar cache, cf.
+    `convert_columnar`.
+
+    The cached arrays are memory-mapped copy-on-write, such that repeated jobs
+    on the same node share pages through the OS cache, and such that in-place
+    modifications are private to the calling process. If all columns in a dtype
+    group are requested, and no selection is applied, the returned DataFrame is
+    backed directly by the memory-map, i.e. no data is copied; otherwise only
+    the requested columns (and rows) are copied.
+
+    Arguments:
+        directory: Directory of the columnar cache.
+        columns: List of columns to read. If `None`, all columns are read.
+        conditions: List of `(column, operator, value)` tuples, cf.
+            `build_where`. If `None`, all rows are read.
+        dtypes: Dict of `{column: dtype}` to which to cast the columns, if not
+            already stored with these dtypes, cf. `convert_columnar`.
+        sample: Fraction of the passing rows to read, selected at random, cf.
+            `read_columns`.
+        seed: Seed for the random subsample, cf. `sample_rows`.
+
+    Returns:
+        pandas.DataFrame with the requested columns.
+
+    Raises:
+        KeyError: If any of the requested `columns`, or any of the columns used
+            in `conditions`, are not present in the cache.
+    """
+
+    # Read metadata
+    with open(directory + 'meta.json', 'r') as f:
+        meta = json.load(f)
+        pass
+
+    # Memory-map arrays
+    lookup = dict()
+    arrays = list()
+    for block in meta['blocks']:
+        array = np.load(directory + block['file'], mmap_mode='c')
+        arrays.append((block['columns'], array))
+        for irow, col in enumerate(block['columns']):
+            lookup[col] = array[irow]
+            pass
+        pass
+
+    # Check(s)
+    conditions = conditions or []
+    columns = list(columns) if columns is not None else [col for cols, _ in arrays for col in cols]
+    missing = [col for col in columns + [c[0] for c in conditions] if col not in lookup]
+    if missing:
+        raise KeyError("read_columnar: The following {} column(s) were not found in {}: {}".format(len(missing), directory, ', '.join(sorted(set(missing)))))
+
+    # Selection
+    index = np.load(directory + 'index.npy', mmap_mode='c')
+    msk = None
+    if conditions:
+        msk = apply_conditions(lookup, conditions)
+        pass
+    if sample:
+        msk = sample_rows(meta['nrows'], sample, seed, msk)
+        pass
+    if msk is not None:
+        msk = np.flatnonzero(msk)
+        index = index[msk]
+        pass
+
+    # Build DataFrame block-by-block
+    frames = list()
+    for cols, array in arrays:
+        wanted = [col for col in cols if col in columns]
+        if not wanted:
+            continue
+        if len(wanted) < len(cols):
+            array = array[[cols.index(col) for col in wanted]]
+            pass
+        if msk is not None:
+            array = array[:, msk]
+            pass
+        frames.append(pd.DataFrame(array.T, index=index, columns=wanted, copy=False))
+        pass
+
+    return _astype(pd.concat(frames, axis=1, copy=False), dtypes)
+
+
+def iter_columnar (directory, columns=None, conditions=None, dtypes=None, chunksize=CHUNKSIZE):
+    """
+    Iterate over chunks of (a subset of) the rows and columns of a columnar
+    cache, cf. `convert_columnar` and `read_columnar`.
+
+    Arguments:
+        directory: Directory of the columnar cache.
+        columns: List of columns to read. If `None`, all columns are read.
+        conditions: List of `(column, operator, value)` tuples, cf.
+            `build_where`. If `None`, all rows are read.
+        dtypes: Dict of `{column: dtype}` to which to cast the columns, cf.
+            `read_columnar`.
+        chunksize: Number of rows to read at a time.
+
+    Yields:
+        pandas.DataFrame with the requested columns, for each chunk.
+    """
+
+    # Read metadata
+    with open(directory + 'meta.json', 'r') as f:
+        meta = json.load(f)
+        pass
+
+    # Memory-map arrays
+    lookup = dict()
+    for block in meta['blocks']:
+        array = np.load(directory + block['file'], mmap_mode='r')
+        for irow, col in enumerate(block['columns']):
+            lookup[col] = array[irow]
+            pass
+        pass
+    index = np.load(directory + 'index.npy', mmap_mode='r')
+
+    # Check(s)
+    conditions = conditions or []
+    columns = list(columns) if columns is not None else [col for block in meta['blocks'] for col in block['columns']]
+    missing = [col for col in columns + [c[0] for c in conditions] if col not in lookup]
+    if missing:
+        raise KeyError("iter_columnar: The following {} column(s) were not found in {}: {}".format(len(missing), directory, ', '.join(sorted(set(missing)))))
+
+    for start in range(0, meta['nrows'], chunksize):
+        sl = slice(start, start + chunksize)
+        chunk = pd.DataFrame(collections.OrderedDict((col, lookup[col][sl]) for col in columns), index=index[sl])
+        if conditions:
+            chunk = chunk[apply_conditions({c[0]: lookup[c[0]][sl] for c in conditions}, conditions)]
+            pass
+        yield _astype(chunk, dtypes)
+        pass
+
+    return
+
+
+def _float_groups (data, columns=None):
+    """
+    Group the floating-point columns of `data`, optionally restricted to
+    `columns`, by dtype, such that each group can be processed in a single
+    pass over a `(nrows, ncols)` array of its values.
+
+    Returns:
+        List of lists of column names.
+    """
+    groups = collections.OrderedDict()
+    for col, dtype in zip(data.columns, data.dtypes):
+        if np.issubdtype(dtype, np.floating) and (columns is None or col in columns):
+            groups.setdefault(dtype, list()).append(col)
+            pass
+        pass
+    return groups.values()
+
+
+def audit_na (data, defaults=None, columns=None):
+    """
+    Count the N/A values in each floating-point column of `data` and, if
+    `defaults` are given, fill them in place, in a single pass over the values
+    of each dtype group.
+
+    Arguments:
+        data: pandas.DataFrame to be audited. Modified in place if `defaults`
+            are given.
+        defaults: Dict of `{column: value}` with which to fill N/A values.
+            Columns without a default are left unchanged.
+        columns: List of columns to audit. If `None`, all floating-point
+            columns are audited.
+
+    Returns:
+        Tuple of the N/A report, a dict with the number of rows (`nrows`), the
+        number of N/A values per column (`columns`) and the number of rows
+        with any N/A value (`rows`) before filling, and the number of rows with
+        any N/A value remaining after filling (`remaining`); and the boolean
+        row mask of the latter.
+    """
+
+    defaults = defaults or dict()
+    counts   = collections.OrderedDict()
+    rows     = np.zeros((len(data),), dtype=bool)
+    remain   = np.zeros((len(data),), dtype=bool)
+
+    for cols in _float_groups(data, columns):
+        values = data[cols].values
+        mask   = np.isnan(values)
+        for col, count in zip(cols, mask.sum(axis=0)):
+            counts[col] = int(count)
+            pass
+        if not mask.any():
+            continue
+        rows |= mask.any(axis=1)
+
+        # Fill all columns with a default in one masked copy, and write back
+        # only the filled columns, in one assignment
+        fill    = np.array([defaults.get(col, np.nan) for col in cols], dtype=values.dtype)
+        missing = np.isnan(fill)
+        remain |= (mask & missing).any(axis=1)
+        filled  = np.flatnonzero((mask & ~missing).any(axis=0))
+        if not len(filled):
+            continue
+        if not values.flags.writeable:
+            values = values.copy()
+            pass
+        np.copyto(values, fill, where=mask & ~missing)
+        if len(filled) == len(cols):
+            data[cols] = values
+        else:
+            data[[cols[icol] for icol in filled]] = values[:, filled]
+            pass
+        pass
+
+    report = {
+        'nrows':     len(data),
+        'columns':   counts,
+        'rows':      int(rows.sum()),
+        'remaining': int(remain.sum()),
+        }
+    return report, remain
+
+
+def get_na_path (path):
+    """
+    Get the path of the sidecar file in which N/A reports for the HDF5 file at
+    `path` are cached, cf. `load_na_report`.
+    """
+    return os.path.splitext(path)[0] + '_na.json'
+
+
+def get_na_key (columns, conditions=None, **kwargs):
+    """
+    Get the key identifying a selection of the data in the N/A sidecar file.
+
+    Arguments:
+        columns: List of columns read.
+        conditions: List of `(column, operator, value)` tuples used to select
+            rows, cf. `build_where`.
+        kwargs: Any other parameters affecting the rows read.
+
+    Returns:
+        Hexadecimal digest of the selection.
+    """
+    selection = [sorted(columns), sorted(map(list, conditions or [])), sorted(kwargs.items())]
+    return hashlib.md5(json.dumps(selection)).hexdigest()
+
+
+def load_na_report (path, key):
+    """
+    Load the cached N/A report for the selection `key` of the HDF5 file at
+    `path`, cf. `audit_na`.
+
+    Returns:
+        The N/A report, or `None` if no report exists or the HDF5 file has
+        changed since it was cached.
+    """
+
+    try:
+        with open(get_na_path(path), 'r') as f:
+            sidecar = json.load(f)
+            pass
+    except (IOError, ValueError):
+        return None
+
+    stat = os.stat(path)
+    if sidecar['size'] != stat.st_size or sidecar['mtime'] != stat.st_mtime:
+        return None
+    return sidecar['reports'].get(key, None)
+
+
+def save_na_report (path, key, report):
+    """
+    Cache the N/A report for the selection `key` of the HDF5 file at `path`,
+    cf. `load_na_report`. Reports for a previous version of the file are
+    discarded. An exclusive lock is held on a sibling lock file while updating
+    the sidecar file, which is replaced atomically, such that concurrent jobs
+    neither lose each other's reports nor read a partially written file.
+    """
+
+    sidecar_path = get_na_path(path)
+    stat = os.stat(path)
+    sidecar = {'size': stat.st_size, 'mtime': stat.st_mtime, 'reports': dict()}
+    try:
+        with open(sidecar_path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(sidecar_path, 'r') as f:
+                        cached = json.load(f)
+                        pass
+                    if cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+                        sidecar['reports'] = cached['reports']
+                        pass
+                except (IOError, ValueError):
+                    pass
+
+                sidecar['reports'][key] = report
+                with open(sidecar_path + '.tmp', 'w') as f:
+                    json.dump(sidecar, f, indent=4)
+                    pass
+                os.rename(sidecar_path + '.tmp', sidecar_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                pass
+            pass
+    except (IOError, OSError):
+        log.warning("save_na_report: Could not write N/A report to {}".format(sidecar_path))
+        pass
+    return
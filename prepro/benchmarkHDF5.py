@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script for benchmarking the HDF5 output settings of `save_hdf5`, i.e. the
+compression filter, compression level, byte-shuffle filter, and chunk size,
+in terms of write time, file size, and full and per-batch read throughput.
+
+Usage:
+    $ python -m prepro.benchmarkHDF5 [--input data.h5] [--rows 1000000] [--batch-size 8192]
+
+If no input file is given, a synthetic dataset, with the same layout as the
+final prepro dataset, is used.
+"""
+
+# Basic import(s)
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+# Scientific import(s)
+import h5py
+import numpy as np
+
+# Project import(s)
+from .common import save_hdf5, load_hdf5, BATCH_SIZE
+
+# Default settings, as (compression, complevel, shuffle)
+SETTINGS = [
+    ('none', None, False),
+    ('lzf',  None, False),
+    ('lzf',  None, True),
+    ('gzip', 1,    False),
+    ('gzip', 1,    True),
+    ('gzip', 4,    False),
+    ('gzip', 4,    True),
+    ('gzip', 9,    True),
+    ]
+
+# Command-line argument parser
+parser = argparse.ArgumentParser(description="Benchmark HDF5 compression and chunking settings.")
+parser.add_argument('--input', default=None,
+                    help="HDF5 file from which to read benchmark data. By default, synthetic data are used.")
+parser.add_argument('--dataset', default='dataset',
+                    help="Name of dataset in the HDF5 file.")
+parser.add_argument('--rows', type=int, default=1000000,
+                    help="Number of rows to benchmark.")
+parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                    help="Number of rows per random-access read.")
+parser.add_argument('--batches', type=int, default=100,
+                    help="Number of random-access reads.")
+parser.add_argument('--chunk-rows', type=int, nargs='+', default=[BATCH_SIZE // 2, BATCH_SIZE, BATCH_SIZE * 8],
+                    help="Chunk sizes, in rows, to benchmark.")
+
+
+def synthetic (rows, seed=21):
+    """
+    Generate a synthetic dataset with the same layout as the final prepro
+    dataset, i.e. float substructure variables, weights, and integer flags.
+    """
+    rng = np.random.RandomState(seed)
+    names = ['m', 'pt', 'eta', 'phi', 'rho', 'rhoDDT', 'D2', 'Tau21', 'N2', 'C2', 'Split12', 'Split23',
+             'weight', 'weight_train', 'weight_adv']
+    dtype = [(name, np.float32) for name in names] + [('signal', np.uint8), ('train', np.uint8)]
+    data = np.zeros((rows,), dtype=dtype)
+    for name in names:
+        data[name] = rng.lognormal(size=rows).astype(np.float32)
+        pass
+    data['signal'] = rng.randint(2, size=rows)
+    data['train']  = rng.randint(2, size=rows)
+    return data
+
+
+def benchmark (data, path, batch_size, batches, **kwargs):
+    """
+    Benchmark writing and reading `data` to/from `path`.
+
+    Arguments:
+        data: Numpy recarray to be written.
+        path: Path to temporary HDF5 file.
+        batch_size: Number of rows per random-access read.
+        batches: Number of random-access reads.
+        kwargs: Keyword arguments passed to `save_hdf5`.
+
+    Returns:
+        Tuple of write time, in seconds, file size, in MB, full-read throughput,
+        and random-access read throughput, in MB/s.
+    """
+
+    # Write
+    start = time.time()
+    save_hdf5(data, path, **kwargs)
+    t_write = time.time() - start
+    size = os.path.getsize(path) / float(2**20)
+
+    # Read full dataset
+    mb = data.nbytes / float(2**20)
+    start = time.time()
+    load_hdf5(path)
+    t_full = time.time() - start
+
+    # Read random batches
+    rng = np.random.RandomState(42)
+    nrows  = data.shape[0]
+    starts = rng.randint(max(nrows - batch_size, 1), size=batches)
+    start = time.time()
+    with h5py.File(path, 'r') as hf:
+        dataset = hf['dataset']
+        for first in starts:
+            dataset[first:first + batch_size]
+            pass
+        pass
+    t_batch = time.time() - start
+    mb_batch = min(batch_size, nrows) * batches * data.dtype.itemsize / float(2**20)
+
+    return t_write, size, mb / t_full, mb_batch / t_batch
+
+
+# Main function definition
+def main ():
+
+    # Parse command-line arguments
+    args = parser.parse_args()
+
+    # Get benchmark data
+    if args.input:
+        with h5py.File(args.input, 'r') as hf:
+            data = hf[args.dataset][:args.rows]
+            pass
+    else:
+        data = synthetic(args.rows)
+        pass
+
+    print "Benchmarking {} rows ({:.1f} MB), reading {} batches of {} rows".format(
+        data.shape[0], data.nbytes / float(2**20), args.batches, args.batch_size)
+    print "  {:6s} {:>5s} {:>7s} {:>7s}  {:>8s} {:>9s} {:>11s} {:>11s}".format(
+        'filter', 'level', 'shuffle', 'chunks', 'write', 'size', 'full read', 'batch read')
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'benchmark.h5')
+        for compression, complevel, shuffle in SETTINGS:
+            for chunksize in args.chunk_rows:
+                t_write, size, full, batch = benchmark(data, path, args.batch_size, args.batches,
+                                                       compression=compression,
+                                                       complevel=complevel,
+                                                       shuffle=shuffle,
+                                                       chunksize=chunksize)
+                print "  {:6s} {:>5s} {:>7s} {:7d}  {:7.2f}s {:6.1f} MB {:6.1f} MB/s {:6.1f} MB/s".format(
+                    compression, str(complevel or '-'), 'yes' if shuffle else 'no', chunksize,
+                    t_write, size, full, batch)
+                pass
+            pass
+    finally:
+        shutil.rmtree(tempdir)
+        pass
+
+    return
+
+
+# Main function call
+if __name__ == '__main__':
+    main()
+    pass
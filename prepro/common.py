@@ -1,68 +1,358 @@
 # -*- coding: utf-8 -*-
 
 # Basic import(s)
+import os
+import mmap
+import json
+import time
+import Queue
 import h5py
 import numpy as np
 import datetime
 import argparse
+import collections
 
 # Project import(s)
 from adversarial.utils import mkdir
 from adversarial.utils import garbage_collect
+from adversarial.utils import file_digest
 
 
-def run_batched (process, args, max_processes=2, queue=None):
+# Global variable definition(s)
+BATCH_SIZE   = 8192    # Training batch size, cf. configs/default.json
+COMPRESSIONS = ['gzip', 'lzf', 'none']
+MANIFEST     = 'manifest.json'
+
+
+def _get_size (arg):
+    """
+    Get the size, in bytes, of the file passed to a process in `arg`, if any;
+    otherwise 0.
     """
-    Generic method to run `process` in parallel on batches of `args`.
+    for item in (arg if isinstance(arg, (list, tuple)) else [arg]):
+        if isinstance(item, basestring) and os.path.isfile(item):
+            return os.path.getsize(item)
+        pass
+    return 0
+
+
+def _format_duration (seconds):
+    """Format a duration in seconds as e.g. '1h02m03s' or '4.5s'."""
+    if seconds < 60:
+        return '{:.1f}s'.format(seconds)
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours,   minutes = divmod(minutes, 60)
+    if hours:
+        return '{:d}h{:02d}m{:02d}s'.format(hours, minutes, seconds)
+    return '{:d}m{:02d}s'.format(minutes, seconds)
+
+
+def run_batched (process, args, max_processes=2, queue=None, retries=2, poll=0.1, strict=False, timeout=10.):
+    """
+    Generic method to run `process` in parallel on `args`.
+
+    The `args` are handled by a dynamic pool of at most `max_processes`
+    concurrent processes: a new process is started as soon as a running one
+    finishes, such that a single, large input file does not stall the others.
+    The duration and throughput of each process, and an estimate of the
+    remaining time, are reported as processes finish. Processes which fail,
+    i.e. exit with non-zero exit code, are retried up to `retries` times.
+
+    If `queue` is specified, each process should put a single `(index, result)`
+    tuple on it, where `index` is the attribute set on the process by this
+    method, identifying both the argument and the attempt. Only the result of
+    the successful attempt for each argument is kept.
 
     Arguments:
-        process: The process to batch, parallelise. Assumed to inherit from
+        process: The process to parallelise. Assumed to inherit from
             `multiprocessing.Process`
-        args: List of arguments to be batch, each item passed to `process`.
+        args: List of arguments, each item passed to `process`.
         max_processes: Maximal number of concurrent processes to run.
+        queue: (Optional) `multiprocessing.Queue` to which each process puts its
+            result.
+        retries: Number of times to retry a failed process.
+        poll: Interval, in seconds, at which to check running processes.
+        strict: Whether to raise an error if any process failed, after all
+            retries.
+        timeout: Time, in seconds, to wait for the results of successful
+            processes after all processes have finished. Processes whose
+            result is not received are considered failed.
+
+    Returns:
+        List of results put on `queue` by the successful processes, in the
+        order of `args`, if `queue` is specified; otherwise an empty list.
+
+    Raises:
+        RuntimeError: If `strict` and any process failed.
     """
 
     # Check(s)
     assert isinstance(args, (list, tuple))
     assert len(args)
+    assert max_processes > 0
+
+    # Bookkeeping
+    pending   = collections.deque(enumerate(args))
+    attempts  = collections.defaultdict(int)
+    running   = dict()  # {index: (process, start time)}
+    failed    = list()
+    received  = dict()  # {(index, attempt): result}
+    succeeded = dict()  # {index: attempt}
+    sizes     = [_get_size(arg) for arg in args]
+    total     = sum(sizes)
+    done      = 0
+    done_size = 0
+    start     = time.time()
+
+    def receive (block):
+        """Get all available results from `queue`, waiting up to `block` s."""
+        while True:
+            try:
+                key, result = queue.get(timeout=block) if block else queue.get_nowait()
+            except Queue.Empty:
+                return
+            if key in received:
+                print "   [WARN] Got more than one result for argument {} (attempt {}); ignoring.".format(*key)
+            else:
+                received[key] = result
+                pass
+            block = 0
+            pass
+        return
 
-    # Batch the function `args` as to never occupy more than `max_processes`.
-    # batches = map(list, np.array_split(args, np.ceil(len(args) / float(max_processes)))) #must change!!!
-    batchNumber=np.ceil(len(args) / float(max_processes))
-    i=0
-    batches=[]
-    while i<len(args):
-        batches.append(args[i:i+max_processes])
-        i+=max_processes
+    print "   Running {} processes on {} arguments ({:.1f} MB)".format(max_processes, len(args), total / 1.0E+06)
 
-    # Loop batches of args
-    results = list()
-    for ibatch, batch in enumerate(batches):
-        print "   Batch {}/{} | Contains {} arguments".format(ibatch + 1, len(batches), len(batch))
+    while pending or running:
 
-        # Convert files using multiprocessing
-        processes = map(process, batch)
+        # Start processes on free workers
+        while pending and len(running) < max_processes:
+            idx, arg = pending.popleft()
+            attempts[idx] += 1
+            p = process(arg)
+            p.queue = queue  # Possibly `None`
+            p.index = (idx, attempts[idx])
+            p.start()
+            running[idx] = (p, time.time())
+            pass
 
-        # Add queue (possibly `None`)
-        for p in processes:
-            p.queue = queue
+        # (Opt.) Get results. Necessary to drain the queue while processes run,
+        # since processes do not exit until their results have been consumed.
+        if queue is not None:
+            receive(poll)
+        else:
+            time.sleep(poll)
             pass
 
-        # Start processes
-        for p in processes: p.start()
+        # Check for finished processes
+        for idx, (p, tstart) in running.items():
+            if p.is_alive():
+                continue
+            p.join()
+            del running[idx]
+            duration = time.time() - tstart
+
+            # Retry failed process
+            if p.exitcode != 0:
+                if attempts[idx] <= retries:
+                    print "   [WARN] Process for argument {} failed with exit code {} (attempt {}/{}); retrying.".format(idx, p.exitcode, attempts[idx], retries + 1)
+                    pending.append((idx, args[idx]))
+                else:
+                    print "   [ERROR] Process for argument {} failed with exit code {} after {} attempts.".format(idx, p.exitcode, attempts[idx])
+                    failed.append(idx)
+                    pass
+                continue
+
+            # Report throughput and ETA
+            succeeded[idx] = attempts[idx]
+            done      += 1
+            done_size += sizes[idx]
+            elapsed = time.time() - start
+            if total and done_size:
+                eta  = (total - done_size) * elapsed / float(done_size)
+                rate = ' ({:.1f} MB/s)'.format(sizes[idx] / 1.0E+06 / max(duration, 1.0E-03))
+            else:
+                eta  = (len(args) - done) * elapsed / float(done)
+                rate = ''
+                pass
+            print "   [{}/{}] Finished argument {} in {}{} | ETA {}".format(done, len(args), idx, _format_duration(duration), rate, _format_duration(eta))
+            pass
+        pass
 
-        # (Opt.) Get results
-        if queue is not None:
-            results += [queue.get() for _ in processes]
+    # (Opt.) Get remaining results, keeping only those of successful attempts
+    results = list()
+    if queue is not None:
+        deadline = time.time() + timeout
+        while any(key not in received for key in succeeded.items()) and time.time() < deadline:
+            receive(poll)
+            pass
+        for idx in sorted(succeeded):
+            key = (idx, succeeded[idx])
+            if key in received:
+                results.append(received[key])
+            else:
+                print "   [ERROR] No result received for argument {}.".format(idx)
+                failed.append(idx)
+                pass
             pass
+        pass
 
-        # Wait for conversion processes to finish
-        for p in processes: p.join()
+    print "   Done in {}.".format(_format_duration(time.time() - start))
+    if failed:
+        print "   [ERROR] {} argument(s) failed: {}".format(len(failed), ', '.join(map(str, sorted(failed))))
+        if strict:
+            raise RuntimeError("run_batched: {} argument(s) failed.".format(len(failed)))
         pass
 
     return results
 
 
+def unravel (data, nleading=0):
+    """
+    Flatten non-flat, i.e. per-event, data to one row per jet.
+
+    Each jet row holds the scalar (per-event) fields of its event together with
+    the variable-length (per-jet) fields of the jet. The flattening is
+    vectorised: the per-event jet counts are used to broadcast the event fields
+    and to slice the leading jets of all events from the concatenated per-jet
+    arrays in bulk.
+
+    Arguments:
+        data: Numpy recarray, as read by `root_numpy`, in which per-jet fields
+            have object dtype.
+        nleading: Take only up to `nleading` jets in each event, given sorting.
+            If 0, all jets are taken.
+
+    Returns:
+        Flat numpy recarray, with event fields followed by jet fields, each in
+        alphabetical order. Events without jets are dropped. Per-jet fields have
+        the element dtype of their branch, unless `data` has no entries.
+    """
+
+    if not data.dtype.hasobject:
+        return data
+
+    # Identify variable-length (i.e. per-jet) and scalar (i.e. per-event)
+    # fields
+    jet_fields   = sorted([field for field, (kind, _) in data.dtype.fields.iteritems() if kind.hasobject])
+    event_fields = sorted([field for field in data.dtype.names if field not in jet_fields])
+
+    # Number of jets in, and to take from, each event
+    counts = np.fromiter((len(jets) for jets in data[jet_fields[0]]), dtype=np.int64, count=data.shape[0])
+    take   = np.minimum(counts, nleading) if nleading > 0 else counts
+
+    # Indices of the taken jets in the concatenated per-jet arrays, and of the
+    # event to which each belongs
+    ievent = np.repeat(np.arange(data.shape[0]), take)
+    first  = np.repeat(np.cumsum(take) - take, take)
+    ijet   = np.repeat(np.cumsum(counts) - counts, take) + (np.arange(take.sum()) - first)
+
+    # Concatenate per-jet arrays. Each entry is read by `root_numpy` as an
+    # array of the branch element type, also for events without jets, such
+    # that the dtype of the per-jet fields is kept if no event has any jets.
+    jets = dict()
+    for field in jet_fields:
+        jets[field] = np.concatenate(data[field]) if data.shape[0] else np.zeros((0,))
+        pass
+
+    # Fill output array
+    dtype  = [(field, data.dtype[field]) for field in event_fields] + \
+             [(field, jets[field].dtype) for field in jet_fields]
+    output = np.empty((ievent.shape[0],), dtype=dtype)
+    for field in event_fields:
+        output[field] = data[field][ievent]
+        pass
+    for field in jet_fields:
+        output[field] = jets[field][ijet]
+        pass
+
+    return output
+
+
+def get_dtype (data, fields, names=None):
+    """
+    Get the dtype of the array built by `build_array`.
+
+    Arguments:
+        data: Numpy recarray, or its dtype.
+        fields: List of (name, dtype, value) tuples for the fields to add, cf.
+            `build_array`.
+        names: (Optional) Names of the fields of `data` to copy. Defaults to all.
+
+    Returns:
+        Packed, structured numpy dtype with the fields of `data`, followed by
+        `fields`.
+    """
+    dtype = getattr(data, 'dtype', data)
+    names = list(dtype.names if names is None else names)
+    return np.dtype([(name, dtype[name]) for name in names] + [(name, np.dtype(field_dtype)) for name, field_dtype, _ in fields])
+
+
+def build_array (data, fields, names=None, index=None, out=None):
+    """
+    Build numpy recarray from (a selection of) the rows and fields of `data`,
+    with additional, derived fields, in a single allocation.
+
+    Adding fields one at a time, e.g. using `numpy.lib.recfunctions.append_fields`,
+    copies the entire array for each field. Instead, the final dtype is computed
+    up front, the output array is allocated once, and each field is filled in
+    place.
+
+    Arguments:
+        data: Numpy recarray.
+        fields: List of (name, dtype, value) tuples for the fields to add, in
+            order. `value` is either a scalar; an array with one entry per
+            output row; a function of the output array, called once the fields
+            of `data` have been copied, returning such an array; or `None`, in
+            which case the field is zero-filled.
+        names: (Optional) Names of the fields of `data` to copy. Defaults to all.
+        index: (Optional) Boolean mask or array of indices selecting the rows of
+            `data` to copy.
+        out: (Optional) Preallocated array with the dtype given by `get_dtype`
+            into which to build, e.g. a slice of a larger array into which
+            several inputs are concatenated.
+
+    Returns:
+        Numpy recarray with the selected rows and fields of `data`, followed by
+        `fields`.
+    """
+
+    # Get output dtype and number of rows
+    dtype = get_dtype(data, fields, names)
+    if index is not None:
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+            pass
+        pass
+    nrows = data.shape[0] if index is None else index.size
+
+    # Allocate output array
+    if out is None:
+        out = np.empty((nrows,), dtype=dtype)
+    else:
+        assert out.dtype == dtype, "build_array: Output array has dtype {}, expected {}".format(out.dtype, dtype)
+        assert out.shape == (nrows,), "build_array: Output array has shape {}, expected {}".format(out.shape, (nrows,))
+        pass
+
+    # Copy (selected rows of) existing fields, one at a time
+    for name in dtype.names[:len(dtype.names) - len(fields)]:
+        out[name] = data[name] if index is None else data[name][index]
+        pass
+
+    # Fill derived fields in place
+    for name, _, value in fields:
+        if value is None:
+            out[name] = 0
+        elif callable(value):
+            out[name] = value(out)
+        else:
+            out[name] = value
+            pass
+        pass
+
+    return out
+
+
 def get_parser (**kwargs):
     """
     General method to get argument parser for preprocessing scripts.
@@ -93,7 +383,13 @@ def get_parser (**kwargs):
                           help='Size of training datasets in millions of events.'),
                  'test': \
                      dict(action='store', type=int, required=True,
-                          help='Size of testing datasets in millions of events.')}
+                          help='Size of testing datasets in millions of events.'),
+                 'force': \
+                     dict(action='store_true',
+                          help='Process all inputs, even those which are up to date in the manifest.'),
+                 'checksum': \
+                     dict(action='store_true',
+                          help='Compare inputs to the manifest by checksum, rather than by size and modification time.')}
 
     # Validate
     kwargs = {k.replace('_','-'): v for (k,v) in kwargs.iteritems()}
@@ -114,43 +410,562 @@ def get_parser (**kwargs):
     return parser
 
 
+def add_hdf5_arguments (parser):
+    """
+    Add arguments configuring the HDF5 output, cf. `save_hdf5`, to `parser`.
+    """
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='gzip',
+                        help='Compression filter for output HDF5 file.')
+    parser.add_argument('--complevel', type=int, default=4,
+                        help='Compression level, for gzip compression (0-9).')
+    parser.add_argument('--shuffle', action='store_true',
+                        help='Apply byte-shuffle filter before compression.')
+    parser.add_argument('--chunk-rows', type=int, default=BATCH_SIZE,
+                        help='Number of rows per HDF5 chunk; aligned with the training batch size by default.')
+    return parser
+
+
+def get_hdf5_options (args):
+    """
+    Get keyword arguments for `save_hdf5` from command-line arguments, cf.
+    `add_hdf5_arguments`.
+    """
+    return dict(compression=args.compression, complevel=args.complevel,
+                shuffle=args.shuffle, chunksize=args.chunk_rows)
+
+
+def _get_dataset_options (shape, gzip=True, compression=None, complevel=4, shuffle=False, chunksize=BATCH_SIZE):
+    """
+    Get the keyword arguments for `h5py.Group.create_dataset` for a dataset of
+    `shape`, cf. `save_hdf5`.
+    """
+
+    # Check(s)
+    if compression is None:
+        compression = 'gzip' if gzip else 'none'
+        pass
+    assert compression in COMPRESSIONS, "Compression {} not supported".format(compression)
+
+    # HDF5 dataset options. Filters require chunking.
+    opts = dict()
+    if compression != 'none':
+        opts['compression'] = compression
+        if compression == 'gzip':
+            opts['compression_opts'] = complevel
+            pass
+        pass
+    if shuffle:
+        opts['shuffle'] = True
+        pass
+    if shape[0] > 0 and (chunksize or opts):
+        rows = min(chunksize or BATCH_SIZE, shape[0])
+        opts['chunks'] = (rows,) + tuple(shape[1:])
+        pass
+    return opts
+
+
 @garbage_collect
-def save_hdf5 (data, path, name='dataset', gzip=True):
+def save_hdf5 (data, path, name='dataset', gzip=True, compression=None, complevel=4, shuffle=False, chunksize=BATCH_SIZE):
     """
     Save numpy recarray to HDF5 file.
 
+    The dataset is chunked, such that it can be read partially, e.g. batch by
+    batch, without decompressing the full dataset. By default, chunks are
+    aligned with the training batch size.
+
     Arguments:
         data: Numpy recarray to be saved to file.
         path: Path to HDF5 save file.
         name: Name of dataset in which to store the data.
-        gzip: Whether to apply gzip compression to HDF5 file.
+        gzip: Whether to apply gzip compression to HDF5 file. Ignored if
+            `compression` is specified.
+        compression: Compression filter, one of `COMPRESSIONS`.
+        complevel: Compression level, for gzip compression (0-9).
+        shuffle: Whether to apply the byte-shuffle filter, which typically
+            improves compression of numeric data.
+        chunksize: Number of rows per chunk. If `None`, the dataset is stored
+            contiguously, i.e. without chunking, unless filters are applied.
     """
 
     # Ensure directory exists
     basedir = '/'.join(path.split('/')[:-1])
     if basedir: mkdir(basedir)
 
+    # HDF5 dataset options
+    opts = _get_dataset_options(data.shape, gzip, compression, complevel, shuffle, chunksize)
+
     # Save array to HDF5 file
     with h5py.File(path, 'w') as hf:
-        hf.create_dataset(name,  data=data, compression="gzip" if gzip else None)
+        hf.create_dataset(name,  data=data, **opts)
+        pass
+
+    return
+
+
+@garbage_collect
+def shuffle_hdf5 (path, output=None, name='dataset', bucket_rows=10000000, read_rows=1000000, **kwargs):
+    """
+    Shuffle the rows of the dataset in HDF5 file out-of-core, i.e. with memory
+    usage bounded by `bucket_rows` and `read_rows` rows rather than by the size
+    of the dataset.
+
+    A two-pass shuffle is used: in the first pass, the dataset is read in chunks
+    and each row is scattered to one of K on-disk buckets, chosen uniformly at
+    random; in the second pass, each bucket is read, shuffled in memory, and
+    appended to the output. The resulting permutation is uniformly random, as
+    for an in-memory shuffle, so e.g. stratified k-folds can be taken directly
+    from the output. Uses `np.random`, such that results are reproducible given
+    the seed.
+
+    Arguments:
+        path: Path to HDF5 file to be shuffled.
+        output: (Optional) Path to output HDF5 file. Defaults to `path`, in
+            which case the file is replaced once the shuffle is done.
+        name: Name of dataset to shuffle.
+        bucket_rows: Maximal expected number of rows per bucket, i.e. held in
+            memory in the second pass.
+        read_rows: Number of rows to read at a time in the first pass.
+        kwargs: Options for the output dataset, e.g. its `chunksize`, cf.
+            `save_hdf5`.
+    """
+
+    # Check(s)
+    if output is None:
+        output = path
+        pass
+    assert bucket_rows > 0
+    assert read_rows > 0
+
+    buckets_path = output + '.buckets.tmp'
+    output_path  = output + '.tmp'
+
+    try:
+        with h5py.File(path, 'r') as hf_in, h5py.File(buckets_path, 'w') as hf_buckets:
+            dataset = hf_in[name]
+            nrows   = dataset.shape[0]
+            dtype   = dataset.dtype
+            num_buckets = max(int(np.ceil(nrows / float(bucket_rows))), 1)
+            buckets = [hf_buckets.create_dataset('bucket_{}'.format(ix), shape=(0,), maxshape=(None,),
+                                                 dtype=dtype, chunks=(min(read_rows, BATCH_SIZE * 8),))
+                       for ix in range(num_buckets)]
+
+            # First pass: Scatter rows to random buckets
+            for start in range(0, nrows, read_rows):
+                chunk  = dataset[start:start + read_rows]
+                assign = np.random.randint(num_buckets, size=chunk.shape[0])
+                order  = np.argsort(assign, kind='mergesort')
+                counts = np.bincount(assign, minlength=num_buckets)
+                chunk  = chunk[order]
+                offset = 0
+                for bucket, count in zip(buckets, counts):
+                    if count:
+                        size = bucket.shape[0]
+                        bucket.resize((size + count,))
+                        bucket[size:size + count] = chunk[offset:offset + count]
+                        offset += count
+                        pass
+                    pass
+                del chunk, assign, order
+                pass
+
+            # Second pass: Shuffle each bucket in memory, and gather
+            with h5py.File(output_path, 'w') as hf_out:
+                out = hf_out.create_dataset(name, shape=(nrows,), dtype=dtype, **_get_dataset_options((nrows,), **kwargs))
+                offset = 0
+                for bucket in buckets:
+                    data = bucket[:]
+                    np.random.shuffle(data)
+                    out[offset:offset + data.shape[0]] = data
+                    offset += data.shape[0]
+                    del data
+                    pass
+                assert offset == nrows
+                pass
+            pass
+
+        os.rename(output_path, output)
+    finally:
+        for tmp in [buckets_path, output_path]:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+                pass
+            pass
         pass
 
     return
 
 
 @garbage_collect
-def load_hdf5 (path, name='dataset'):
+def load_hdf5 (path, name='dataset', out=None):
     """
     Load numpy recarray from HDF5 file.
 
     Arguments:
         path: Path to HDF5 from which to read array.
         name: Name of dataset in which data is stored.
+        out: (Optional) Preallocated, contiguous array into which to read the
+            data directly, e.g. a slice of a `shared_array`. Must have the
+            shape and dtype of the stored dataset.
     """
 
     # Load array from HDF5 file
     with h5py.File(path, 'r') as hf:
-        data = hf[name][:]
+        if out is None:
+            data = hf[name][:]
+        else:
+            hf[name].read_direct(out)
+            data = out
+            pass
         pass
 
     return data
+
+
+def get_hdf5_info (path, name='dataset'):
+    """
+    Get the shape and dtype of the dataset stored in HDF5 file, without reading
+    any of the data.
+
+    Arguments:
+        path: Path to HDF5 file.
+        name: Name of dataset in which data is stored.
+    """
+    with h5py.File(path, 'r') as hf:
+        return hf[name].shape, hf[name].dtype
+
+
+def shared_array (shape, dtype):
+    """
+    Allocate a numpy array backed by anonymous, shared memory.
+
+    Processes forked after the allocation, e.g. by `run_batched`, can write
+    into (slices of) the array in place, with the result visible to the parent
+    process without any pickling or copying.
+
+    Arguments:
+        shape: Shape of array.
+        dtype: Numpy dtype of array, possibly structured.
+    """
+    dtype  = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    buffer = mmap.mmap(-1, max(nbytes, 1))
+    return np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def file_info (path, checksum=False):
+    """
+    Get the information identifying the contents of the file at `path`.
+
+    Arguments:
+        path: Path to file.
+        checksum: Whether to include the MD5 digest of the file contents.
+
+    Returns:
+        Dict with the size and modification time, and (opt.) the MD5 digest, of
+        the file.
+    """
+    stat = os.stat(path)
+    info = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if checksum:
+        info['md5'] = file_digest(path)
+        pass
+    return info
+
+
+def _same_file (path, info, checksum=False):
+    """
+    Check whether the file at `path` is unchanged with respect to `info`, cf.
+    `file_info`. If `checksum`, and `info` has a digest, the file contents are
+    compared; otherwise only the size and modification time.
+    """
+    if not info or not os.path.isfile(path):
+        return False
+    if checksum and 'md5' in info:
+        return file_digest(path) == info['md5']
+    current = file_info(path)
+    return current['size'] == info['size'] and current['mtime'] == info['mtime']
+
+
+def load_manifest (directory, stage):
+    """
+    Load the manifest of `stage` in `directory`.
+
+    The manifest records, for each output file produced by `stage`, the input
+    files from which it was produced (cf. `file_info`), the configuration used
+    (e.g. the selection and the list of branches), and the output file itself,
+    such that reruns only need to process new or changed inputs.
+
+    Arguments:
+        directory: Directory holding the manifest.
+        stage: Name of the preprocessing stage, e.g. 'convert'.
+
+    Returns:
+        Dict of {output path: entry}; empty if no manifest exists.
+    """
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.isfile(path):
+        return dict()
+    with open(path, 'r') as f:
+        return json.load(f).get(stage, dict())
+
+
+def save_manifest (directory, stage, manifest):
+    """
+    Save the manifest of `stage` to `directory`, cf. `load_manifest`, leaving
+    the manifests of other stages untouched. The file is replaced atomically.
+    """
+    mkdir(directory)
+    path = os.path.join(directory, MANIFEST)
+    manifests = dict()
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            manifests = json.load(f)
+            pass
+        pass
+    manifests[stage] = manifest
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifests, f, indent=2, sort_keys=True)
+        pass
+    os.rename(path + '.tmp', path)
+    return
+
+
+def manifest_entry (inputs, output, config, checksum=False):
+    """
+    Get the manifest entry for `output`, produced from the files `inputs` with
+    the configuration `config`, cf. `load_manifest`.
+    """
+    return {'inputs': {path: file_info(path, checksum) for path in inputs},
+            'output': file_info(output),
+            'config': config}
+
+
+def is_up_to_date (manifest, inputs, output, config, checksum=False):
+    """
+    Check whether `output` is up to date, i.e. whether it has been produced
+    from the unchanged files `inputs` with the same `config`, according to
+    `manifest`.
+
+    Arguments:
+        manifest: Manifest, as returned by `load_manifest`.
+        inputs: List of paths to input files from which `output` is produced.
+        output: Path to output file.
+        config: JSON-serialisable configuration, e.g. as returned by
+            `adversarial.utils.get_cache_key`.
+        checksum: Whether to compare the input files by checksum, where
+            available.
+    """
+    entry = manifest.get(output)
+    if entry is None or entry['config'] != config:
+        return False
+    if set(entry['inputs']) != set(inputs):
+        return False
+    if not _same_file(output, entry['output']):
+        return False
+    return all(_same_file(path, entry['inputs'][path], checksum) for path in inputs)
+
+
+def prune_manifest (manifest):
+    """
+    Remove the entries, and output files, in `manifest` whose input files no
+    longer exist, such that they are not picked up by downstream stages.
+
+    Returns:
+        List of removed output files.
+    """
+    removed = list()
+    for output, entry in manifest.items():
+        if all(os.path.isfile(path) for path in entry['inputs']):
+            continue
+        if os.path.isfile(output):
+            os.remove(output)
+            pass
+        del manifest[output]
+        removed.append(output)
+        pass
+    return removed
+
+
+def update_manifest (directory, stage, manifest, jobs, config, since, checksum=False):
+    """
+    Record the outputs of `jobs` produced by the current run in `manifest`, and
+    save it to `directory`, cf. `save_manifest`.
+
+    Only outputs written after `since` are recorded, such that the inputs of
+    failed processes are processed again in the next run.
+
+    Arguments:
+        directory: Directory holding the manifest.
+        stage: Name of the preprocessing stage.
+        manifest: Manifest, as returned by `load_manifest`.
+        jobs: List of (inputs, output) tuples, with `inputs` a list of paths.
+        config: Configuration with which the outputs were produced.
+        since: Start time of the run, in seconds since the epoch.
+        checksum: Whether to record the digests of the input files.
+    """
+    for inputs, output in jobs:
+        manifest.pop(output, None)
+        if os.path.isfile(output) and os.path.getmtime(output) >= int(since):
+            manifest[output] = manifest_entry(inputs, output, config, checksum)
+            pass
+        pass
+    save_manifest(directory, stage, manifest)
+    return
+
+
+class FlatReweighter (object):
+    """
+    Histogram-based reweighter to a flat target distribution, e.g. flat pT.
+
+    For a flat target, the weight of each sample is the ratio of the expected,
+    flat target histogram to the (weighted) histogram of the original samples
+    in the bin to which it belongs, i.e. the inverse of the original density.
+    The target is computed analytically, without drawing random target samples,
+    such that the weights are deterministic. The original histogram is filled
+    in a single pass, optionally in chunks, cf. `partial_fit`, for data which do
+    not fit in memory.
+    """
+
+    def __init__ (self, bins=100, range=None, binning='linear', smoothing=1., normalise=True):
+        """
+        Arguments:
+            bins: Number of bins, or array of bin edges.
+            range: (Optional) Tuple of (min, max) of the flat target
+                distribution. Defaults to the range of the fitted samples.
+            binning: Either 'linear', for equal widths, or 'quantile', for
+                bins with equal numbers of (unweighted) fitted samples. The
+                default reproduces the binning of the previously used
+                `hep_ml.reweight.BinsReweighter`, whose bin edges were the
+                quantiles of the flat target. Ignored if `bins` is an array of
+                edges.
+            smoothing: Width, in bins, of the Gaussian kernel with which the
+                histograms are smoothed. If 0, no smoothing is applied.
+            normalise: Whether to scale the weights to unit mean on the fitted
+                samples.
+        """
+
+        # Check(s)
+        assert binning in ['quantile', 'linear'], "FlatReweighter: Binning {} not supported".format(binning)
+        assert smoothing >= 0
+
+        # Member variable(s)
+        self.bins      = bins
+        self.range     = range
+        self.binning   = binning
+        self.smoothing = smoothing
+        self.normalise = normalise
+        self.edges     = None
+        self.hist      = None
+        self.count     = 0
+        self.bin_weights = None
+        return
+
+
+    def _set_edges (self, x):
+        """Set the bin edges and target range from the samples `x`."""
+        if self.range is None:
+            self.range = (x.min(), x.max())
+            pass
+        if not np.isscalar(self.bins):
+            self.edges = np.asarray(self.bins, dtype=np.float64)
+        elif self.binning == 'quantile':
+            inside = x[(x >= self.range[0]) & (x <= self.range[1])]
+            self.edges = np.percentile(inside, np.linspace(0, 100, self.bins + 1)).astype(np.float64)
+            self.edges[[0, -1]] = self.range
+        else:
+            self.edges = np.linspace(self.range[0], self.range[1], self.bins + 1)
+            pass
+        self.hist = np.zeros((len(self.edges) - 1,), dtype=np.float64)
+        return
+
+
+    def _digitise (self, x):
+        """Get the bin index of each of the samples `x`, clipped to the range."""
+        return np.clip(np.searchsorted(self.edges, x, side='right') - 1, 0, len(self.hist) - 1)
+
+
+    def _smooth (self, hist):
+        """Smooth `hist` with a Gaussian kernel, reflecting at the edges."""
+        if not self.smoothing:
+            return hist
+        radius = min(int(np.ceil(2.5 * self.smoothing)), len(hist) - 1)
+        kernel = np.exp(-0.5 * np.square(np.arange(-radius, radius + 1) / float(self.smoothing)))
+        kernel /= kernel.sum()
+        return np.convolve(np.pad(hist, radius, mode='symmetric'), kernel, mode='valid')
+
+
+    def partial_fit (self, x, original_weight=None):
+        """
+        Fill the original histogram with the samples `x`, e.g. one chunk of a
+        dataset at a time. The bin edges are set from the first chunk, unless
+        given explicitly. Call `finalise` once all chunks have been added.
+
+        Arguments:
+            x: Array of original samples.
+            original_weight: (Optional) Array of original sample weights.
+        """
+        x = np.asarray(x)
+        if self.edges is None:
+            self._set_edges(x)
+            pass
+        self.hist  += np.bincount(self._digitise(x), weights=original_weight, minlength=len(self.hist))
+        self.count += x.size
+        return self
+
+
+    def finalise (self):
+        """
+        Compute the per-bin weights from the filled original histogram.
+        """
+
+        # Analytical, flat target histogram, with the same total as the original
+        lower  = np.clip(self.edges[:-1], *self.range)
+        upper  = np.clip(self.edges[1:],  *self.range)
+        target = (upper - lower) / float(self.range[1] - self.range[0]) * self.hist.sum()
+
+        # Per-bin weights
+        original = self._smooth(self.hist)
+        target   = self._smooth(target)
+        self.bin_weights = np.zeros_like(target)
+        np.divide(target, original, out=self.bin_weights, where=original > 0)
+
+        # (Opt.) Scale to unit mean on the fitted samples
+        if self.normalise and self.count:
+            self.bin_weights *= self.count / np.dot(self.hist, self.bin_weights)
+            pass
+        return self
+
+
+    def fit (self, x, original_weight=None):
+        """
+        Fit the reweighter to the original samples `x`, in a single pass.
+
+        Arguments:
+            x: Array of original samples.
+            original_weight: (Optional) Array of original sample weights.
+        """
+        self.edges = None
+        self.hist  = None
+        self.count = 0
+        return self.partial_fit(x, original_weight).finalise()
+
+
+    def predict_weights (self, x, original_weight=None):
+        """
+        Get the flattening weights of the samples `x`.
+
+        Arguments:
+            x: Array of samples.
+            original_weight: (Optional) Array of original sample weights, by
+                which the flattening weights are multiplied.
+
+        Returns:
+            Array of weights.
+        """
+        assert self.bin_weights is not None, "FlatReweighter: Call `fit` or `finalise` before `predict_weights`."
+        weights = self.bin_weights[self._digitise(x)]
+        if original_weight is not None:
+            weights = weights * original_weight
+            pass
+        return weights
+    pass
@@ -7,11 +7,15 @@ Script for converting W/top tagging ntuples to HDF5 files.
 > 1. Convert
   2. Slim
   3. Reweight
+
+All three stages can be run in a single script, without
+intermediate files, using `pipeline.py`.
 """
 
 # Basic import(s)
 import re
 import glob
+import time
 import multiprocessing
 
 # Get ROOT to stop hogging the command-line options
@@ -21,16 +25,16 @@ import root_numpy
 
 # Scientific import(s)
 import numpy as np
-from numpy.lib import recfunctions
 
 # Project import(s)
-from adversarial.utils import garbage_collect
+from adversarial.utils import garbage_collect, get_cache_key
 from adversarial.profile import Profile, profile
-from .common import load_hdf5, save_hdf5, get_parser, run_batched
+from .common import load_hdf5, save_hdf5, get_parser, run_batched, build_array
+from .common import load_manifest, is_up_to_date, prune_manifest, update_manifest
 
 # Command-line arguments parser
-parser = get_parser(input=True, output=True, max_processes=True)
-parser.description = "Convert ntuples to HDF5."
+parser = get_parser(input=True, output=True, max_processes=True, force=True, checksum=True)
+parser.description = "Convert ntuples to HDF5. Only new or changed input files are converted, cf. the manifest in the output directory."
 
 # Global definition(s)
 SELECTION = {
@@ -135,6 +139,45 @@ def rename (name):
     return name
 
 
+def convert (tree, key, start=None, stop=None):
+    """
+    Read and convert (a range of entries in) standard-format W/top tagging
+    ROOT tree.
+
+    Arguments:
+        tree: ROOT.TTree to be converted.
+        key: Class to which `tree` belongs, i.e. 'sig' or 'bkg'.
+        start, stop: (Optional) Range of entries to read.
+
+    Returns:
+        Numpy recarray with the selected samples.
+    """
+
+    # Read in data as a numpy recarray
+    data = root_numpy.tree2array(tree, branches=BRANCHES, selection=SELECTION[key], start=start, stop=stop)
+
+    # Rename columns
+    data.dtype.names = map(rename, data.dtype.names)
+
+    # Rescale energy-type variables (MeV -> GeV)
+    data['m']        /= 1000.
+    data['pt']       /= 1000.
+    data['truth_pt'] /= 1000.
+
+    # Add `signal` column
+    data = build_array(data, [('signal', int, int(1 if key == 'sig' else 0))])
+    return data
+
+
+def get_output_path (path, key, output):
+    """
+    Get the path of the HDF5 file to which the ROOT file at `path`, belonging to
+    class `key`, is converted in directory `output`.
+    """
+    filename = path.split('/')[-1].replace('.root', '') + '_full.h5'
+    return output + key + '/' + filename
+
+
 # Main function definition
 @profile
 def main ():
@@ -152,6 +195,13 @@ def main ():
 
     path_pattern = args.input + 'submitDir-{}*/data-tree/*.root'
 
+    # Load manifest of previous conversions, and remove outputs of input files
+    # which no longer exist
+    manifest = load_manifest(args.output, 'convert')
+    for output in prune_manifest(manifest):
+        print "Removed {}, since its input file no longer exists.".format(output)
+        pass
+
     # Loop classes
     for key in SELECTION.keys():
         print "\n== {}".format(key)
@@ -160,11 +210,23 @@ def main ():
         paths = sorted(glob.glob(path_pattern.format('wprime' if key == 'sig' else 'JZ')))
         print "   Found {} input data files.".format(len(paths))
 
-        if len(paths) == 0:
+        # Select new or changed input files
+        config = get_cache_key(key=key, selection=SELECTION[key], branches=BRANCHES)
+        jobs   = [([path], get_output_path(path, key, args.output)) for path in paths]
+        if not args.force:
+            jobs = [(inputs, output) for inputs, output in jobs if not is_up_to_date(manifest, inputs, output, config, args.checksum)]
+            print "   {} input data files are new or changed.".format(len(jobs))
+            pass
+
+        if len(jobs) == 0:
             continue
 
         # Run batched conversion in parallel
-        run_batched(FileConverter, [(path, key, args) for path in paths], max_processes=args.max_processes)
+        since = time.time()
+        run_batched(FileConverter, [(inputs[0], key, args) for inputs, _ in jobs], max_processes=args.max_processes)
+
+        # Record outputs in manifest
+        update_manifest(args.output, 'convert', manifest, jobs, config, since, args.checksum)
         pass
 
     return
@@ -206,25 +268,12 @@ class FileConverter (multiprocessing.Process):
         f = ROOT.TFile(self.__path, 'READ')
         t = f.Get('FlatSubstructureJetTree')
 
-        # Read in data as a numpy recarray
-        data = root_numpy.tree2array(t, branches=BRANCHES, selection=SELECTION[self.__key])
+        # Read in and convert data
+        data = convert(t, self.__key)
         print "     Got {:8d}/{:8d} samples ({})".format(data.size, t.GetEntries(), identifier)
 
-        # Rename columns
-        data.dtype.names = map(rename, data.dtype.names)
-
-        # Rescale energy-type variables (MeV -> GeV)
-        data['m']        /= 1000.
-        data['pt']       /= 1000.
-        data['truth_pt'] /= 1000.
-
-        # Add `signal` column
-        signal = (np.ones((data.shape[0],)) * int(1 if self.__key == 'sig' else 0)).astype(int)
-        data = recfunctions.append_fields(data, 'signal', signal)
-
         # Writing output HDF5 file
-        filename = self.__path.split('/')[-1].replace('.root', '') + '_full.h5'
-        save_hdf5(data, self.__args.output + self.__key + '/' + filename)
+        save_hdf5(data, get_output_path(self.__path, self.__key, self.__args.output))
         return
     pass
 
@@ -8,12 +8,12 @@ from glob import glob
 
 # Scientific import(s)
 import numpy as np
-import numpy.lib.recfunctions as rfn
 import ROOT
 import root_numpy
 
 # Project import(s)
 from adversarial.profile import profile
+from .common import unravel, get_dtype, build_array
 
 # Global variable definition(s)
 COLLECTION = 'AntiKt10LCTopoTrimmedPtFrac5SmallR20JetsCalibSelect'
@@ -27,42 +27,6 @@ def rename (name):
     return name
 
 
-def unravel (data):
-    """
-    ...
-    """
-    
-    if not data.dtype.hasobject:
-        return data
-
-    # Identify variable-length (i.e. per-jet) and scalar (i.e. per-event)
-    # fields
-    jet_fields = list()
-    for field, (kind, _) in data.dtype.fields.iteritems():
-        if kind.hasobject:
-            jet_fields.append(field)
-            pass
-        pass
-    jet_fields   = sorted(jet_fields)
-    event_fields = sorted([field for field in data.dtype.names if field not in jet_fields])
-
-    # Loop events, take up to `nleading` jets from each (@TODO: pT-ordered?)
-    jets = list()
-    data_events = data[event_fields]
-    data_jets   = data[jet_fields]
-    
-    rows = list()
-    for jets, event in zip(data_jets, data_events):
-        for jet in np.array(jets.tolist()).T:
-            row = event.copy()
-            row = rfn.append_fields(row, jet_fields, jet.tolist(), usemask=False)
-            rows.append(row)
-            pass
-        pass
-        
-    return np.concatenate(rows)
-
-
 # Main function definition.
 @profile
 def main (sig, bkg, treename='jetTree/nominal', shuffle=True, sample=None, seed=21, replace=True, nleading=2, frac_train=0.8):
@@ -98,25 +62,30 @@ def main (sig, bkg, treename='jetTree/nominal', shuffle=True, sample=None, seed=
     data_sig = unravel(data_sig)
     data_bkg = unravel(data_bkg)
 
-    # Append signal fields
-    data_sig = rfn.append_fields(data_sig, "signal", np.ones ((data_sig.shape[0],)), usemask=False)
-    data_bkg = rfn.append_fields(data_bkg, "signal", np.zeros((data_bkg.shape[0],)), usemask=False)
-
-    # Concatenate arrays
-    data = np.concatenate((data_sig, data_bkg))
-
     # Rename columns
-    data.dtype.names = map(rename, data.dtype.names)
+    data_sig.dtype.names = map(rename, data_sig.dtype.names)
+    data_bkg.dtype.names = map(rename, data_bkg.dtype.names)
 
     # Object selection
-    msk = (data['fjet_pt'] > 10.) & (data['fjet_JetConstitScaleMomentum_m'] > 10.)
-    data = data[msk]
-
-    # Append rhoDDT field
-    data = rfn.append_fields(data, "rhoDDT", np.log(np.square(data['fjet_JetConstitScaleMomentum_m']) / data['fjet_pt']), usemask=False)
-
-    # Append train field
-    data = rfn.append_fields(data, "train", rng.rand(data.shape[0]) < frac_train, usemask=False)
+    msk_sig = (data_sig['fjet_pt'] > 10.) & (data_sig['fjet_JetConstitScaleMomentum_m'] > 10.)
+    msk_bkg = (data_bkg['fjet_pt'] > 10.) & (data_bkg['fjet_JetConstitScaleMomentum_m'] > 10.)
+
+    # Concatenate selected signal and background samples, and append signal,
+    # rhoDDT, and train fields, in a single allocation
+    dtype = np.result_type(data_sig.dtype['fjet_JetConstitScaleMomentum_m'], data_sig.dtype['fjet_pt'])
+    def fields (signal):
+        return [("signal", float, signal),
+                ("rhoDDT", dtype, lambda d: np.log(np.square(d['fjet_JetConstitScaleMomentum_m']) / d['fjet_pt'])),
+                ("train",  bool,  None)]
+
+    num_sig = msk_sig.sum()
+    data = np.empty((num_sig + msk_bkg.sum(),), dtype=get_dtype(data_sig, fields(1.)))
+    build_array(data_sig, fields(1.), index=msk_sig, out=data[:num_sig])
+    build_array(data_bkg, fields(0.), index=msk_bkg, out=data[num_sig:])
+    del data_sig, data_bkg
+
+    # Fill train field
+    data["train"] = rng.rand(data.shape[0]) < frac_train
 
     # (Opt.) Shuffle
     if shuffle:
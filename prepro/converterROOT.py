@@ -3,18 +3,21 @@
 
 # Basic import(s)
 import h5py
+import fnmatch
 import argparse
 import itertools
+import multiprocessing
 from glob import glob
 
 # Scientific import(s)
 import numpy as np
-import numpy.lib.recfunctions as rfn
 import ROOT
 import root_numpy
 
 # Project import(s)
-from adversarial.profile import profile
+from adversarial.utils import garbage_collect
+from adversarial.profile import Profile, profile
+from .common import unravel, get_dtype, build_array, run_batched, shared_array
 
 # Command-line argument parser
 parser = argparse.ArgumentParser(description="Convert generally non-flat ROOT file(s) to single HDF5 file")
@@ -42,50 +45,79 @@ parser.add_argument('--seed', type=int, default=21,
                     help="Random-number generator seed, for reproducibility.")
 parser.add_argument('--nleading', type=int, default=2,
                     help="Take only up to `nleading` jets in each event, given sorting.")
+parser.add_argument('--branches', nargs='+', default=None,
+                    help="Branches to read, after renaming, supporting wild-cards. By default, all branches are read.")
+parser.add_argument('--max-processes', type=int, default=5,
+                    help="Maximum number of files to read concurrently.")
+
+# Global variable definition(s)
+VAR_M      = 'fjet_JetConstitScaleMomentum_m'
+VAR_PT     = 'fjet_pt'
+VAR_RHO    = 'fjet_rho'    # New variable
+VAR_RHODDT = 'fjet_rhoDDT' # New variable
 
 
 # Utility function(s)
 glob_sort_list = lambda paths: sorted(list(itertools.chain.from_iterable(map(glob, paths))))
 
 
-def unravel (data, nleading):
+def rename (name, collection):
+    """Rename jet collection `collection` to `fjet` in branch `name`."""
+    return name.replace(collection, 'fjet')
+
+
+def get_fields (dtype, signal):
     """
-    ...
+    Get the fields appended to the data, cf. `build_array`.
+
+    Arguments:
+        dtype: Numpy dtype of the (renamed) data.
+        signal: Value of the `signal` field.
     """
-    
-    if not data.dtype.hasobject:
-        return data
+    rho_dtype = np.result_type(dtype[VAR_M], dtype[VAR_PT])
+    return [("signal",   float,     signal),
+            (VAR_RHO,    rho_dtype, lambda d: np.log(d[VAR_M]**2 / d[VAR_PT]**2)),
+            (VAR_RHODDT, rho_dtype, lambda d: np.log(d[VAR_M]**2 / d[VAR_PT] / 1.)),
+            ("train",    bool,      None)]
 
-    if nleading == 0:
-        nleading = 99999
-        pass
 
-    # Identify variable-length (i.e. per-jet) and scalar (i.e. per-event)
-    # fields
-    jet_fields = list()
-    for field, (kind, _) in data.dtype.fields.iteritems():
-        if kind.hasobject:
-            jet_fields.append(field)
-            pass
-        pass
-    jet_fields   = sorted(jet_fields)
-    event_fields = sorted([field for field in data.dtype.names if field not in jet_fields])
-
-    # Loop events, take up to `nleading` jets from each
-    jets = list()
-    data_events = data[event_fields]
-    data_jets   = data[jet_fields]
-    
-    rows = list()
-    for jets, event in zip(data_jets, data_events):
-        for jet in np.array(jets.tolist()).T[:nleading]:
-            row = event.copy()
-            row = rfn.append_fields(row, jet_fields, jet.tolist(), usemask=False)
-            rows.append(row)
-            pass
-        pass
-        
-    return np.concatenate(rows)
+def get_entries (path, treename):
+    """Get the number of entries in the TTree `treename` in the ROOT file at `path`."""
+    f = ROOT.TFile(path, 'READ')
+    t = f.Get(treename)
+    num_entries = t.GetEntries() if t else 0
+    f.Close()
+    return num_entries
+
+
+def read (path, treename, branches, collection, nleading, start=None, stop=None):
+    """
+    Read, unravel, and rename the jets in a single ROOT file, and perform the
+    object selection.
+
+    Arguments:
+        path: Path to ROOT file.
+        treename: Name of ROOT TTree to be read.
+        branches: List of (original) names of the branches to read, or `None`
+            for all branches.
+        collection: Name of jet collection, which is renamed to `fjet`.
+        nleading: Take only up to `nleading` jets in each event.
+        start, stop: (Optional) Range of entries to read.
+
+    Returns:
+        Tuple of flat numpy recarray, and boolean mask of selected jets.
+    """
+
+    # Read in, and (opt.) unravel non-flat data
+    data = root_numpy.root2array(path, treename=treename, branches=branches, start=start, stop=stop)
+    data = unravel(data, nleading)
+
+    # Rename columns
+    data.dtype.names = [rename(name, collection) for name in data.dtype.names]
+
+    # Object selection
+    msk = (data[VAR_PT] > 10.) & (data[VAR_M] > 10.) # @TODO: Generalise?
+    return data, msk
 
 
 # Main function definition.
@@ -110,11 +142,6 @@ def main ():
     # Convenience
     shuffle = not args.no_shuffle
 
-    # Renaming method
-    def rename (name):
-        name = name.replace(args.collection, 'fjet')
-        return name
-
     # For reproducibility
     rng = np.random.RandomState(seed=args.seed)
 
@@ -124,40 +151,47 @@ def main ():
 
     print "Found {} signal and {} background files.".format(len(sig), len(bkg))
 
-    # Read in data
-    data_sig = root_numpy.root2array(sig, treename=args.treename)
-    data_bkg = root_numpy.root2array(bkg, treename=args.treename)
-
-    # (Opt.) Unravel non-flat data
-    data_sig = unravel(data_sig, args.nleading)
-    data_bkg = unravel(data_bkg, args.nleading)
-
-    # Append signal fields
-    data_sig = rfn.append_fields(data_sig, "signal", np.ones ((data_sig.shape[0],)), usemask=False)
-    data_bkg = rfn.append_fields(data_bkg, "signal", np.zeros((data_bkg.shape[0],)), usemask=False)
-
-    # Concatenate arrays
-    data = np.concatenate((data_sig, data_bkg))
-
-    # Rename columns
-    data.dtype.names = map(rename, data.dtype.names)
-
-    # Variable names
-    var_m      = 'fjet_JetConstitScaleMomentum_m'
-    var_pt     = 'fjet_pt'
-    var_rho    = 'fjet_rho'    # New variable
-    var_rhoDDT = 'fjet_rhoDDT' # New variable
-
-    # Object selection
-    msk = (data[var_pt] > 10.) & (data[var_m] > 10.) # @TODO: Generalise?
-    data = data[msk]
+    # Get the (original) names of the branches to read, and the dtype of the
+    # output, from the first entry of the first non-empty file. The per-jet
+    # fields have the element type of their branch, also if that entry has no
+    # jets, cf. `unravel`.
+    first    = next((path for path in sig + bkg if get_entries(path, args.treename)), sig[0])
+    probe, _ = read(first, args.treename, None, args.collection, args.nleading, stop=1)
+    original = {rename(name, args.collection): name for name in root_numpy.list_branches(first, treename=args.treename)}
+    if args.branches is None:
+        branches = None
+        names    = list(probe.dtype.names)
+    else:
+        names = [name for name in probe.dtype.names if name in [VAR_M, VAR_PT] or
+                 any(fnmatch.fnmatch(name, pattern) for pattern in args.branches)]
+        branches = [original[name] for name in names]
+        print "Reading {} of {} branches.".format(len(names), len(probe.dtype.names))
+        pass
+    dtype = get_dtype(probe, get_fields(probe.dtype, 1.), names=names)
+    del probe
+
+    # Common arguments for reading each file, in order: signal, then background
+    vargs = [(path, args, branches, names, 1.) for path in sig] + \
+            [(path, args, branches, names, 0.) for path in bkg]
+
+    # Count selected jets in each file, reading only the selection variables
+    with Profile("Counting selected jets"):
+        queue = multiprocessing.Queue()
+        counts  = run_batched(FileReader, [varg + (None,) for varg in vargs],
+                              queue=queue, max_processes=args.max_processes, strict=True)
+        offsets = np.cumsum([0] + counts)
+        pass
 
-    # Append rhoDDT field
-    data = rfn.append_fields(data, var_rho,    np.log(data[var_m]**2 / data[var_pt]**2),   usemask=False)
-    data = rfn.append_fields(data, var_rhoDDT, np.log(data[var_m]**2 / data[var_pt] / 1.), usemask=False)
+    # Read selected jets from each file directly into a preallocated, shared
+    # output array, and append signal, rho, rhoDDT, and train fields
+    with Profile("Reading {} selected jets".format(offsets[-1])):
+        data = shared_array((offsets[-1],), dtype)
+        run_batched(FileReader, [varg + (data[start:stop],) for varg, start, stop in zip(vargs, offsets[:-1], offsets[1:])],
+                    max_processes=args.max_processes, strict=True)
+        pass
 
-    # Append train field
-    data = rfn.append_fields(data, "train", rng.rand(data.shape[0]) < args.frac_train, usemask=False)
+    # Fill train field
+    data["train"] = rng.rand(data.shape[0]) < args.frac_train
 
     # (Opt.) Shuffle
     if shuffle:
@@ -176,6 +210,63 @@ def main ():
 
     return 
 
+
+class FileReader (multiprocessing.Process):
+
+    def __init__ (self, vargs):
+        """
+        Process for reading a single, generally non-flat ROOT file, and either
+        counting the selected jets, or building them into a slice of the
+        preallocated output array.
+
+        Arguments:
+            path: Path to the ROOT file to be read.
+            args: Namespace containing command-line arguments.
+            branches: List of (original) names of the branches to read, or
+                `None` for all branches.
+            names: List of (renamed) names of the fields to read.
+            signal: Value of the `signal` field for jets in the file.
+            out: Slice of the shared output array into which to build the
+                selected jets, or `None` to only count them.
+        """
+
+        # Unpack input arguments
+        path, args, branches, names, signal, out = vargs
+
+        # Base class constructor
+        super(FileReader, self).__init__()
+
+        # Member variable(s)
+        self.__path     = path
+        self.__args     = args
+        self.__branches = branches
+        self.__names    = names
+        self.__signal   = signal
+        self.__out      = out
+        self.queue      = None  # Set by the runner script.
+        self.index      = None  # Set by the runner script.
+        return
+
+
+    @garbage_collect
+    def run (self):
+
+        args = self.__args
+
+        # Count selected jets, reading only the selection variables
+        if self.__out is None:
+            original = {rename(name, args.collection): name for name in root_numpy.list_branches(self.__path, treename=args.treename)}
+            _, msk = read(self.__path, args.treename, [original[VAR_M], original[VAR_PT]], args.collection, args.nleading)
+            self.queue.put((self.index, int(msk.sum())))
+            return
+
+        # Read selected jets into output array
+        data, msk = read(self.__path, args.treename, self.__branches, args.collection, args.nleading)
+        build_array(data, get_fields(data.dtype, self.__signal), names=self.__names, index=msk, out=self.__out)
+        return
+    pass
+
+
 # Main function call.
 if __name__ == '__main__':
     main()
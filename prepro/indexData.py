@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script for indexing the final HDF5 dataset, such that the train/test and
+signal/background selections in `load_data` are performed on disk.
+"""
+
+# Basic import(s)
+import argparse
+
+# Project import(s)
+from adversarial.utils import index_data, INDEX_VARIABLES
+from adversarial.profile import profile
+
+# Command-line argument parser
+parser = argparse.ArgumentParser(description="Rewrite HDF5 dataset in indexed, table format.")
+parser.add_argument('path',
+                    help="Path to the HDF5 file to be indexed.")
+parser.add_argument('--dataset', default='dataset',
+                    help="Name of dataset in the HDF5 file.")
+parser.add_argument('--output', default=None,
+                    help="Name of output HDF5 file. By default, the input file is replaced.")
+parser.add_argument('--chunksize', type=int, default=1000000,
+                    help="Number of rows to convert at a time.")
+
+
+# Main function definition
+@profile
+def main ():
+
+    # Parse command-line argument
+    args = parser.parse_args()
+
+    print "Indexing {} on: {}".format(args.path, ', '.join(INDEX_VARIABLES))
+    index_data(args.path, INDEX_VARIABLES, name=args.dataset, output=args.output, chunksize=args.chunksize)
+    return
+
+
+# Main function call
+if __name__ == '__main__':
+    main()
+    pass
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script for producing the final dataset from W/top tagging ntuples without
+intermediate files.
+
+> 1. Convert
+> 2. Slim
+> 3. Reweight
+
+The ROOT trees are read in chunks, each of which is converted and slimmed in
+memory; the intermediate `_full.h5` and `_slim.h5` files are never written. The
+selected samples in each file are first counted, reading only the selection
+variables, and the slimmed chunks are then written directly into a shared
+array at per-file offsets, such that the slimmed data are held in memory only
+once. These are then reweighted, split, and shuffled, and the final dataset is
+written once. The per-stage scripts remain available, and use the same stage
+functions: `convertData.convert`, `slimData.slim`, and `reweightData.finalise`.
+"""
+
+# Basic import(s)
+import re
+import os
+import glob
+import multiprocessing
+
+# Get ROOT to stop hogging the command-line options
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+import root_numpy
+
+# Scientific import(s)
+import numpy as np
+
+# Project import(s)
+from adversarial.utils import garbage_collect
+from adversarial.profile import Profile, profile
+from .common import save_hdf5, shuffle_hdf5, get_parser, run_batched, add_hdf5_arguments, get_hdf5_options, shared_array
+from .convertData import convert, rename, BRANCHES, SELECTION
+from .slimData import slim
+from .reweightData import finalise, add_reweight_arguments
+
+# Command-line arguments parser
+parser = get_parser(input=True, output=True, max_processes=True, train=True, test=True)
+parser.description = "Convert, slim, and reweight ntuples to final HDF5 dataset."
+parser.add_argument('--chunksize', type=int, default=1000000,
+                    help="Number of tree entries to read at a time.")
+add_hdf5_arguments(parser)
+add_reweight_arguments(parser)
+
+
+# Main function definition
+@profile
+def main ():
+
+    # For reproducibility
+    np.random.seed(21)
+
+    # Parse command-line argument
+    args = parser.parse_args()
+
+    # Modify input/output directory names to conform to convention
+    if not args.input .endswith('/'): args.input  += '/'
+    if not args.output.endswith('/'): args.output += '/'
+
+    # Find datasets
+    print "Reading input files from:\n  {}".format(args.input)
+    print "Writing output file to: \n  {}".format(args.output)
+
+    path_pattern = args.input + 'submitDir-{}*/data-tree/*.root'
+
+    vargs = list()
+    for key in sorted(SELECTION.keys()):
+        paths = sorted(glob.glob(path_pattern.format('wprime' if key == 'sig' else 'JZ')))
+        print "   Found {} input data files for {}.".format(len(paths), key)
+        vargs += [(path, key, args.chunksize) for path in paths]
+        pass
+
+    if len(vargs) == 0:
+        return
+
+    # Order data in the same way as the `_slim.h5` files are read by
+    # `reweightData`, for reproducibility
+    vargs = sorted(vargs, key=lambda varg: (varg[1], os.path.basename(varg[0])))
+
+    # Count selected samples in each file, reading only the selection variables
+    with Profile("Counting selected samples"):
+        queue   = multiprocessing.Queue()
+        results = run_batched(FilePipeline, [varg + (None,) for varg in vargs],
+                              queue=queue, max_processes=args.max_processes, strict=True)
+        dtypes  = set(dtype for _, dtype in results)
+        if len(dtypes) != 1:
+            raise IOError("Input files have {} different dtypes.".format(len(dtypes)))
+        offsets = np.cumsum([0] + [count for count, _ in results])
+        pass
+
+    # Converting and slimming ROOT files in parallel, directly into a shared
+    # output array at the offset of each file
+    with Profile("Converting and slimming ROOT file(s)"):
+        data = shared_array((offsets[-1],), dtypes.pop())
+        run_batched(FilePipeline, [varg + (data[start:stop],) for varg, start, stop in zip(vargs, offsets[:-1], offsets[1:])],
+                    max_processes=args.max_processes, strict=True)
+        pass
+
+    # Subsample, reweight, split, and (opt.) shuffle
+    data = finalise(data, args.train, args.test, bins=args.bins, binning=args.binning, smoothing=args.smoothing,
+                    shuffle=not args.bucket_rows)
+
+    # Writing output HDF5 file
+    output = args.output + 'data_{}M_{}M.h5'.format(args.train, args.test)
+    if not args.bucket_rows:
+        with Profile("Writing output HDF5 file"):
+            save_hdf5(data, output, **get_hdf5_options(args))
+            pass
+    else:
+        # Write unshuffled, release the in-memory data, and shuffle on disk
+        with Profile("Writing unshuffled HDF5 file"):
+            save_hdf5(data, output + '.unshuffled.tmp', compression='none', chunksize=None)
+            del data
+            pass
+
+        with Profile("Shuffling samples out-of-core"):
+            shuffle_hdf5(output + '.unshuffled.tmp', output, bucket_rows=args.bucket_rows, **get_hdf5_options(args))
+            os.remove(output + '.unshuffled.tmp')
+            pass
+        pass
+
+    return
+
+
+class FilePipeline (multiprocessing.Process):
+
+    def __init__ (self, vargs):
+        """
+        Process for converting and slimming standard-format W/top tagging ROOT
+        file, in chunks, and either counting the selected samples, or writing
+        them into a slice of the preallocated output array.
+
+        Arguments:
+            path: Path to the ROOT file to be converted.
+            key: Class to which the file pointer to by `path` belongs
+            chunksize: Number of tree entries to read at a time.
+            out: Slice of the shared output array into which to write the
+                slimmed samples, or `None` to only count them.
+        """
+
+        # Unpack input arguments
+        path, key, chunksize, out = vargs
+
+        # Base class constructor
+        super(FilePipeline, self).__init__()
+
+        # Member variable(s)
+        self.__path      = path
+        self.__key       = key
+        self.__chunksize = chunksize
+        self.__out       = out
+        self.queue       = None  # Set by the runner script.
+        self.index       = None  # Set by the runner script.
+        return
+
+
+    @garbage_collect
+    def run (self):
+
+        # Get unique file identifier
+        identifier = re.search("(WZqqqq_m[\d]+|JZ[\d]+W)\.", self.__path).groups(1)[0]
+
+        # Get data tree
+        f = ROOT.TFile(self.__path, 'READ')
+        t = f.Get('FlatSubstructureJetTree')
+        num_entries = t.GetEntries()
+
+        # Count selected samples, reading only the variables used in the
+        # selection in `convert` and `slim`, and get the output dtype from a
+        # single (possibly empty) entry
+        if self.__out is None:
+            branch = [name for name in BRANCHES if rename(name) == 'N2']
+            n2     = root_numpy.tree2array(t, branches=branch, selection=SELECTION[self.__key])[branch[0]]
+            dtype  = slim(convert(t, self.__key, 0, 1)).dtype
+            self.queue.put((self.index, (int((~np.isnan(n2)).sum()), dtype)))
+            return
+
+        # Convert and slim data in chunks, into output array
+        offset = 0
+        for start in range(0, num_entries, self.__chunksize):
+            data = slim(convert(t, self.__key, start, start + self.__chunksize))
+            if offset + data.shape[0] > self.__out.shape[0]:
+                raise RuntimeError("Got more than the {} counted samples ({}).".format(self.__out.shape[0], identifier))
+            self.__out[offset:offset + data.shape[0]] = data
+            offset += data.shape[0]
+            del data
+            pass
+        if offset != self.__out.shape[0]:
+            raise RuntimeError("Got {} of the {} counted samples ({}).".format(offset, self.__out.shape[0], identifier))
+        print "     Got {:8d}/{:8d} samples ({})".format(offset, num_entries, identifier)
+        return
+    pass
+
+
+# Main function call
+if __name__ == '__main__':
+    main()
+    pass
@@ -7,10 +7,15 @@ Script for reweighting HDF5 files from W/top tagging ntuples.
   1. Convert
   2. Slim
 > 3. Reweight
+
+All three stages can be run in a single script, without
+intermediate files, using `pipeline.py`.
 """
 
 # Basic import(s)
+import os
 import glob
+import time
 import multiprocessing
 
 # Get ROOT to stop hogging the command-line options
@@ -20,116 +25,117 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True
 # Scientific import(s)
 import math
 import numpy as np
-from numpy.lib.recfunctions import append_fields
-from hep_ml.reweight import BinsReweighter
 
 # Project import(s)
-from adversarial.utils import garbage_collect
+from adversarial.utils import garbage_collect, get_cache_key
 from adversarial.profile import Profile, profile
-from .common import load_hdf5, save_hdf5, get_parser, run_batched
+from .common import load_hdf5, save_hdf5, get_parser, run_batched, get_hdf5_info, shared_array, add_hdf5_arguments, get_hdf5_options, build_array, FlatReweighter, shuffle_hdf5
+from .common import load_manifest, is_up_to_date, update_manifest
 
 # Command-line arguments parser
-parser = get_parser(train=True, test=True, dir=True, max_processes=True)
-parser.description = "Re-weight HDF5 file to flat pT-spectrum."
-
-# Main function definition
-@profile
-def main ():
-
-    # For reproducibility
-    np.random.seed(21)
-
-    # Parse command-line argument
-    args = parser.parse_args()
-
-    # Modify directory name to conform to convention
-    if not args.dir.endswith('/'): args.dir += '/'
-
-    print "Reading and reweighting, splitting files in:\n  {}".format(args.dir)
-
-    paths = sorted(glob.glob(args.dir + '*/*_slim.h5'))
+parser = get_parser(train=True, test=True, dir=True, max_processes=True, force=True, checksum=True)
+parser.description = "Re-weight HDF5 file to flat pT-spectrum. Skipped if the output is up to date, cf. the manifest in the directory."
+add_hdf5_arguments(parser)
+
+
+def add_reweight_arguments (parser):
+    """
+    Add arguments configuring the flat-pT reweighting, cf. `finalise`, to
+    `parser`.
+    """
+    parser.add_argument('--bins', type=int, default=100,
+                        help='Number of pT bins used for reweighting.')
+    parser.add_argument('--binning', choices=['linear', 'quantile'], default='linear',
+                        help='Binning used for reweighting: equal widths, or equal numbers of samples.')
+    parser.add_argument('--smoothing', type=float, default=1.,
+                        help='Width, in bins, of the Gaussian smoothing of the pT histograms. 0 to disable.')
+    parser.add_argument('--bucket-rows', type=int, default=10000000,
+                        help='Number of rows per bucket in the out-of-core shuffle of the output file. 0 to shuffle in memory.')
+    return parser
+
+add_reweight_arguments(parser)
+
+
+def finalise (data, train, test, bins=100, binning='linear', smoothing=1., shuffle=True):
+    """
+    Subsample, reweight, perform train/test split, and shuffle W/top tagging
+    data, as slimmed by `slimData.slim`, to produce the final dataset.
+
+    Arguments:
+        data: Numpy recarray, with signal and background samples.
+        train: Size of training datasets in millions of events.
+        test: Size of testing datasets in millions of events.
+        bins, binning, smoothing: Configuration of the flat-pT reweighting, cf.
+            `FlatReweighter`.
+        shuffle: Whether to shuffle the samples in memory. Otherwise, the
+            output file should be shuffled out-of-core, cf.
+            `common.shuffle_hdf5`.
+
+    Returns:
+        Numpy recarray with the final dataset.
+    """
 
-    print "Found {} files.".format(len(paths))
-
-    # Reading input HDF5 file(s)
-    data = None
-    with Profile("Reading input HDF5 file(s)"):
-
-        # Run batched conversion in parallel
-        queue = multiprocessing.Queue()
-        parts = run_batched(FileLoader, list(enumerate(paths)), queue=queue, max_processes=args.max_processes)
-
-        # Concatenate data in sorted order, for reproducibility
-        data = np.concatenate(zip(*sorted(parts, key=lambda t: t[0]))[1])
-        pass
-    
     print "Found {} samples.".format(data.shape[0])
 
     # Subsample
     with Profile("Subsample"):
+        keep = np.ones((data.shape[0],), dtype=bool)
         for sig in [0,1]:
 
             # Select samples belonging to current category
             msk = data['signal'] == sig
 
-            # Store reference of samples belonging to other category
-            other = np.array(~msk).astype(bool)
-
-            # Subsample current category
-            num_sample = int((args.train + args.test) * 1E+06)
+            # Subsample current category, keeping all samples from other
+            # categories
+            num_sample = int((train + test) * 1E+06)
             if num_sample <= msk.sum():
                 idx = np.random.choice(np.where(msk)[0], num_sample, replace=False)
-                sample = np.zeros_like(msk).astype(bool)
-                sample[idx] = True
+                keep[msk] = False
+                keep[idx] = True
             else:
                 print "[WARNING] Requested {:.1e} samples, but only {:.1e} are availabe in current mask. Using all available samples.".format(num_sample, msk.sum())
-                sample = np.ones_like(msk).astype(bool)
                 pass
-
-            # Select subsample, and all samples from other categories
-            data = data[sample | other]
             pass
+
+        # Select subsample, and add new data columns, in one copy
+        dtype = data.dtype['weight_test']
+        data = build_array(data, [
+            ('weight_train', dtype, 1.),
+            ('weight_adv',   dtype, 1.),
+            ('train',        int,   0),
+            ], index=keep)
         pass
 
 
     # Re-weighting
     with Profile("Re-weighting"):
 
-        # Add new data columns
-        data = append_fields(data, 'weight_train', np.ones_like(data['weight_test']))
-        data = append_fields(data, 'weight_adv',   np.ones_like(data['weight_test']))
-
         # Reweight signal and background separately
         for sig in [0,1]:
 
             # Prepare data arrays
             msk = data['signal'] == sig
 
-            # Flat pT
+            # Flat pT, in the pT-range of the current class
             # ------------------------------------------------------------------
             original = data['pt'][msk]
-            xmin, xmax = original.min(), original.max()
-            target = np.random.rand(original.size) * (xmax - xmin) + xmin
 
-            # Fit bins-reweighter
-            reweighter = BinsReweighter(n_bins=100, n_neighs=1)
-            reweighter.fit(original, target=target)
-            
+            # Fit flat reweighter
+            reweighter = FlatReweighter(bins=bins, binning=binning, smoothing=smoothing)
+            reweighter.fit(original)
+
             # Predict new, flat-pT weight
             data['weight_train'][msk] = reweighter.predict_weights(original)
 
 
-            # (Flat-pT, physical-m) reweighted
+            # (Flat-pT, physical-m) reweighted, in the pT-range of all classes
             # ------------------------------------------------------------------
-            original        = data['pt'][msk]
             original_weight = data['weight_test'][msk]
-
             ptmin, ptmax = data['pt'].min(), data['pt'].max()
-            target = np.random.rand(msk.sum()) * (ptmax - ptmin) + ptmin
 
-            # Fit bins-reweighter
-            reweighter = BinsReweighter(n_bins=100, n_neighs=1)
-            reweighter.fit(original, original_weight=original_weight, target=target)
+            # Fit flat reweighter
+            reweighter = FlatReweighter(bins=bins, range=(ptmin, ptmax), binning=binning, smoothing=smoothing)
+            reweighter.fit(original, original_weight=original_weight)
 
             # Compute new weights
             data['weight_adv'][msk] = reweighter.predict_weights(original, original_weight=original_weight)
@@ -152,7 +158,7 @@ def main ():
         msk_sig = data['signal'] == 1
         num_sig =   msk_sig .sum()
         num_bkg = (~msk_sig).sum()
-        num_train = int(args.train * 1E+06)
+        num_train = int(train * 1E+06)
         print "Found {:.1e} signal and {:.1e} background samples.".format(num_sig, num_bkg)
         print "Using {:.1e} samples for training for each class, leaving {:.1e} signal and {:.1e} background samples for testing.".format(num_train, num_sig - num_train, num_bkg - num_train)
 
@@ -161,25 +167,97 @@ def main ():
         idx_sig_train = np.random.choice(idx_sig, num_train, replace=False)
         idx_bkg_train = np.random.choice(idx_bkg, num_train, replace=False)
 
-        data = append_fields(data, 'train', np.zeros_like(data['signal']).astype(int))
         data['train'][idx_sig_train] = 1
         data['train'][idx_bkg_train] = 1
         pass
 
 
-    # Shuffle
-    with Profile("Shuffling samples"):
-        idx = np.arange(data.shape[0])
-        np.random.shuffle(idx)
-        data = data[idx]
+    # (Opt.) Shuffle, in place
+    if shuffle:
+        with Profile("Shuffling samples"):
+            np.random.shuffle(data)
+            pass
         pass
 
+    return data
+
+
+# Main function definition
+@profile
+def main ():
+
+    # For reproducibility
+    np.random.seed(21)
+
+    # Parse command-line argument
+    args = parser.parse_args()
+
+    # Modify directory name to conform to convention
+    if not args.dir.endswith('/'): args.dir += '/'
+
+    print "Reading and reweighting, splitting files in:\n  {}".format(args.dir)
+
+    paths = sorted(glob.glob(args.dir + '*/*_slim.h5'))
+
+    print "Found {} files.".format(len(paths))
+
+    # Check whether the output is up to date, i.e. whether it was produced
+    # from the same slimmed files with the same configuration
+    output   = args.dir + 'data_{}M_{}M.h5'.format(args.train, args.test)
+    config   = get_cache_key(train=args.train, test=args.test, hdf5=get_hdf5_options(args),
+                             reweight=dict(bins=args.bins, binning=args.binning, smoothing=args.smoothing),
+                             bucket_rows=args.bucket_rows)
+    manifest = load_manifest(args.dir, 'reweight')
+    if not args.force and is_up_to_date(manifest, paths, output, config, args.checksum):
+        print "Output file {} is up to date.".format(output)
+        return
+    since = time.time()
+
+    # Reading input HDF5 file(s)
+    data = None
+    with Profile("Reading input HDF5 file(s)"):
+
+        # Get size and type of each file, and check compatibility
+        infos  = [get_hdf5_info(path) for path in paths]
+        dtypes = set(dtype for _, dtype in infos)
+        if len(dtypes) != 1:
+            raise IOError("Input files have {} different dtypes.".format(len(dtypes)))
+        offsets = np.cumsum([0] + [shape[0] for shape, _ in infos])
+
+        # Allocate shared output array, into which each file is read at a
+        # known offset, in sorted order for reproducibility
+        data = shared_array((offsets[-1],), dtypes.pop())
+
+        # Run batched loading in parallel
+        vargs = [(path, data[start:stop]) for path, start, stop in zip(paths, offsets[:-1], offsets[1:])]
+        run_batched(FileLoader, vargs, max_processes=args.max_processes, strict=True)
+        pass
+    
+    # Subsample, reweight, split, and (opt.) shuffle
+    data = finalise(data, args.train, args.test, bins=args.bins, binning=args.binning, smoothing=args.smoothing,
+                    shuffle=not args.bucket_rows)
 
     # Writing output HDF5 file
-    with Profile("Writing output HDF5 file"):
-        save_hdf5(data, args.dir + 'data_{}M_{}M.h5'.format(args.train, args.test))
+    if not args.bucket_rows:
+        with Profile("Writing output HDF5 file"):
+            save_hdf5(data, output, **get_hdf5_options(args))
+            pass
+    else:
+        # Write unshuffled, release the in-memory data, and shuffle on disk
+        with Profile("Writing unshuffled HDF5 file"):
+            save_hdf5(data, output + '.unshuffled.tmp', compression='none', chunksize=None)
+            del data
+            pass
+
+        with Profile("Shuffling samples out-of-core"):
+            shuffle_hdf5(output + '.unshuffled.tmp', output, bucket_rows=args.bucket_rows, **get_hdf5_options(args))
+            os.remove(output + '.unshuffled.tmp')
+            pass
         pass
 
+    # Record output in manifest
+    update_manifest(args.dir, 'reweight', manifest, [(paths, output)], config, since, args.checksum)
+
     return
 
 
@@ -191,29 +269,27 @@ class FileLoader (multiprocessing.Process):
 
         Arguments:
             path: Path to the HDF5 file to be loaded.
-            idx: Index of the process; for reproducibility.
+            out: Slice of shared array, cf. `shared_array`, into which to read
+                the contents of the file.
         """
 
         # Unpack input arguments
-        idx, path = vargs
+        path, out = vargs
 
         # Base class constructor
         super(FileLoader, self).__init__()
 
         # Member variable(s)
-        self.__idx   = idx
         self.__path  = path
-        self.queue   = None  # Set by the runner script.
+        self.__out   = out
+        self.queue   = None  # Set by the runner script; unused.
         return
 
     @garbage_collect
     def run (self):
 
-        # Load data
-        data = load_hdf5(self.__path)
-
-        # Store in return dict
-        self.queue.put((self.__idx, data))
+        # Load data directly into shared memory
+        load_hdf5(self.__path, out=self.__out)
         return
 
     pass
@@ -7,11 +7,15 @@ Script for slimming HDF5 files from W/top tagging ntuples.
   1. Convert
 > 2. Slim
   3. Reweight
+
+All three stages can be run in a single script, without
+intermediate files, using `pipeline.py`.
 """
 
 # Basic import(s)
 import re
 import glob
+import time
 import multiprocessing
 
 # Get ROOT to stop hogging the command-line options
@@ -21,16 +25,16 @@ import root_numpy
 
 # Scientific import(s)
 import numpy as np
-from numpy.lib.recfunctions import append_fields
 
 # Project import(s)
-from adversarial.utils import garbage_collect
+from adversarial.utils import garbage_collect, get_cache_key
 from adversarial.profile import Profile, profile
-from .common import load_hdf5, save_hdf5, get_parser, run_batched
+from .common import load_hdf5, save_hdf5, get_parser, run_batched, build_array
+from .common import load_manifest, is_up_to_date, prune_manifest, update_manifest
 
 # Command-line arguments parser
-parser = get_parser(dir=True, max_processes=True)
-parser.description = "Slim, decorate HDF5 file."
+parser = get_parser(dir=True, max_processes=True, force=True, checksum=True)
+parser.description = "Slim, decorate HDF5 file. Only new or changed input files are slimmed, cf. the manifest in the directory."
 
 # Global variable definition(s)
 BRANCHES = [
@@ -64,6 +68,42 @@ BRANCHES = [
     ]
 
 
+def slim (data):
+    """
+    Slim and decorate W/top tagging data.
+
+    Arguments:
+        data: Numpy recarray, as converted by `convertData.convert`.
+
+    Returns:
+        Numpy recarray with only `BRANCHES`, and the derived `rho` and `rhoDDT`
+        fields.
+
+    Raises:
+        IOError: If any of `BRANCHES` are not present in `data`.
+    """
+
+    # Perform slimming
+    missing = [branch for branch in BRANCHES if branch not in data.dtype.names]
+    if missing:
+        print "ERROR: The following {} branches were not found in the input data:".format(len(missing))
+        for name in missing:
+            print "  {}".format(name)
+            pass
+        raise IOError()
+
+    # @FIXME: Filter out NaN N2's
+    msk = ~np.isnan(data['N2'])
+
+    # Select branches and rows, and add new, necessary fields, in one copy
+    dtype = np.result_type(data.dtype['m'], data.dtype['pt'])
+    data = build_array(data, [
+        ('rho',    dtype, lambda d: np.log(np.square(d['m']) / np.square(d['pt']))),
+        ('rhoDDT', dtype, lambda d: np.log(np.square(d['m']) / d['pt'] / 1.)),
+        ], names=BRANCHES, index=msk)
+    return data
+
+
 # Main function definition
 @profile
 def main ():
@@ -76,11 +116,33 @@ def main ():
 
     print "Reading and slimming, decorating files in:\n  {}".format(args.dir)
 
+    # Load manifest of previous slimming, and remove outputs of input files
+    # which no longer exist, e.g. removed by `convertData`
+    manifest = load_manifest(args.dir, 'slim')
+    for output in prune_manifest(manifest):
+        print "Removed {}, since its input file no longer exists.".format(output)
+        pass
+
     paths = sorted(glob.glob(args.dir + '*/*_full.h5'))
     print "Found {} files.".format(len(paths))
 
+    # Select new or changed input files, e.g. re-converted by `convertData`
+    config = get_cache_key(branches=BRANCHES)
+    jobs   = [([path], path.replace('_full', '_slim')) for path in paths]
+    if not args.force:
+        jobs = [(inputs, output) for inputs, output in jobs if not is_up_to_date(manifest, inputs, output, config, args.checksum)]
+        print "{} files are new or changed.".format(len(jobs))
+        pass
+
+    if len(jobs) == 0:
+        return
+
     # Run batched slimming in parallel
-    run_batched(FileSlimmer, paths, max_processes=args.max_processes)
+    since = time.time()
+    run_batched(FileSlimmer, [inputs[0] for inputs, _ in jobs], max_processes=args.max_processes)
+
+    # Record outputs in manifest
+    update_manifest(args.dir, 'slim', manifest, jobs, config, since, args.checksum)
     return
 
 
@@ -113,22 +175,7 @@ class FileSlimmer (multiprocessing.Process):
         print "     Read {:8d} samples ({}).".format(data.shape[0], identifier)
 
         # Perform slimming
-        missing = [branch for branch in BRANCHES if branch not in data.dtype.names]
-        if missing:
-            print "ERROR: The following {} branches were not found in the input file:".format(len(missing))
-            for name in missing:
-                print "  {}".format(name)
-                pass
-            raise IOError()
-
-        data = data[BRANCHES].copy()
-
-        # @FIXME: Filter out NaN N2's
-        data = data[~np.isnan(data['N2'])]
-
-        # Add new, necessary fields
-        data = append_fields(data, 'rho',    np.log(np.square(data['m']) / np.square(data['pt'])))
-        data = append_fields(data, 'rhoDDT', np.log(np.square(data['m']) / data['pt'] / 1.))
+        data = slim(data)
 
         # Writing output HDF5 file
         save_hdf5(data, self.__path.replace('_full', '_slim'))
@@ -3,25 +3,27 @@
 """Common methods for training and testing neural network classifiers."""
 
 # Basic import(s)
+import os
 import re
 import sys
 import json
 import logging as log
 from pprint import pprint
+import tempfile
 import subprocess
 import datetime
 
 # Scientific import(s)
 import numpy as np
-import pandas as pd
 
 # Project import(s)
-from adversarial.utils import INPUT_VARIABLES
+from adversarial.utils import INPUT_VARIABLES, load_data_iter, lazy_import, restore_checkpoint
 from adversarial.profile import profile
+pd = lazy_import('pandas')
 
 
 @profile
-def add_nn (data, clf, newfeat=None):
+def add_nn (data, clf, newfeat=None, path=None, **kwargs):
     """
     Add neural network tagger from `clf to `data`. Modifies `data` in-place.
 
@@ -29,15 +31,50 @@ def add_nn (data, clf, newfeat=None):
         data: Pandas DataFrame to which to add classifier variable.
         clf: Keras network model, from which to get classifier variable.
         newfeat: Name of output feature.
+        path: (Optional) Path to the HDF5 file from which `data` was loaded. If
+            specified, the input features are read from the file in chunks, cf.
+            `predict_nn`, such that `data` need not hold them.
+        kwargs: Sample selection, e.g. `test=True`, with which `data` was
+            loaded, passed to `predict_nn`.
     """
     # Check(s)
     assert newfeat is not None, "Please specify an output feature name"
 
+    # Get NN-classifier variable
+    if path is None:
+        values = clf.predict(data[INPUT_VARIABLES].values, batch_size=8192).flatten()
+    else:
+        values = predict_nn(clf, path, **kwargs)
+        assert len(values) == len(data), \
+            "add_nn: Got {} predictions for {} samples; check the sample selection.".format(len(values), len(data))
+        pass
+
     # Add NN-classifier variable to DataFrame
-    data[newfeat] = pd.Series(clf.predict(data[INPUT_VARIABLES].values, batch_size=8192).flatten(), index=data.index)
+    data[newfeat] = pd.Series(values, index=data.index)
     return
 
 
+@profile
+def predict_nn (clf, path, **kwargs):
+    """
+    Evaluate neural network tagger `clf` on the HDF5 file at `path`, reading
+    the input features in chunks, such that the full dataset never has to be
+    held in memory.
+
+    Arguments:
+        clf: Keras network model, from which to get classifier variable.
+        path: The path to the HDF5 file, from which data should be loaded.
+        kwargs: Keyword arguments, e.g. sample selection and chunk size, passed
+            to `load_data_iter`.
+
+    Returns:
+        Numpy array with the classifier variable, for all selected samples in
+        the order in which they are stored.
+    """
+    outputs = [clf.predict(X, batch_size=8192).flatten() for X, _, _, _ in load_data_iter(path, **kwargs)]
+    return np.concatenate(outputs)
+
+
 def parallelise_model (model, args):
     """
     Parallelise model on GPUs. Requires TensorFlow backend, GPU-enabled running
@@ -65,6 +102,247 @@ def parallelise_model (model, args):
     return parallelised
 
 
+class BatchGenerator (object):
+    """
+    Generator of (inputs, targets, sample weights) batches for Keras'
+    `fit_generator`, sliced by index from contiguous arrays, such that no
+    per-fold copies of the training data are needed.
+
+    The samples are reshuffled at the start of each epoch. Used with
+    `fit_batched`, batches are produced on a background thread, prefetching at
+    most one batch ahead of training.
+    """
+
+    def __init__ (self, inputs, targets, weights, index=None, batch_size=8192, shuffle=True, seed=None):
+        """
+        Arguments:
+            inputs: List of input arrays, e.g. features, with samples along the
+                first axis.
+            targets: List of target arrays.
+            weights: List of sample weight arrays.
+            index: (Optional) Array of indices of the samples to use, e.g. the
+                training samples in the current fold. Defaults to all samples.
+            batch_size: Number of samples per batch.
+            shuffle: Whether to reshuffle the samples each epoch.
+            seed: (Optional) Random-number generator seed, for reproducibility.
+        """
+
+        # Member variable(s)
+        self.inputs     = list(inputs)
+        self.targets    = list(targets)
+        self.weights    = list(weights)
+        self.index      = np.arange(self.inputs[0].shape[0]) if index is None else np.asarray(index)
+        self.batch_size = batch_size
+        self.shuffle    = shuffle
+        self.rng        = np.random.RandomState(seed)
+        return
+
+
+    def __len__ (self):
+        """Number of batches per epoch."""
+        return int(np.ceil(self.index.size / float(self.batch_size)))
+
+
+    def __getitem__ (self, idx):
+        """Get the batch of samples with (sorted) indices `idx`."""
+        unwrap = lambda arrays: arrays[0] if len(arrays) == 1 else arrays
+        return tuple(unwrap([np.take(array, idx, axis=0) for array in arrays])
+                     for arrays in [self.inputs, self.targets, self.weights])
+
+
+    def flow (self):
+        """
+        Generate batches indefinitely, one epoch, i.e. `len(self)` batches, at
+        a time.
+        """
+        while True:
+            index = self.rng.permutation(self.index) if self.shuffle else self.index
+            for start in range(0, index.size, self.batch_size):
+                # Sort indices within each batch, for memory locality
+                yield self[np.sort(index[start:start + self.batch_size])]
+                pass
+            pass
+        return
+    pass
+
+
+class Folds (object):
+    """
+    Stratified k-fold cross-validation over contiguous, float32 training
+    arrays.
+
+    The columns used in training, e.g. features, auxiliary and decorrelation
+    variables, and weights, are converted once into a single, contiguous block
+    (optionally memory-mapped), with rows ordered by fold, such that the
+    validation samples of each fold are a contiguous slice of the block. Each
+    fold then only needs index arrays into the block, cf. `BatchGenerator`,
+    rather than fresh copies of the columns.
+    """
+
+    def __init__ (self, groups, labels, folds, dtype=np.float32, mmap_dir=None, chunksize=1000000):
+        """
+        Arguments:
+            groups: List of (name, array) tuples, with arrays of one row per
+                sample, e.g. `data[features].values`.
+            labels: Array of class labels, by which the folds are stratified.
+            folds: Number of folds.
+            dtype: Data type of the block.
+            mmap_dir: (Optional) Directory in which to memory-map the block,
+                rather than holding it in memory. The backing file is removed
+                once mapped.
+            chunksize: Number of rows to convert at a time.
+        """
+
+        # Import(s)
+        from sklearn.model_selection import StratifiedKFold
+
+        # Get validation indices for each fold
+        # @NOTE: No shuffling is performed -- assuming that's already done.
+        nrows = len(labels)
+        splits = StratifiedKFold(n_splits=folds).split(np.zeros((nrows, 1)), labels)
+        validations = [validation for _, validation in splits]
+
+        # Member variable(s)
+        self.folds  = folds
+        self.order  = np.concatenate(validations)  # Block row -> data row
+        self.bounds = np.cumsum([0] + map(len, validations))
+
+        # Allocate block
+        groups = [(name, np.asarray(values)) for name, values in groups]
+        widths = [1 if values.ndim == 1 else values.shape[1] for _, values in groups]
+        shape  = (nrows, sum(widths))
+        if mmap_dir is None:
+            self.block = np.empty(shape, dtype=dtype)
+        else:
+            fd, path = tempfile.mkstemp(suffix='.npy', dir=mmap_dir)
+            os.close(fd)
+            self.block = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+            os.remove(path)
+            pass
+
+        # Fill block, in fold order, one group and chunk at a time
+        self.arrays = dict()
+        offsets = np.cumsum([0] + widths)
+        for (name, values), start, stop in zip(groups, offsets[:-1], offsets[1:]):
+            for first in range(0, nrows, chunksize):
+                rows = self.order[first:first + chunksize]
+                self.block[first:first + rows.size, start:stop] = values[rows].reshape((rows.size, stop - start))
+                pass
+            self.arrays[name] = self.block[:, start] if values.ndim == 1 else self.block[:, start:stop]
+            pass
+        return
+
+
+    def __getitem__ (self, name):
+        """Get the block columns for group `name`, in block row order."""
+        return self.arrays[name]
+
+
+    def split (self):
+        """
+        Generate the training and validation block row indices for each fold.
+        """
+        nrows = self.order.size
+        for lower, upper in zip(self.bounds[:-1], self.bounds[1:]):
+            train = np.concatenate((np.arange(lower), np.arange(upper, nrows)))
+            yield train, np.arange(lower, upper)
+            pass
+        return
+
+
+    def data_index (self, rows):
+        """Get the data row indices, e.g. for `DataFrame.iloc`, of block `rows`."""
+        return self.order[rows]
+    pass
+
+
+# Options for `fit_generator` and `evaluate_generator`, to produce batches on a
+# single background thread, at most one batch ahead.
+PREFETCH_OPTS = dict(max_queue_size=1, workers=1, use_multiprocessing=False)
+
+
+def fit_batched (model, generator, fit_opts, validation=None, **kwargs):
+    """
+    Fit `model` on batches from `generator`.
+
+    Arguments:
+        model: Compiled Keras model.
+        generator: `BatchGenerator` for training samples.
+        fit_opts: Configuration dict for `fit`, e.g. `cfg['classifier']['fit']`.
+            `batch_size` and `shuffle` are handled by the generator.
+        validation: (Optional) `BatchGenerator` for validation samples.
+        kwargs: Additional keyword arguments, e.g. callbacks, passed to
+            `fit_generator`.
+
+    Returns:
+        Keras `History` object.
+    """
+    opts = {key: value for key, value in fit_opts.iteritems() if key not in ['batch_size', 'shuffle']}
+    opts.update(kwargs)
+    opts.update(PREFETCH_OPTS)
+    if validation is not None:
+        opts['validation_data']  = validation.flow()
+        opts['validation_steps'] = len(validation)
+        pass
+    return model.fit_generator(generator.flow(), steps_per_epoch=len(generator), **opts)
+
+
+def evaluate_batched (model, generator):
+    """
+    Evaluate `model` on a single epoch of batches from `generator`.
+    """
+    return model.evaluate_generator(generator.flow(), steps=len(generator), **PREFETCH_OPTS)
+
+
+def fit_stage (model, generator, fit_opts, checkpoint, stage, history, state=None, period=1, validation=None, callbacks=None):
+    """
+    Fit `model` for a single training stage, e.g. adversary pre-training, on
+    batches from `generator`, saving checkpoints every `period` epochs and at
+    the end of the stage.
+
+    Arguments:
+        model: Compiled Keras model.
+        generator: `BatchGenerator` for training samples.
+        fit_opts: Configuration dict for `fit`, cf. `fit_batched`.
+        checkpoint: Tuple of the directory and model name for the checkpoints,
+            cf. `save_checkpoint`.
+        stage: Name of the training stage.
+        history: Dict of per-stage training histories, updated in-place.
+        state: (Optional) Checkpoint state dict, cf. `load_checkpoint`. If it
+            belongs to `stage`, the model and optimizer are restored, and the
+            fit continues from the checkpointed epoch.
+        period: Number of epochs between checkpoints.
+        validation: (Optional) `BatchGenerator` for validation samples.
+        callbacks: (Optional) List of additional Keras callbacks.
+
+    Returns:
+        Training history dict of `stage`, including any resumed epochs.
+    """
+
+    # Import(s)
+    from adversarial.callbacks import CheckpointCallback
+
+    # (Opt.) Resume from checkpoint
+    initial_epoch = 0
+    if state is not None and state['stage'] == stage:
+        restore_checkpoint(checkpoint[0], state, model)
+        initial_epoch = state['epoch']
+        log.info("Resuming {} '{}' from epoch {}".format(checkpoint[1], stage, initial_epoch))
+        pass
+
+    callbacks = list(callbacks or []) + [CheckpointCallback(checkpoint[0], checkpoint[1], stage, history, period=period)]
+    fit_batched(model, generator, fit_opts, validation=validation, callbacks=callbacks, initial_epoch=initial_epoch)
+    return history.get(stage, dict())
+
+
+def merge_histories (history, stages, keys):
+    """
+    Concatenate the per-stage training histories in `history`, for `stages` in
+    order, for each of `keys`, e.g. the model's metric names.
+    """
+    return {key: [value for stage in stages for value in history.get(stage, dict()).get(key, [])] for key in keys}
+
+
 def initialise_config (args, cfg):
     """
     Neural network-specific initialisation of the configuration dict. Modifies
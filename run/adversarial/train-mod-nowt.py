@@ -9,20 +9,11 @@ import pickle
 import logging as log
 import itertools
 
-# Get ROOT to stop hogging the command-line options
-import ROOT
-ROOT.PyConfig.IgnoreCommandLineOptions = True
-
 # Scientific import(s)
 import numpy as np
 import pandas as pd
-import root_numpy
 from sklearn.model_selection import StratifiedKFold
 
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
-
 # Project import(s)
 from adversarial.utils     import *
 from adversarial.profile   import *
@@ -90,7 +81,7 @@ def main (args):
 
     # Loading data
     # --------------------------------------------------------------------------
-    data, features, features_decorrelation = load_data(args.input + 'data.h5', train=True)
+    data, features, features_decorrelation = load_data(args.input + 'data.h5', columns=USED_VARIABLES, train=True, mmap=args.mmap)
     num_features = len(features)
 
     # Regulsarisation parameter
@@ -100,8 +91,22 @@ def main (args):
     lambda_str = '{l:.{d:d}f}'.format(d=digits,l=lambda_reg).replace('.', 'p')
     print "lambda_str=",lambda_str
 
-    # Get standard-formatted decorrelation inputs
-    decorrelation= get_decorrelation_variables(data)
+    # Get standard-formatted decorrelation inputs. The scaling is fitted once,
+    # on the training dataset, or reused from a pre-trained adversary.
+    scaler_dir  = 'models/adversarial/adversary/full/'
+    scaler_name = 'adversary_lambda{}'.format(lambda_str)
+    scaler = None
+    if not (args.train or args.train_adversarial):
+        try:
+            scaler = load_scaler(scaler_dir, scaler_name)
+        except IOError:
+            log.warning("No decorrelation scaler found in {}; fitting on training data.".format(scaler_dir))
+            pass
+        pass
+    if scaler is None:
+        scaler = fit_decorrelation_scaler(data)
+        pass
+    decorrelation = get_decorrelation_variables(data, scaler)
     aux_vars = ['logpt']
     data['logpt'] = pd.Series(np.log(data['fjet_pt'].values), index=data.index)
     
@@ -112,7 +117,7 @@ def main (args):
     #data['weight_clf'] = pd.Series(data[weight_var].values, index=data.index)
 
     # -- Adversary
-    #data['weight_adv'] = pd.Series(np.multiply(data[weight_var].values,  1. - data['signal'].values), index=data.index)
+    #data['weight_adv'] = pd.Series(np.multiply(data[weight_var].values,  1 - data['signal'].values), index=data.index)
     #only weight bkg?
 
     # Classifier-only fit, cross-validation
@@ -402,6 +407,7 @@ def main (args):
                     # Save combined model and training history to file, both in unique
                     # output directory and in the directory for pre-trained classifiers.
                     save([args.output, basedir], name, combined, ret.history)
+                    save_scaler([args.output, basedir], name, scaler)
 
                     # Add `ANN` variable
                     add_nn(data, classifier, 'ANN')
@@ -507,6 +513,7 @@ def main (args):
             adv = lambda s: s.replace('combined', 'adversary')
             save([args.output,     basedir],      name,  combined, ret.history)
             save([args.output, adv(basedir)], adv(name), adversary)
+            save_scaler([args.output, adv(basedir)], adv(name), scaler)
 
             # Saving adversarially trained classifier in lwtnn-friendly format.
             lwtnn_save(classifier, 'ann')
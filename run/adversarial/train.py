@@ -8,22 +8,11 @@ import glob
 import pickle
 import logging as log
 import itertools
-
-# Get ROOT to stop hogging the command-line options
-import ROOT
-
-ROOT.PyConfig.IgnoreCommandLineOptions = True
+import multiprocessing
 
 # Scientific import(s)
 import numpy as np
 import pandas as pd
-import root_numpy
-from sklearn.model_selection import StratifiedKFold
-
-import matplotlib
-
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
 
 # Project import(s)
 from adversarial.utils import *
@@ -32,7 +21,373 @@ from adversarial.constants import *
 from .common import *
 
 # Global variable(s)
-RNG = np.random.RandomState(21)  # For reproducibility
+SEED = 21
+RNG = np.random.RandomState(SEED)  # For reproducibility
+
+# Columns read by this script: the common variables, and those used for the
+# auxiliary adversary input and the sample weights, cf. `main`.
+COLUMNS = USED_VARIABLES + ['pt', 'weight_adv']
+
+# Shared state for the cross-validation folds, set in `main` before any fold
+# worker processes are forked, cf. `train_fold`.
+CONTEXT = dict()
+
+
+def kullback_leibler (p_true, p_pred):
+    """Custom Kullback-Leibler (KL) divergence cost for the adversary."""
+    import keras.backend as K
+    return -K.log(p_pred)
+
+
+def get_batches (ctx, kind, index=None, shuffle=True, seed=None):
+    """
+    Get batch generator for the classifier or the combined model.
+
+    Arguments:
+        ctx: Dict holding the shared state, cf. `CONTEXT`.
+        kind: Either 'classifier' or 'combined'.
+        index: (Optional) Array of indices of the samples to use.
+        shuffle: Whether to reshuffle the samples at the start of each epoch.
+        seed: (Optional) Random seed. Defaults to drawing one from `RNG`.
+
+    Returns:
+        `BatchGenerator` instance.
+    """
+    arrays, cfg = ctx['arrays'], ctx['cfg']
+    if seed is None:
+        seed = RNG.randint(2**31)
+        pass
+    if kind == 'classifier':
+        inputs, targets, weights = [arrays['features']], [arrays['signal']], [arrays['weight_clf']]
+    else:
+        inputs  = [arrays['features'], arrays['aux'], arrays['decorrelation']]
+        targets = [arrays['signal'], arrays['ones']]
+        weights = [arrays['weight_clf'], arrays['weight_adv']]
+        pass
+    return BatchGenerator(inputs, targets, weights, index=index, batch_size=cfg[kind]['fit']['batch_size'],
+                          shuffle=shuffle, seed=seed)
+
+
+def get_cached_pretraining (ctx, classifier, adversary, batches, validation_batches=None):
+    """
+    Get stand-alone adversary model and batch generators for pre-training the
+    adversary on cached classifier outputs. Since the classifier is frozen
+    during pre-training, its output is computed once, for all samples, rather
+    than in every step of every pre-training epoch.
+
+    Arguments:
+        ctx: Dict holding the shared state, cf. `CONTEXT`.
+        classifier: Pre-trained classifier model.
+        adversary: Adversary model, embedded in the combined model.
+        batches: `BatchGenerator` for training samples of the combined model.
+        validation_batches: (Optional) `BatchGenerator` for validation samples
+            of the combined model.
+
+    Returns:
+        Tuple of the compiled adversary model, sharing its layers with
+        `adversary`, and the `BatchGenerator`s for training and (opt.)
+        validation samples, with the same samples as `batches` and
+        `validation_batches`.
+    """
+
+    # Import(s)
+    from keras.models import Model
+
+    arrays, cfg = ctx['arrays'], ctx['cfg']
+
+    # Compute classifier output once
+    log.info("Caching classifier outputs")
+    output = classifier.predict(arrays['features'], batch_size=cfg['combined']['fit']['batch_size'])
+    output = output.astype(arrays['features'].dtype)
+
+    def cached (generator, shuffle):
+        return BatchGenerator([output, arrays['aux'], arrays['decorrelation']], [arrays['ones']], [arrays['weight_adv']],
+                              index=generator.index, batch_size=generator.batch_size, shuffle=shuffle,
+                              seed=generator.rng.randint(2**31))
+
+    # Compile adversary with the combined model's adversary loss, loss weight,
+    # and optimizer, such that the learning rate decay continues into training.
+    # @NOTE: A new model, sharing the adversary's layers, is compiled, to leave
+    #        the adversary model itself uncompiled, as when saved to file.
+    opts  = cfg['combined']['compile']
+    model = Model(inputs=adversary.inputs, outputs=adversary.outputs, name='adversary_pretrain')
+    model.compile(optimizer=opts['optimizer'], loss=opts['loss'][1], loss_weights=opts['loss_weights'][1:])
+
+    return model, cached(batches, True), (cached(validation_batches, False) if validation_batches is not None else None)
+
+
+def fit_combined (ctx, name, basedir, classifier, adversary, parallelised, batches, validation_batches=None, initial_batches=None, callbacks=None):
+    """
+    Pre-train the adversary, with the classifier frozen, and then train the
+    combined model, checkpointing periodically in the `checkpoints/`
+    subdirectory of `basedir`. With `--resume`, the pre-training or training is
+    continued from the last checkpoint. With `--pretrain-cached`, the adversary
+    is pre-trained stand-alone, cf. `get_cached_pretraining`.
+
+    Arguments:
+        ctx: Dict holding the shared state, cf. `CONTEXT`.
+        name: Name of the combined model, used in the checkpoint filenames.
+        basedir: Directory for the combined model.
+        classifier: Classifier model, embedded in `parallelised`.
+        adversary: Adversary model, embedded in `parallelised`.
+        parallelised: Combined model, possibly parallelised on GPUs.
+        batches: `BatchGenerator` for training samples.
+        validation_batches: (Optional) `BatchGenerator` for validation samples.
+        initial_batches: (Optional) `BatchGenerator` for unshuffled training
+            samples, on which to compute the initial losses.
+        callbacks: (Optional) List of additional Keras callbacks, for training.
+
+    Returns:
+        Training history dict, with the initial, pre-training, and training
+        losses concatenated. With `--pretrain-cached`, the stand-alone
+        adversary pre-training losses are stored separately, with keys prefixed
+        by 'pretrain_'.
+    """
+
+    args, cfg = ctx['args'], ctx['cfg']
+    checkpoint = (basedir + 'checkpoints/', name)
+
+    # (Opt.) Get last checkpoint
+    state = load_checkpoint(*checkpoint) if args.resume else None
+    history = state['history'] if state is not None else dict()
+
+    pretrain = 'pretrain_cached' if args.pretrain_cached else 'pretrain'
+    stages = [(pretrain, False, cfg['combined']['pretrain'], None),
+              ('train',  True,  cfg['combined']['fit']['epochs'], callbacks)]
+    for stage, trainable, epochs, stage_callbacks in stages:
+
+        # Skip pre-training, if already completed
+        if stage == pretrain and state is not None and state['stage'] == 'train':
+            continue
+
+        # Compile model for pre-training/training
+        classifier.trainable = trainable
+        parallelised.compile(**cfg['combined']['compile'])
+
+        # Compute initial losses
+        if stage == pretrain and state is None and initial_batches is not None:
+            log.info("Computing initial loss")
+            initial_losses = [evaluate_batched(parallelised, initial_batches),
+                              evaluate_batched(parallelised, validation_batches)]
+            history['initial'] = dict()
+            for metric, loss_train, loss_val in zip(parallelised.metrics_names, *initial_losses):
+                history['initial'][metric]          = [float(loss_train)]
+                history['initial']['val_' + metric] = [float(loss_val)]
+                pass
+            pass
+
+        # Get model and batches to fit
+        if stage == 'pretrain_cached':
+            model, stage_batches, stage_validation = get_cached_pretraining(ctx, classifier, adversary, batches,
+                                                                            validation_batches)
+        else:
+            model, stage_batches, stage_validation = parallelised, batches, validation_batches
+            pass
+
+        log.info("Pre-training" if stage == pretrain else "Actual training")
+        fit_opts = dict(cfg['combined']['fit'], epochs=epochs)
+        fit_stage(model, stage_batches, fit_opts, checkpoint, stage, history, state=state,
+                  period=args.checkpoint_period, validation=stage_validation, callbacks=stage_callbacks)
+        pass
+
+    keys = list(parallelised.metrics_names)
+    if validation_batches is not None:
+        keys += ['val_' + metric for metric in parallelised.metrics_names]
+        pass
+    merged = merge_histories(history, ['initial', 'pretrain', 'train'], keys)
+    for key, values in history.get('pretrain_cached', dict()).iteritems():
+        merged['pretrain_' + key] = values
+        pass
+    return merged
+
+
+def train_classifier_fold (ctx, fold, train, validation):
+    """
+    Train, and save, the cross-validation classifier for a single fold.
+
+    Arguments:
+        ctx: Dict holding the shared state, cf. `CONTEXT`.
+        fold: Index of the current fold.
+        train: Array of block-row indices of the training samples.
+        validation: Array of block-row indices of the validation samples.
+
+    Returns:
+        Training history dict, including the initial losses.
+    """
+
+    # Import(s)
+    from keras.callbacks import TensorBoard
+    from adversarial.models import classifier_model
+
+    args, cfg = ctx['args'], ctx['cfg']
+
+    # Define unique name for current classifier
+    name = 'crossval_classifier__{}of{}'.format(fold + 1, args.folds)
+    basedir = 'models/adversarial/classifier/crossval/'
+
+    # Get classifier
+    classifier = classifier_model(ctx['num_features'], **cfg['classifier']['model'])
+
+    # Parallelise on GPUs
+    # @NOTE: Store reference to base model to allow for saving.
+    #        Cf. [https://github.com/keras-team/keras/issues/8446#issuecomment-343559454]
+    parallelised = parallelise_model(classifier, args)
+
+    # Compile model (necessary to save properly)
+    parallelised.compile(**cfg['classifier']['compile'])
+
+    # Prepare batch generators, seeded per fold to be independent of the order
+    # in which the folds are run
+    seed = SEED + 1 + fold
+    batches            = get_batches(ctx, 'classifier', train, seed=seed)
+    validation_batches = get_batches(ctx, 'classifier', validation, shuffle=False, seed=seed)
+
+    # Create callbacks
+    callbacks = []
+
+    # -- TensorBoard
+    if args.tensorboard:
+        callbacks += [TensorBoard(log_dir=ctx['tensorboard_dir'] + 'classifier/fold{}/'.format(fold))]
+        pass
+
+    # Compute initial losses
+    initial_losses = [[evaluate_batched(parallelised, get_batches(ctx, 'classifier', train, shuffle=False, seed=seed))],
+                      [evaluate_batched(parallelised, validation_batches)]]
+
+    # Fit classifier model
+    ret = fit_batched(parallelised, batches, cfg['classifier']['fit'], validation=validation_batches,
+                      callbacks=callbacks)
+
+    # Prepend initial losses
+    for metric, loss_train, loss_val in zip(parallelised.metrics_names, *initial_losses):
+        ret.history[metric].insert(0, loss_train)
+        ret.history['val_' + metric].insert(0, loss_val)
+        pass
+
+    # Save classifier model and training history to file, both in unique output
+    # directory and in the directory for pre-trained classifiers
+    save([args.output, basedir], name, classifier, ret.history)
+
+    return ret.history
+
+
+def train_combined_fold (ctx, fold, train, validation):
+    """
+    Train, and save, the cross-validation combined, adversarial model for a
+    single fold, and compute the optimisation metric on the validation samples.
+
+    Arguments:
+        ctx: Dict holding the shared state, cf. `CONTEXT`.
+        fold: Index of the current fold.
+        train: Array of block-row indices of the training samples.
+        validation: Array of block-row indices of the validation samples.
+
+    Returns:
+        Optimisation metric, `rej + lambda * 1/JSD`, or `None` if it could not
+        be computed.
+    """
+
+    # Import(s)
+    from adversarial.models import adversary_model, combined_model
+
+    args, cfg, data = ctx['args'], ctx['cfg'], ctx['data']
+
+    # Define unique name for current classifier
+    name = 'combined_lambda{}__{}of{}'.format(ctx['lambda_str'], fold + 1, args.folds)
+    basedir = 'models/adversarial/combined/crossval/'
+
+    # Load pre-trained classifier
+    classifier, _ = load('models/adversarial/classifier/full/', 'classifier')
+
+    # Set up adversary
+    adversary = adversary_model(gmm_dimensions=len(DECORRELATION_VARIABLES),
+                                **cfg['adversary']['model'])
+
+    # Set up combined, adversarial model
+    combined = combined_model(classifier, adversary, **cfg['combined']['model'])
+
+    # Parallelise on GPUs
+    parallelised = parallelise_model(combined, args)
+
+    # Prepare batch generators, seeded per fold to be independent of the order
+    # in which the folds are run
+    seed = SEED + 1 + fold
+    batches            = get_batches(ctx, 'combined', train, seed=seed)
+    validation_batches = get_batches(ctx, 'combined', validation, shuffle=False, seed=seed)
+
+    # Pre-train adversary and train combined model
+    history = fit_combined(ctx, name, basedir, classifier, adversary, parallelised, batches,
+                           validation_batches=validation_batches,
+                           initial_batches=get_batches(ctx, 'combined', train, shuffle=False, seed=seed))
+
+    # Save combined model and training history to file, both in unique output
+    # directory and in the directory for pre-trained classifiers.
+    save([args.output, basedir], name, combined, history)
+    save_scaler([args.output, basedir], name, ctx['scaler'])
+
+    # Add `ANN` variable
+    add_nn(data, classifier, 'ANN')
+
+    # Compute optimisation metric
+    try:
+        rej, jsd = metrics(data.iloc[ctx['folds'].data_index(validation)], 'ANN')
+        print "Background rejection: {}".format(rej)
+        print "1/JSD:                {}".format(jsd)
+        if np.inf in [rej, jsd] or np.nan in [rej, jsd]:
+            return None
+        return rej + ctx['lambda_reg'] * jsd
+    except ValueError:
+        print "Got a NaN. Returning 0"
+        return None
+
+
+def train_fold (task):
+    """
+    Train a single cross-validation fold, using the shared state in `CONTEXT`.
+    Used both sequentially and as the target of the fold worker processes.
+
+    Arguments:
+        task: Tuple of model kind, either 'classifier' or 'combined', and the
+            index of the fold.
+
+    Returns:
+        The output of `train_classifier_fold` or `train_combined_fold`.
+    """
+    kind, fold = task
+    train, validation = list(CONTEXT['folds'].split())[fold]
+    with Profile("Fold {}/{}".format(fold + 1, CONTEXT['args'].folds)):
+        if kind == 'classifier':
+            return train_classifier_fold(CONTEXT, fold, train, validation)
+        return train_combined_fold(CONTEXT, fold, train, validation)
+
+
+def initialise_worker ():
+    """
+    Initialise the Keras backend, and the configuration dict, in a fold worker
+    process, with the CPU cores shared evenly between the workers.
+    """
+    args = CONTEXT['args']
+    initialise_backend(args, share=min(args.parallel_folds, args.folds))
+    initialise_config(args, CONTEXT['cfg'])
+    return
+
+
+def run_folds (kind, pool=None):
+    """
+    Train all cross-validation folds, either sequentially or, if a `pool` of
+    fold worker processes is given, in parallel.
+
+    Arguments:
+        kind: Either 'classifier' or 'combined'.
+        pool: (Optional) `multiprocessing.Pool` of fold worker processes.
+
+    Returns:
+        List of the outputs of `train_fold`, ordered by fold.
+    """
+    tasks = [(kind, fold) for fold in range(CONTEXT['args'].folds)]
+    if pool is None:
+        return map(train_fold, tasks)
+    return pool.map(train_fold, tasks, chunksize=1)
 
 
 # Main function definition
@@ -68,28 +423,13 @@ def main(args):
         cfg['classifier']['fit']['verbose'] = 2  # @TEMP
         cfg['combined']['fit']['verbose'] = 2  # @TEMP
 
-        # Initialise Keras backend
-        initialise_backend(args)
-
-        import keras
-        import keras.backend as K
-        from keras.models import load_model
-        from keras.callbacks import Callback, TensorBoard, EarlyStopping
-        from keras.utils.vis_utils import plot_model
-
-        # Neural network-specific initialisation of the configuration dict
-        initialise_config(args, cfg)
-
         # Setup TensorBoard, if applicable
         tensorboard_dir = initialise_tensorboard(args, cfg)
-
-        # Print the current environment setup
-        print_env(args, cfg)
         pass
 
     # Loading data
     # --------------------------------------------------------------------------
-    data, features, features_decorrelation = load_data(args.input + 'data.h5', train=True)
+    data, features, features_decorrelation = load_data(args.input + 'data.h5', columns=COLUMNS, train=True, mmap=args.mmap)
     num_features = len(features)
 
     # Regulsarisation parameter
@@ -97,8 +437,22 @@ def main(args):
     digits = int(np.ceil(max(-np.log10(lambda_reg), 0)))
     lambda_str = '{l:.{d:d}f}'.format(d=digits, l=lambda_reg).replace('.', 'p')
 
-    # Get standard-formatted decorrelation inputs
-    decorrelation = get_decorrelation_variables(data)
+    # Get standard-formatted decorrelation inputs. The scaling is fitted once,
+    # on the training dataset, or reused from a pre-trained adversary.
+    scaler_dir  = 'models/adversarial/adversary/full/'
+    scaler_name = 'adversary_lambda{}'.format(lambda_str)
+    scaler = None
+    if not (args.train or args.train_adversarial):
+        try:
+            scaler = load_scaler(scaler_dir, scaler_name)
+        except IOError:
+            log.warning("No decorrelation scaler found in {}; fitting on training data.".format(scaler_dir))
+            pass
+        pass
+    if scaler is None:
+        scaler = fit_decorrelation_scaler(data)
+        pass
+    decorrelation = get_decorrelation_variables(data, scaler)
     aux_vars = ['logpt']
     data['logpt'] = pd.Series(np.log(data['pt'].values), index=data.index)
 
@@ -108,7 +462,66 @@ def main(args):
     data['weight_clf'] = pd.Series(data[weight_var].values, index=data.index)
 
     # -- Adversary
-    data['weight_adv'] = pd.Series(np.multiply(data['weight_adv'].values, 1. - data['signal'].values), index=data.index)
+    data['weight_adv'] = pd.Series(np.multiply(data['weight_adv'].values, 1 - data['signal'].values), index=data.index)
+
+    # Contiguous, float32 training arrays, ordered by stratified k-fold, from
+    # which the batches for each fold are sliced by index, cf. `BatchGenerator`
+    with Profile("Materialising cross-validation folds"):
+        folds = Folds([('features',      data[features].values),
+                       ('aux',           data[aux_vars].values),
+                       ('decorrelation', decorrelation),
+                       ('signal',        data['signal'].values),
+                       ('weight_clf',    data['weight_clf'].values),
+                       ('weight_adv',    data['weight_adv'].values)],
+                      labels=data['signal'].values, folds=args.folds, dtype=np.float32,
+                      mmap_dir=args.output if args.mmap else None)
+        arrays = dict(folds.arrays)
+        arrays['ones'] = np.ones_like(arrays['signal'])
+        pass
+
+    # Use same custom Kullback-Leibler (KL) divergence cost for all adversaries
+    cfg['combined']['compile']['loss'][1] = kullback_leibler
+
+    # Shared state for the cross-validation folds
+    CONTEXT.update(args=args, cfg=cfg, data=data, arrays=arrays, folds=folds, scaler=scaler,
+                   num_features=num_features, lambda_reg=lambda_reg, lambda_str=lambda_str,
+                   tensorboard_dir=tensorboard_dir)
+
+    # (Opt.) Start fold worker processes. These must be forked _before_ the Keras
+    # backend is initialised in this process, since TensorFlow does not survive
+    # a fork; the data are shared with the workers copy-on-write.
+    pool = None
+    if args.parallel_folds > 1 and (args.optimise_classifier or args.optimise_adversarial):
+        log.info("Running cross-validation folds in {} worker processes".format(min(args.parallel_folds, args.folds)))
+        pool = multiprocessing.Pool(min(args.parallel_folds, args.folds), initializer=initialise_worker)
+        pass
+
+    # Initialise Keras backend
+    # --------------------------------------------------------------------------
+    with Profile("Initialising backend"):
+        initialise_backend(args)
+
+        import keras
+        import keras.backend as K
+        from keras.models import load_model
+        from keras.callbacks import Callback, TensorBoard, EarlyStopping
+        from keras.utils.vis_utils import plot_model
+
+        # Neural network-specific initialisation of the configuration dict
+        initialise_config(args, cfg)
+
+        # Print the current environment setup
+        print_env(args, cfg)
+        pass
+
+    def classifier_batches (index=None, shuffle=True):
+        return get_batches(CONTEXT, 'classifier', index, shuffle)
+
+    def combined_batches (index=None, shuffle=True):
+        return get_batches(CONTEXT, 'combined', index, shuffle)
+
+    # Import module creator methods and optimiser options
+    from adversarial.models import classifier_model, adversary_model, combined_model, decorrelation_model
 
     # Classifier-only fit, cross-validation
     # --------------------------------------------------------------------------
@@ -118,14 +531,6 @@ def main(args):
         basename = 'crossval_classifier'
         basedir = 'models/adversarial/classifier/crossval/'
 
-        # Get indices for each fold in stratified k-fold training
-        # @NOTE: No shuffling is performed -- assuming that's already done.
-        skf = StratifiedKFold(n_splits=args.folds).split(data[features].values,
-                                                         data['signal'].values)
-
-        # Import module creator methods and optimiser options
-        from adversarial.models import classifier_model, adversary_model, combined_model, decorrelation_model
-
         # Collection of classifiers and their associated training histories
         classifiers = list()
         histories = list()
@@ -134,71 +539,9 @@ def main(args):
         if args.optimise_classifier:  # args.train or args.train_classifier:
             log.info("Training cross-validation classifiers")
 
-            # Loop `k` folds
-            for fold, (train, validation) in enumerate(skf):
-                with Profile("Fold {}/{}".format(fold + 1, args.folds)):
-
-                    # Define unique name for current classifier
-                    name = '{}__{}of{}'.format(basename, fold + 1, args.folds)
+            # Train `k` folds; the classifiers are saved to file
+            histories = run_folds('classifier', pool)
 
-                    # Get classifier
-                    classifier = classifier_model(num_features, **cfg['classifier']['model'])
-
-                    # Parallelise on GPUs
-                    # @NOTE: Store reference to base model to allow for saving.
-                    #        Cf. [https://github.com/keras-team/keras/issues/8446#issuecomment-343559454]
-                    parallelised = parallelise_model(classifier, args)
-
-                    # Compile model (necessary to save properly)
-                    parallelised.compile(**cfg['classifier']['compile'])
-
-                    # Prepare arrays
-                    X = data[features].values[train]
-                    Y = data['signal'].values[train]
-                    W = data['weight_clf'].values[train]
-                    validation_data = (
-                        data[features].values[validation],
-                        data['signal'].values[validation],
-                        data['weight_clf'].values[validation]
-                    )
-
-                    # Create callbacks
-                    callbacks = []
-
-                    # -- TensorBoard
-                    if args.tensorboard:
-                        callbacks += [TensorBoard(log_dir=tensorboard_dir + 'classifier/fold{}/'.format(fold))]
-                        pass
-
-                    # Compute initial losses
-                    X_val, Y_val, W_val = validation_data
-                    eval_opts = dict(batch_size=cfg['classifier']['fit']['batch_size'], verbose=0)
-                    initial_losses = [[parallelised.evaluate(X, Y, sample_weight=W, **eval_opts)],
-                                      [parallelised.evaluate(X_val, Y_val, sample_weight=W_val, **eval_opts)]]
-
-                    # Fit classifier model
-                    ret = parallelised.fit(X, Y, sample_weight=W, validation_data=validation_data, callbacks=callbacks,
-                                           **cfg['classifier']['fit'])
-
-                    # Prepend initial losses
-                    for metric, loss_train, loss_val in zip(parallelised.metrics_names, *initial_losses):
-                        ret.history[metric].insert(0, loss_train)
-                        ret.history['val_' + metric].insert(0, loss_val)
-                        pass
-
-                    # Add to list of cost histories
-                    histories.append(ret.history)
-
-                    # Add to list of classifiers
-                    classifiers.append(classifier)
-
-                    # Save classifier model and training history to file, both
-                    # in unique output directory and in the directory for pre-
-                    # trained classifiers
-                    save([args.output, basedir], name, classifier, ret.history)
-                    pass
-                pass  # end: k-fold cross-validation
-            pass
         else:
 
             # Load pre-trained classifiers
@@ -222,6 +565,11 @@ def main(args):
     # Early stopping in case of stand-alone classifier optimisation
     # --------------------------------------------------------------------------
     if args.optimise_classifier:
+        if pool is not None:
+            pool.close()
+            pool.join()
+            pass
+
         # Compute average validation loss
         val_avg = np.mean([hist['val_loss'] for hist in histories], axis=0)
         val_std = np.std([hist['val_loss'] for hist in histories], axis=0)
@@ -258,17 +606,17 @@ def main(args):
                 callbacks += [TensorBoard(log_dir=tensorboard_dir + name + '/')]
                 pass
 
-            # Prepare arrays
-            X = data[features].values
-            Y = data['signal'].values
-            W = data['weight_clf'].values
-
-            # Fit classifier model
-            ret = parallelised.fit(X, Y, sample_weight=W, callbacks=callbacks, **cfg['classifier']['fit'])
+            # Fit classifier model, checkpointing periodically and (opt.)
+            # resuming from the last checkpoint
+            checkpoint = (basedir + 'checkpoints/', name)
+            state = load_checkpoint(*checkpoint) if args.resume else None
+            history = fit_stage(parallelised, classifier_batches(), cfg['classifier']['fit'], checkpoint, 'train',
+                                state['history'] if state is not None else dict(), state=state,
+                                period=args.checkpoint_period, callbacks=callbacks)
 
             # Save classifier model and training history to file, both in unique
             # output directory and in the directory for pre-trained classifiers.
-            save([args.output, basedir], name, classifier, ret.history)
+            save([args.output, basedir], name, classifier, history)
 
             # Saving classifier in lwtnn-friendly format.
             lwtnn_save(classifier, 'nn')
@@ -281,127 +629,29 @@ def main(args):
             pass  # end: train/load
         pass
 
-    # Definitions for adversarial training
-    # --------------------------------------------------------------------------
-    # Create custom Kullback-Leibler (KL) divergence cost.
-    def kullback_leibler(p_true, p_pred):
-        return -K.log(p_pred)
-
-    cfg['combined']['compile']['loss'][1] = kullback_leibler
-
     # @TODO: Make `train_{classifier,adverarial}` methods for used with _both_
     #        cross-val.- and full trianing
 
     # Combined adversarial fit, cross-validation
     # --------------------------------------------------------------------------
     with Profile("Combined adversarial fit, cross-validation"):
-        # @TODO:
-        # - Checkpointing
 
         # Define variables
         results = []  # Holding optimisation metrics
-        basename = 'combined_lambda{}'.format(lambda_str)
-        basedir = 'models/adversarial/combined/crossval/'
-
-        # Get indices for each fold in stratified k-fold training
-        # @NOTE: No shuffling is performed -- assuming that's already done above.
-        skf = StratifiedKFold(n_splits=args.folds).split(data[features].values,
-                                                         data['signal'].values)
 
         if args.optimise_adversarial:  # args.train or args.train_adversarial:
             log.info("Training combined model cross-validation")
 
-            # Loop `k` folds
-            for fold, (train, validation) in enumerate(skf):
-                with Profile("Fold {}/{}".format(fold + 1, args.folds)):
-
-                    # Define unique name for current classifier
-                    name = '{}__{}of{}'.format(basename, fold + 1, args.folds)
-
-                    # Load pre-trained classifier
-                    classifier, _ = load('models/adversarial/classifier/full/', 'classifier')
-
-                    # Set up adversary
-                    adversary = adversary_model(gmm_dimensions=len(DECORRELATION_VARIABLES),
-                                                **cfg['adversary']['model'])
-
-                    # Set up combined, adversarial model
-                    combined = combined_model(classifier, adversary, **cfg['combined']['model'])
-
-                    # Parallelise on GPUs
-                    parallelised = parallelise_model(combined, args)
-
-                    # Prepare arrays
-                    X = [data[features].values[train]] + [data[aux_vars].values[train], decorrelation[train]]
-                    Y = [data['signal'].values[train]] + [np.ones_like(data['signal'].values[train])]
-                    W = [data['weight_clf'].values[train]] + [data['weight_adv'].values[train]]
-
-                    validation_data = (
-                        [data[features].values[validation]] + [data[aux_vars].values[validation],
-                                                               decorrelation[validation]],
-                        [data['signal'].values[validation]] + [np.ones_like(data['signal'].values[validation])],
-                        [data['weight_clf'].values[validation]] + [data['weight_adv'].values[validation]]
-                    )
-
-                    # Compile model for pre-training
-                    classifier.trainable = False
-                    parallelised.compile(**cfg['combined']['compile'])
-
-                    # Compute initial losses
-                    log.info("Computing initial loss")
-                    X_val, Y_val, W_val = validation_data
-                    eval_opts = dict(batch_size=cfg['combined']['fit']['batch_size'], verbose=0)
-                    initial_losses = [parallelised.evaluate(X, Y, sample_weight=W, **eval_opts),
-                                      parallelised.evaluate(X_val, Y_val, sample_weight=W_val, **eval_opts)]
-
-                    # Pre-training adversary
-                    log.info("Pre-training")
-                    pretrain_fit_opts = dict(**cfg['combined']['fit'])
-                    pretrain_fit_opts['epochs'] = cfg['combined']['pretrain']
-                    ret_pretrain = parallelised.fit(X, Y, sample_weight=W, validation_data=validation_data,
-                                                    **pretrain_fit_opts)
-
-                    # Re-compile combined model for full training
-                    classifier.trainable = True
-                    parallelised.compile(**cfg['combined']['compile'])
-
-                    # Fit classifier model
-                    log.info("Actual training")
-                    ret = parallelised.fit(X, Y, sample_weight=W, validation_data=validation_data,
-                                           **cfg['combined']['fit'])
-
-                    # Prepend initial losses
-                    for metric, loss_train, loss_val in zip(parallelised.metrics_names, *initial_losses):
-                        ret_pretrain.history[metric].insert(0, loss_train)
-                        ret_pretrain.history['val_' + metric].insert(0, loss_val)
-                        pass
-
-                    for metric in parallelised.metrics_names:
-                        ret.history[metric] = ret_pretrain.history[metric] + ret.history[metric]
-                        ret.history['val_' + metric] = ret_pretrain.history['val_' + metric] + ret.history[
-                            'val_' + metric]
-                        pass
-
-                    # Save combined model and training history to file, both in unique
-                    # output directory and in the directory for pre-trained classifiers.
-                    save([args.output, basedir], name, combined, ret.history)
-
-                    # Add `ANN` variable
-                    add_nn(data, classifier, 'ANN')
-
-                    # Compute optimisation metric
-                    try:
-                        rej, jsd = metrics(data.iloc[validation], 'ANN')
-                        print "Background rejection: {}".format(rej)
-                        print "1/JSD:                {}".format(jsd)
-                        if np.inf in [rej, jsd] or np.nan in [rej, jsd]:
-                            return 0
-                        results.append(rej + lambda_reg * jsd)
-                    except ValueError:
-                        print "Got a NaN. Returning 0"
-                        return 0
-                    pass
+            # Train `k` folds; the combined models are saved to file
+            results = run_folds('combined', pool)
+            if pool is not None:
+                pool.close()
+                pool.join()
                 pass
+
+            if None in results:
+                print "Got a NaN. Returning 0"
+                return 0
             pass
         pass
 
@@ -450,42 +700,16 @@ def main(args):
             # Parallelise on GPUs
             parallelised = parallelise_model(combined, args)
 
-            # Compile model (necessary to save properly)
-            parallelised.compile(**cfg['combined']['compile'])
-
-            # Prepare arrays
-            X = [data[features].values] + [data[aux_vars].values, decorrelation]
-            Y = [data['signal'].values] + [np.ones_like(data['signal'].values)]
-            W = [data['weight_clf'].values] + [data['weight_adv'].values]
-
-            # Compile model for pre-training
-            classifier.trainable = False
-            parallelised.compile(**cfg['combined']['compile'])
-
-            # Pre-training adversary
-            log.info("Pre-training")
-            pretrain_fit_opts = dict(**cfg['combined']['fit'])
-            pretrain_fit_opts['epochs'] = cfg['combined']['pretrain']
-            ret_pretrain = parallelised.fit(X, Y, sample_weight=W, **pretrain_fit_opts)
-
-            # Re-compile combined model for full training
-            classifier.trainable = True
-            parallelised.compile(**cfg['combined']['compile'])
-
-            # Fit classifier model
-            log.info("Actual training")
-            ret = parallelised.fit(X, Y, sample_weight=W, callbacks=callbacks, **cfg['combined']['fit'])
-
-            # Prepend initial losses
-            for metric in parallelised.metrics_names:
-                ret.history[metric] = ret_pretrain.history[metric] + ret.history[metric]
-                pass
+            # Pre-train adversary and train combined model
+            history = fit_combined(CONTEXT, name, basedir, classifier, adversary, parallelised, combined_batches(),
+                                   callbacks=callbacks)
 
             # Save combined model and training history to file, both in unique
             # output directory and in the directory for pre-trained classifiers.
             adv = lambda s: s.replace('combined', 'adversary')
-            save([args.output, basedir], name, combined, ret.history)
+            save([args.output, basedir], name, combined, history)
             save([args.output, adv(basedir)], adv(name), adversary)
+            save_scaler([args.output, adv(basedir)], adv(name), scaler)
 
             # Saving adversarially trained classifier in lwtnn-friendly format.
             lwtnn_save(classifier, 'ann')
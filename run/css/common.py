@@ -4,16 +4,16 @@
 """Common methods for training and testing CSS transform."""
 
 # Scientific import(s)
-import ROOT
-import root_numpy
 import numpy as np
-import pandas as pd
 import gzip
 import pickle
 
 # Project import(s)
-from adversarial.utils import loadclf, saveclf
+from adversarial.utils import loadclf, saveclf, lazy_import, lazy_import_root
 from adversarial.profile import profile
+ROOT       = lazy_import_root()
+root_numpy = lazy_import('root_numpy')
+pd         = lazy_import('pandas')
 
 
 # Common definition(s)
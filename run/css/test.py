@@ -34,7 +34,7 @@ def main (args):
     args, cfg = initialise(args)
 
     # Load data
-    data, features, _ = load_data(args.input + 'data.h5', train=True, background=True)
+    data, features, _ = load_data(args.input + 'data.h5', train=True, background=True, mmap=args.mmap)
 
     # Add CSS variable
     var = "D2"
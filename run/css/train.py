@@ -39,7 +39,7 @@ def main (args):
     args, cfg = initialise(args)
 
     # Load data
-    data, features, _ = load_data(args.input + 'data.h5', background=True, train=True)
+    data, features, _ = load_data(args.input + 'data.h5', columns=['D2', 'm', 'weight_test'], background=True, train=True, mmap=args.mmap)
 
     # Fill substructure profile
     perform_optimisation("D2", D2BINS, data)
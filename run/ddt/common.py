@@ -7,14 +7,14 @@
 import gzip
 
 # Scientific import(s)
-import ROOT
-import root_numpy
 import numpy as np
-import pandas as pd
 
 # Project import(s)
-from adversarial.utils import loadclf
+from adversarial.utils import loadclf, lazy_import, lazy_import_root
 from adversarial.profile import profile
+ROOT       = lazy_import_root()
+root_numpy = lazy_import('root_numpy')
+pd         = lazy_import('pandas')
 
 # Common definition(s)
 BINS = np.linspace(-1, 6, 7 * 4 + 1, endpoint=True)  # Binning in rhoDDT
@@ -30,7 +30,7 @@ def main (args):
     args, cfg = initialise(args)
 
     # Load data
-    data, features, _ = load_data(args.input + 'data.h5', train=True, background=True)
+    data, features, _ = load_data(args.input + 'data.h5', columns=[VAR_TAU21, VAR_RHODDT, VAR_WEIGHT], train=True, background=True, mmap=args.mmap)
 
     # Fill Tau21 profile
     profile = fill_profile(data, VAR_TAU21)
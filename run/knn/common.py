@@ -6,13 +6,13 @@
 import itertools
 
 # Scientific import(s)
-import ROOT
 import numpy as np
-import pandas as pd
 
 # Project import(s)
-from adversarial.utils import wpercentile, loadclf, garbage_collect
+from adversarial.utils import wpercentile, loadclf, garbage_collect, lazy_import, lazy_import_root
 from adversarial.profile import profile
+ROOT = lazy_import_root()
+pd   = lazy_import('pandas')
 
 # Common definition(s)
 VAR  = 'D2'   # 'NN' | Substructure variable to decorrelate
@@ -71,7 +71,7 @@ def main (args):
     args, cfg = initialise(args)
 
     # Load data
-    data, _, _ = load_data(args.input + 'data.h5', train=True)
+    data, _, _ = load_data(args.input + 'data.h5', train=True, mmap=args.mmap)
     msk_sig = data['signal'] == 1
     msk_bkg = ~msk_sig
 
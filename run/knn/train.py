@@ -30,7 +30,7 @@ def main (args):
     args, cfg = initialise(args)
 
     # Load data
-    data, _, _ = load_data(args.input + 'data.h5', train=True)
+    data, _, _ = load_data(args.input + 'data.h5', columns=[VAR, 'weight_test'] + VARS, train=True, mmap=args.mmap)
 
     # -------------------------------------------------------------------------
     ####
@@ -4,12 +4,11 @@
 
 # Scientific import(s)
 import numpy as np
-import pandas as pd
-from sklearn.externals.joblib.parallel import cpu_count, Parallel, delayed
 
 # Project import(s)
-from adversarial.utils import loadclf
+from adversarial.utils import loadclf, lazy_import
 from adversarial.profile import profile
+pd = lazy_import('pandas')
 
 
 def _predict(estimator, X, method, start, stop):
@@ -23,6 +22,7 @@ def parallel_predict(estimator, X, n_jobs=1, method='predict', batches_per_job=3
     """
     Run sklearn classifier prediction in parallel.
     """
+    from sklearn.externals.joblib.parallel import cpu_count, Parallel, delayed
     n_jobs = max(cpu_count() + 1 + n_jobs, 1)  # XXX: this should really be done by joblib
     n_batches = batches_per_job * n_jobs
     n_samples = len(X)
@@ -32,7 +32,7 @@ def main (args):
     args, cfg = initialise(args)
 
     # Load data
-    data, features, _ = load_data(args.input + 'data.h5', sample=0.01)  # @TEMP
+    data, features, _ = load_data(args.input + 'data.h5', sample=0.01, mmap=args.mmap)  # @TEMP
 
     # Define classifier configuration(s)
     pattern = 'uboost_ur_{:4.2f}_te_92_rel21_fixed'
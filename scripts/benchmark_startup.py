@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script for benchmarking the start-up time of the project modules and run
+scripts, i.e. the time taken to import them and to start the command-line
+interface, in fresh Python processes.
+
+Usage:
+    $ python scripts/benchmark_startup.py [--repeats 10] [--modules ...] [--scripts ...]
+
+The heavy dependencies imported by each module are listed, to check that they
+are loaded lazily, cf. `adversarial.utils.lazy_import`.
+"""
+
+# Basic import(s)
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# Heavy dependencies, which should only be imported when actually used
+HEAVY = ['pandas', 'scipy.stats', 'sklearn', 'psutil', 'ROOT', 'root_numpy', 'matplotlib', 'keras', 'tensorflow']
+
+# Default targets
+MODULES = [
+    'adversarial.profile',
+    'adversarial.utils',
+    'run.adversarial.common',
+    'run.css.common',
+    'run.ddt.common',
+    'run.knn.common',
+    'run.uboost.common',
+    ]
+SCRIPTS = [
+    'run.adversarial.train-mod',
+    'run.adversarial.train',
+    ]
+
+# Project root directory
+BASEDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Command-line argument parser
+parser = argparse.ArgumentParser(description="Benchmark import and CLI start-up times.")
+parser.add_argument('--repeats', type=int, default=10,
+                    help="Number of fresh processes per target.")
+parser.add_argument('--modules', nargs='*', default=MODULES,
+                    help="Modules for which to time `import`.")
+parser.add_argument('--scripts', nargs='*', default=SCRIPTS,
+                    help="Script modules for which to time `python -m <script> --help`, i.e. CLI start-up.")
+
+
+def timeit (command, repeats):
+    """
+    Time `command`, run in a fresh process from the project root, `repeats`
+    times.
+
+    Returns:
+        List of wall times, in seconds, or `None` if the command failed.
+    """
+    times = list()
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeats):
+            start = time.time()
+            ret = subprocess.call(command, cwd=BASEDIR, stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+            if ret != 0:
+                return None
+            pass
+        pass
+    return times
+
+
+def loaded (module):
+    """
+    Get the heavy dependencies imported as a side-effect of importing `module`.
+    """
+    code = "import sys, {module}; print(','.join(m for m in {heavy!r} if m in sys.modules))".format(module=module, heavy=HEAVY)
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output([sys.executable, '-c', code], cwd=BASEDIR, stderr=devnull)
+            pass
+    except subprocess.CalledProcessError:
+        return None
+    return output.strip() or '-'
+
+
+def report (title, times, extra=''):
+    """Print one line of the benchmark summary."""
+    if times is None:
+        print "  {:40s} {:>9s}".format(title, 'FAILED')
+        return
+    times = sorted(times)
+    median = times[len(times) // 2]
+    print "  {:40s} {:8.3f}s {:8.3f}s  {}".format(title, times[0], median, extra)
+    return
+
+
+# Main function definition
+def main ():
+
+    # Parse command-line arguments
+    args = parser.parse_args()
+
+    print "Start-up benchmark, {} fresh process(es) per target".format(args.repeats)
+    print "  {:40s} {:>9s} {:>9s}  {}".format('', 'min', 'median', 'heavy modules imported')
+
+    # Baseline: interpreter start-up
+    report('python', timeit([sys.executable, '-c', 'pass'], args.repeats))
+
+    # Module imports
+    for module in args.modules:
+        times = timeit([sys.executable, '-c', 'import {}'.format(module)], args.repeats)
+        report('import ' + module, times, loaded(module) if times is not None else '')
+        pass
+
+    # Command-line interface start-up
+    for script in args.scripts:
+        report('-m ' + script + ' --help', timeit([sys.executable, '-m', script, '--help'], args.repeats))
+        pass
+
+    return
+
+
+# Main function call
+if __name__ == '__main__':
+    main()
+    pass
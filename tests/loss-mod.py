@@ -20,7 +20,7 @@ import root_numpy
 import matplotlib.pyplot as plt
 
 # Project import(s)
-from adversarial.utils import parse_args, initialise, mkdir, load_data, get_decorrelation_variables
+from adversarial.utils import parse_args, initialise, mkdir, load_data, get_decorrelation_variables, load_scaler
 from adversarial.layers import PosteriorLayer
 from adversarial.profile import profile, Profile
 from adversarial.constants import *
@@ -45,7 +45,18 @@ def main (args):
 
     # Compute entropy of decorrelation variable posterior
     data, _, _ = load_data(args.input + 'data.h5', train=True, background=True)
-    decorrelation = get_decorrelation_variables(data)
+
+    # Scale decorrelation variables as seen by the adversary during training
+    lambda_reg = cfg['combined']['model']['lambda_reg']
+    digits = int(np.ceil(max(-np.log10(lambda_reg), 0)))
+    lambda_str = '{l:.{d:d}f}'.format(d=digits, l=lambda_reg).replace('.', 'p')
+    try:
+        scaler = load_scaler('models/adversarial/adversary/full/', 'adversary_lambda{}'.format(lambda_str))
+    except IOError:
+        print "No decorrelation scaler found for lambda = {}; fitting on study data.".format(lambda_reg)
+        scaler = None
+        pass
+    decorrelation = get_decorrelation_variables(data, scaler)
     # H_prior = entropy(decorrelation, weights=data['weight_adv'])
     H_prior = entropy(decorrelation)
     print "Entropy of prior: {}".format(H_prior)
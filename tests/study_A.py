@@ -6,6 +6,7 @@
 
 # Basic import(s)
 import re
+import json
 import gc
 import gzip
 import itertools
@@ -25,6 +26,7 @@ from sklearn.metrics import roc_curve, roc_auc_score
 
 # Project import(s)
 from adversarial.utils import initialise, initialise_backend, parse_args, load_data, mkdir, wpercentile, latex
+from adversarial.utils import file_digest, get_cache_key, get_cache_path, link_cached
 from adversarial.profile import profile, Profile
 from adversarial.constants import *
 from run.adversarial.common import initialise_config
@@ -134,8 +136,35 @@ def main (args):
     # tagger_features = ['NN', ann_var,mv_var,ann_var,sc_var, ann_var]
     tagger_features = ['NN', ann_var, mv_var, sc_var]
 
+    # Study variables
+    study_vars=DECORRELATION_VARIABLES+WEIGHT_VARIABLES+DECORRELATION_VARIABLES_AUX
+    # @NOTE: The NN input features are not loaded; they are streamed from file
+    #        when evaluating the classifiers, cf. `add_nn`.
+    columns = study_vars + mv_vars + sc_vars + flag_vars
+    outputFile="output/study_{}.h5".format(args.note)
+    outputConfig="output/study_{}.json".format(args.note)
+
+    # Look up study intermediates in the content-addressed cache, keyed by the
+    # input dataset, the model weights, and the tagger list. Nothing is
+    # recomputed unless one of these has changed.
+    classifier_path = 'models/adversarial/classifier/full/classifier.h5'
+    combined_paths  = ['models/adversarial/combined/full/combined_lambda{}.h5'.format(lambda_str_) for lambda_str_ in lambda_strs]
+    key = get_cache_key(dataset=file_digest(args.input + 'data.h5', quick=True),
+                        models=[file_digest(path) for path in [classifier_path] + combined_paths],
+                        model_cfg=[cfg['adversary']['model'], cfg['combined']['model']],
+                        taggers=tagger_features,
+                        columns=columns)
+    cached = get_cache_path(key, 'study_A')
+    if os.path.exists(cached):
+        print "Study intermediates are up to date: {}".format(cached)
+        link_cached(cached, outputFile)
+        with open(outputConfig, 'w') as outfile:
+            json.dump(tagger_features, outfile)
+            pass
+        return 0
+
     # Load data
-    data, features, _ = load_data(args.input + 'data.h5', test=True,debug=args.debug) #should fillna for test input
+    data, features, _ = load_data(args.input + 'data.h5', columns=columns, test=True,debug=args.debug, mmap=args.mmap) #should fillna for test input
 
     # Add variables
     # --------------------------------------------------------------------------
@@ -156,9 +185,10 @@ def main (args):
 
         # NN
         from run.adversarial.common import add_nn
+        nn_opts = dict(path=args.input + 'data.h5', test=True, mmap=args.mmap)
         with Profile("NN"):
-            classifier = load_model('models/adversarial/classifier/full/classifier.h5')
-            add_nn(data, classifier, 'NN')
+            classifier = load_model(classifier_path)
+            add_nn(data, classifier, 'NN', **nn_opts)
             pass
 
         # ANN
@@ -169,10 +199,10 @@ def main (args):
             combined = combined_model(classifier, adversary,
                                       **cfg['combined']['model'])
 
-            for ann_var_, lambda_str_ in zip(ann_vars, lambda_strs):
+            for ann_var_, combined_path in zip(ann_vars, combined_paths):
                 print "== Loading model for {}".format(ann_var_)
-                combined.load_weights('models/adversarial/combined/full/combined_lambda{}.h5'.format(lambda_str_))
-                add_nn(data, classifier, ann_var_)
+                combined.load_weights(combined_path)
+                add_nn(data, classifier, ann_var_, **nn_opts)
                 pass
             pass
 
@@ -201,7 +231,6 @@ def main (args):
 
 
     # Remove unused variables
-    study_vars=DECORRELATION_VARIABLES+WEIGHT_VARIABLES+DECORRELATION_VARIABLES_AUX
     # used_variables = set(tagger_features + ann_vars + study_vars)
     used_variables = set(tagger_features + study_vars + flag_vars)
     all_variables = set(list(used_variables) + INPUT_VARIABLES)
@@ -220,10 +249,11 @@ def main (args):
     # outputBase=args.output.rstrip("/")+"/"
     # os.system("mkdir -p "+outputBase)
     # outputFile=outputBase+"study_{}.h5".format(args.note)
-    outputFile="output/study_{}.h5".format(args.note)
-    data.to_hdf(outputFile,"dataset",mode="w",format="fixed")
-    import json
-    with open("output/study_{}.json".format(args.note), 'w') as outfile:
+    mkdir(os.path.dirname(cached))
+    data.to_hdf(cached + '.tmp',"dataset",mode="w",format="fixed")
+    os.rename(cached + '.tmp', cached)
+    link_cached(cached, outputFile)
+    with open(outputConfig, 'w') as outfile:
         json.dump(tagger_features, outfile)
     return 0
 
@@ -22,7 +22,7 @@ import root_numpy
 import matplotlib.pyplot as plt
 
 # Project import(s)
-from adversarial.utils import parse_args, initialise, mkdir, load_data, get_decorrelation_variables
+from adversarial.utils import parse_args, initialise, mkdir, load_data, get_decorrelation_variables, load_scaler
 from adversarial.layers import PosteriorLayer
 from adversarial.profile import profile, Profile
 from adversarial.constants import *
@@ -59,7 +59,18 @@ def main (args):
     else:
         print "Not found ",tempFile,"please run study_A first!"
         return -1
-    decorrelation = get_decorrelation_variables(data) #mass or log mass ?????!
+
+    # Scale decorrelation variables as seen by the adversary during training
+    lambda_reg = cfg['combined']['model']['lambda_reg']
+    digits = int(np.ceil(max(-np.log10(lambda_reg), 0)))
+    lambda_str = '{l:.{d:d}f}'.format(d=digits, l=lambda_reg).replace('.', 'p')
+    try:
+        scaler = load_scaler('models/adversarial/adversary/full/', 'adversary_lambda{}'.format(lambda_str))
+    except IOError:
+        print "No decorrelation scaler found for lambda = {}; fitting on study data.".format(lambda_reg)
+        scaler = None
+        pass
+    decorrelation = get_decorrelation_variables(data, scaler) #mass or log mass ?????!
     # H_prior = entropy(decorrelation, weights=data['weight_adv'])
     H_prior = entropy(decorrelation)
     print "Entropy of prior: {}".format(H_prior)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test the vectorised `unravel` against the previous per-event loop."""
+
+# Basic import(s)
+import numpy as np
+import numpy.lib.recfunctions as rfn
+
+# Project import(s)
+from prepro.common import unravel
+
+
+def unravel_loop (data, nleading=0):
+    """
+    Reference implementation: the per-event loop previously used in
+    `prepro/converterROOT.py`, cf. `unravel`.
+    """
+
+    if not data.dtype.hasobject:
+        return data
+
+    if nleading == 0:
+        nleading = 99999
+        pass
+
+    # Identify variable-length (i.e. per-jet) and scalar (i.e. per-event)
+    # fields
+    jet_fields   = sorted([field for field, (kind, _) in data.dtype.fields.iteritems() if kind.hasobject])
+    event_fields = sorted([field for field in data.dtype.names if field not in jet_fields])
+
+    # Loop events, take up to `nleading` jets from each
+    data_events = data[event_fields]
+    data_jets   = data[jet_fields]
+
+    rows = list()
+    for jets, event in zip(data_jets, data_events):
+        for jet in np.array(jets.tolist()).T[:nleading]:
+            row = np.array([event], dtype=data_events.dtype)
+            row = rfn.append_fields(row, jet_fields, [[value] for value in jet.tolist()], usemask=False)
+            rows.append(row)
+            pass
+        pass
+
+    return np.concatenate(rows)
+
+
+def make_data (counts, seed=21):
+    """
+    Make a jagged recarray, as read by `root_numpy`, with the given number of
+    jets in each event.
+    """
+
+    rng = np.random.RandomState(seed)
+    dtype = [('eventNumber', np.int64), ('weight', np.float64),
+             ('fjet_pt', object), ('fjet_m', object), ('fjet_nConst', object)]
+    data = np.zeros((len(counts),), dtype=dtype)
+    data['eventNumber'] = np.arange(len(counts)) + 1000
+    data['weight']      = rng.rand(len(counts))
+    for ievent, count in enumerate(counts):
+        data['fjet_pt']    [ievent] = rng.rand(count).astype(np.float32) * 1000.
+        data['fjet_m']     [ievent] = rng.rand(count).astype(np.float32) * 300.
+        data['fjet_nConst'][ievent] = rng.randint(1, 100, size=count).astype(np.int32)
+        pass
+    return data
+
+
+def check_equal (output, reference):
+    """Check that the two unravelled arrays hold the same rows, in order."""
+    assert output.dtype.names == reference.dtype.names
+    assert output.shape == reference.shape
+    for field in output.dtype.names:
+        # The loop upcasts all per-jet fields to a common dtype
+        assert np.array_equal(output[field].astype(reference[field].dtype), reference[field]), field
+        pass
+    return
+
+
+def test_unravel_random ():
+    counts = np.random.RandomState(7).poisson(2.5, size=500)
+    data   = make_data(counts)
+    for nleading in [0, 1, 2, 3, 10]:
+        check_equal(unravel(data, nleading), unravel_loop(data, nleading))
+        pass
+    return
+
+
+def test_unravel_empty_events ():
+    # Events without jets, including the first and last ones
+    counts = [0, 3, 0, 0, 1, 5, 2, 0]
+    data   = make_data(counts)
+    for nleading in [0, 1, 2]:
+        output = unravel(data, nleading)
+        check_equal(output, unravel_loop(data, nleading))
+        assert 1000 not in output['eventNumber']
+        assert 1007 not in output['eventNumber']
+        pass
+    return
+
+
+def test_unravel_nleading_zero ():
+    # `nleading=0` takes all jets in each event
+    counts = [4, 1, 0, 7]
+    data   = make_data(counts)
+    output = unravel(data, nleading=0)
+    check_equal(output, unravel_loop(data, nleading=0))
+    assert output.shape[0] == sum(counts)
+    assert np.array_equal(np.bincount(output['eventNumber'] - 1000, minlength=len(counts)), counts)
+    return
+
+
+def test_unravel_no_jets ():
+    # The loop cannot handle inputs without any jets; the output should be
+    # empty, with the same fields as otherwise.
+    data   = make_data([0, 0, 0])
+    output = unravel(data)
+    assert output.shape == (0,)
+    assert output.dtype.names == ('eventNumber', 'weight', 'fjet_m', 'fjet_nConst', 'fjet_pt')
+
+    # Per-jet fields have the element type of their branch
+    assert output.dtype == unravel(make_data([0, 2, 0])).dtype
+    assert output.dtype['fjet_pt']     == np.float32
+    assert output.dtype['fjet_nConst'] == np.int32
+    return
+
+
+def test_unravel_flat ():
+    # Flat inputs are returned unchanged
+    data = np.zeros((5,), dtype=[('a', np.float32), ('b', np.int32)])
+    assert unravel(data) is data
+    return